@@ -113,7 +113,10 @@ async def app_chat(app_id: int, payload: AgentChatRequest):
             mcp_servers=mcp_servers,
             model_config=payload.llm_config,
             knowledge_base_ids=payload.knowledge_base_ids,
-            knowledge_settings=payload.knowledge_settings
+            knowledge_settings=payload.knowledge_settings,
+            tool_result_max_chars=wf.graph.get("tool_result_max_chars"),
+            tool_context_budget=wf.graph.get("tool_context_budget"),
+            stable_prompt_prefix=wf.graph.get("stable_prompt_prefix")
         ):
             # 添加 conversation_id 到响应中
             item["conversation_id"] = conversation_id
@@ -6,3 +6,20 @@ router = APIRouter()
 @router.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+@router.get("/health/cache")
+async def cache_stats():
+    """各级缓存的命中统计（当前进程，未启用的缓存为 null）"""
+    from core.rag.embedding_cache import get_embedding_cache, get_query_embedding_cache
+    from core.rag.retrieval_cache import get_retrieval_cache
+    from core.tools.cache import get_tool_cache
+
+    embedding_cache = get_embedding_cache()
+    retrieval_cache = get_retrieval_cache()
+    return {
+        "tool": get_tool_cache().stats.to_dict(),
+        "query_embedding": get_query_embedding_cache().stats.to_dict(),
+        "embedding": embedding_cache.stats.to_dict() if embedding_cache else None,
+        "retrieval": retrieval_cache.stats.to_dict() if retrieval_cache else None,
+    }
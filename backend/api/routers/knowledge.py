@@ -6,20 +6,30 @@
 Author: chunlin
 """
 
+import asyncio
 import json
-from typing import Optional, List
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, List, Dict
 from datetime import datetime
 
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 import logging
 
+from configs import get_settings
 from database.models import KnowledgeBase, Document, DocumentSegment, ModelProvider
 from core.rag.chunker import DocumentChunker
 from core.rag.embedding import EmbeddingService
-from core.rag.db_conn import get_weaviate_client
-from core.rag.retriever import WeaviateHybridRetriever, RetrievalMode
-from core.rag.reranker import DashScopeReranker
+from core.rag.embedding_cache import get_query_embedding_cache
+from core.rag.db_conn import get_vector_store, kb_collection_name
+from core.rag.weaviate_client import build_vector_index_config
+from core.rag.retriever import WeaviateHybridRetriever, RetrievalMode, get_knowledge_base_retriever
+from core.rag.retrieval_cache import bump_index_version
+from core.rag.reranker import get_reranker
 # 在文件顶部添加日志配置
 logger = logging.getLogger(__name__)
 
@@ -36,6 +46,7 @@ class CreateKnowledgeBaseRequest(BaseModel):
     rerank_provider: Optional[str] = None
     rerank_model: Optional[str] = None
     retrieval_mode: str = "hybrid"  # semantic, keyword, hybrid
+    indexing_config: Optional[dict] = None  # 索引配置（向量索引类型、压缩、dimensions 等）
 
 
 class KnowledgeBaseResponse(BaseModel):
@@ -75,6 +86,34 @@ class QueryResponse(BaseModel):
     total: int
 
 
+class BatchQueryRequest(BaseModel):
+    """批量检索请求（离线评测、批量补全）"""
+    queries: List[str] = Field(min_length=1, max_length=1000)
+    top_k: int = 5
+    retrieval_mode: Optional[str] = None  # 覆盖默认检索模式
+    alpha: float = 0.5
+    score_threshold: float = 0.0
+    rerank: bool = False
+    rerank_top_k: int = 3
+    filters: Optional[dict] = None
+    concurrency: int = Field(default=16, ge=1, le=64)  # 并发检索数
+
+
+class BatchQueryItem(BaseModel):
+    query: str
+    results: List[QueryResult]
+    total: int
+    error: Optional[str] = None
+    cached: bool = False  # 检索结果来自缓存
+    timing_ms: Dict[str, float]  # search / rerank
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryItem]
+    total: int
+    timing_ms: Dict[str, float]  # resolve / cache / embed / search / rerank / total
+
+
 class UpdateKnowledgeBaseRequest(BaseModel):
     """更新知识库请求"""
     name: Optional[str] = None
@@ -197,9 +236,67 @@ class HitTestingResponse(BaseModel):
 
 # ============== API 端点 ==============
 
+def _validate_indexing_config(indexing_config: Optional[dict]) -> None:
+    """校验索引配置，非法时返回 400"""
+    if not indexing_config:
+        return
+    dimensions = indexing_config.get("dimensions")
+    if dimensions is not None and (not isinstance(dimensions, int) or dimensions <= 0):
+        raise HTTPException(status_code=400, detail="dimensions 必须为正整数")
+    try:
+        build_vector_index_config(indexing_config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _remove_upload(doc: Document) -> None:
+    """删除文档的上传文件（早期版本上传的文档没有文件）"""
+    file_path = (doc.metadata or {}).get("file_path")
+    if file_path:
+        Path(file_path).unlink(missing_ok=True)
+
+
+async def _sync_document_status(kb: KnowledgeBase, doc: Document) -> None:
+    """
+    将文档的启用 / 归档状态同步到向量存储（检索时按这两个属性过滤）
+
+    对象的 enabled = 文档启用且分段启用，archived = 文档归档。
+    """
+    weaviate = get_vector_store()
+    collection_name = kb_collection_name(kb)
+    active = doc.enabled and not doc.archived
+    await weaviate.update_by_filter(
+        collection_name,
+        {"doc_id": str(doc.id)},
+        {"enabled": active, "archived": doc.archived}
+    )
+    if active:
+        disabled_seg_ids = await DocumentSegment.filter(
+            document_id=doc.id,
+            enabled=False
+        ).values_list("id", flat=True)
+        if disabled_seg_ids:
+            await weaviate.update_by_filter(
+                collection_name,
+                {"doc_id": str(doc.id), "segment_id": list(disabled_seg_ids)},
+                {"enabled": False}
+            )
+
+
+async def _sync_segment_status(kb: KnowledgeBase, doc: Document, seg: DocumentSegment) -> None:
+    """将分段的启用状态同步到向量存储"""
+    await get_vector_store().update_by_filter(
+        kb_collection_name(kb),
+        {"doc_id": str(doc.id), "segment_id": seg.id},
+        {"enabled": seg.enabled and doc.enabled and not doc.archived, "archived": doc.archived}
+    )
+
+
 @router.post("/datasets", response_model=KnowledgeBaseResponse)
 async def create_knowledge_base(payload: CreateKnowledgeBaseRequest):
     """创建知识库"""
+    _validate_indexing_config(payload.indexing_config)
+
     # 创建数据库记录
     kb = await KnowledgeBase.create(
         name=payload.name,
@@ -208,17 +305,16 @@ async def create_knowledge_base(payload: CreateKnowledgeBaseRequest):
         embedding_model=payload.embedding_model,
         rerank_provider=payload.rerank_provider,
         rerank_model=payload.rerank_model,
-        retrieval_mode=payload.retrieval_mode
+        retrieval_mode=payload.retrieval_mode,
+        indexing_config=payload.indexing_config
     )
 
     # 创建 Weaviate Collection
-    weaviate = get_weaviate_client()
-    collection_name = f"kb_{kb.id}"
+    weaviate = get_vector_store()
+    collection_name = kb_collection_name(kb)
 
-    try:
-        await weaviate.create_collection(collection_name)
-    finally:
-        weaviate.close()
+    # 全局单例，不要在这里关闭连接
+    await weaviate.create_collection(collection_name, kb.indexing_config)
 
     return KnowledgeBaseResponse(
         id=kb.id,
@@ -289,8 +385,8 @@ async def delete_knowledge_base(kb_id: int):
         raise HTTPException(status_code=404, detail="Knowledge base not found")
 
     # 删除 Weaviate Collection
-    weaviate = get_weaviate_client()
-    collection_name = f"kb_{kb_id}"
+    weaviate = get_vector_store()
+    collection_name = kb_collection_name(kb)
 
     try:
         await weaviate.delete_collection(collection_name)
@@ -305,6 +401,8 @@ async def delete_knowledge_base(kb_id: int):
         await DocumentSegment.filter(document_id=doc.id).delete()
     await Document.filter(knowledge_base_id=kb_id).delete()
     await kb.delete()
+    await bump_index_version(kb_id)
+    shutil.rmtree(Path(get_settings().upload_dir) / str(kb_id), ignore_errors=True)
 
     return {"deleted": True}
 
@@ -321,18 +419,21 @@ async def upload_document(
     if not kb:
         raise HTTPException(status_code=404, detail="Knowledge base not found")
 
-    # 读取文件内容
-    content = await file.read()
-    text = content.decode("utf-8")
+    # 文件流式写入上传目录，索引任务从文件流式分块，全文不进入内存和消息队列
+    upload_dir = Path(get_settings().upload_dir) / str(kb_id)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    file_path = upload_dir / f"{uuid.uuid4().hex}{Path(file.filename or '').suffix}"
+    with open(file_path, "wb") as out:
+        await run_in_threadpool(shutil.copyfileobj, file.file, out, 1 << 20)
 
-    # 创建文档记录
+    # 创建文档记录（字数由索引任务统计）
     doc = await Document.create(
         knowledge_base_id=kb_id,
         name=file.filename,
-        content=text,
-        metadata={"size": len(content), "type": file.content_type},
+        content="",
+        metadata={"size": file_path.stat().st_size, "type": file.content_type, "file_path": str(file_path)},
         status="indexing",
-        word_count=len(text),
+        word_count=0,
         segment_count=0
     )
 
@@ -342,12 +443,13 @@ async def upload_document(
     task = index_document_task.delay(
         document_id=doc.id,
         knowledge_base_id=kb_id,
-        content=text,
+        content=None,
         filename=file.filename,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         embedding_provider=kb.embedding_provider,
-        embedding_model=kb.embedding_model
+        embedding_model=kb.embedding_model,
+        file_path=str(file_path)
     )
 
     # 更新任务 ID
@@ -403,7 +505,7 @@ async def query_knowledge_base(kb_id: int, payload: QueryRequest):
         raise HTTPException(status_code=404, detail="Knowledge base not found")
 
     # 初始化服务
-    weaviate =get_weaviate_client()
+    weaviate = get_vector_store()
 
     # 获取 Provider 凭证
     api_key = None
@@ -418,13 +520,14 @@ async def query_knowledge_base(kb_id: int, payload: QueryRequest):
         provider=kb.embedding_provider,
         model=kb.embedding_model,
         api_key=api_key,
-        api_base=api_base
+        api_base=api_base,
+        dimensions=(kb.indexing_config or {}).get("dimensions")
     )
 
     # 确定检索模式
     mode_str = payload.retrieval_mode or kb.retrieval_mode
 
-    collection_name = f"kb_{kb_id}"
+    collection_name = kb_collection_name(kb)
 
     retriever = WeaviateHybridRetriever(
         weaviate_client=weaviate,
@@ -434,7 +537,8 @@ async def query_knowledge_base(kb_id: int, payload: QueryRequest):
         top_k=payload.top_k,
         alpha=payload.alpha,
         score_threshold=payload.score_threshold,
-        filters=payload.filters
+        filters=payload.filters,
+        knowledge_base_id=kb_id
     )
 
     try:
@@ -443,22 +547,8 @@ async def query_knowledge_base(kb_id: int, payload: QueryRequest):
 
         # Rerank
         if payload.rerank and results:
-            # 获取 Rerank Provider 凭证 (假设 rerank 目前都在 dashscope, 或者根据模型名推断，或者添加 rerank_provider 字段)
-            # 暂时假设 rerank model 也是从 ModelProvider 管理的，且目前只有 DashScope 支持 Rerank
-            # 如果 kb.rerank_model 存在，则尝试获取其 provider（或者统一用 dashscope）
-
-            rerank_api_key = None
-            if kb.rerank_model:
-                # 简单处理：假设 rerank model 都是 dashscope 提供的，除非有 rerank_provider 字段
-                # 由于 KnowledgeBase 暂时没加 rerank_provider，先尝试用 "dashscope" 获取凭证
-                provider_obj = await ModelProvider.get_or_none(name="dashscope")
-                if provider_obj:
-                    rerank_api_key = provider_obj.api_key
-
-            reranker = DashScopeReranker(
-                model_name=kb.rerank_model or "gte-rerank",
-                api_key=rerank_api_key
-            )
+            # 按知识库的 rerank_provider（dashscope / local / cascade）创建重排序器
+            reranker = await get_reranker(kb.rerank_provider, kb.rerank_model)
             docs_for_rerank = [
                 {"content": r.content, "metadata": r.metadata}
                 for r in results
@@ -473,51 +563,19 @@ async def query_knowledge_base(kb_id: int, payload: QueryRequest):
         else:
             candidates = results
 
-        # 过滤已禁用或归档的文档/分段
-        final_results = []
-        if candidates:
-            # 收集所有涉及的 ID
-            doc_ids = set()
-            seg_ids = set()
-            for r in candidates:
-                if d_id := r.metadata.get("doc_id"):
-                    doc_ids.add(int(d_id))
-                if s_id := r.metadata.get("segment_id"):
-                    seg_ids.add(int(s_id))
-
-            # 批量查询状态
-            # 1. 查找有效文档 (enabled=True, archived=False)
-            valid_docs = await Document.filter(
-                id__in=list(doc_ids),
-                knowledge_base_id=kb_id,
-                enabled=True,
-                archived=False
-            ).values_list("id", flat=True)
-            valid_doc_ids = set(valid_docs)
-
-            # 2. 查找有效分段 (enabled=True)
-            # 注意：如果 Weaviate 没存 segment_id，可能无法过滤分段级别，但在本系统中应该都存了
-            valid_segs = await DocumentSegment.filter(
-                id__in=list(seg_ids),
-                enabled=True
-            ).values_list("id", flat=True)
-            valid_seg_ids = set(valid_segs)
-
-            for r in candidates:
-                doc_id = int(r.metadata.get("doc_id", 0))
-                seg_id = int(r.metadata.get("segment_id", 0))
-
-                # 检查文档和分段是否有效
-                if doc_id in valid_doc_ids and seg_id in valid_seg_ids:
-                    final_results.append(QueryResult(
-                        content=r.content,
-                        score=r.score,
-                        doc_name=r.metadata.get("doc_name"),
-                        chunk_index=r.metadata.get("chunk_index", 0),
-                        metadata=r.metadata
-                    ))
-
-            # 3. 更新命中计数 (Async update)
+        # 已禁用或归档的文档/分段已由检索器在向量存储中过滤
+        final_results = [
+            QueryResult(
+                content=r.content,
+                score=r.score,
+                doc_name=r.metadata.get("doc_name"),
+                chunk_index=r.metadata.get("chunk_index", 0),
+                metadata=r.metadata
+            )
+            for r in candidates
+        ]
+        if final_results:
+            # 更新命中计数 (Async update)
             # 提取最终结果中的分段 ID
             hit_seg_ids = []
             for res in final_results:
@@ -537,6 +595,139 @@ async def query_knowledge_base(kb_id: int, payload: QueryRequest):
     )
 
 
+@router.post("/datasets/{kb_id}/batch-query", response_model=BatchQueryResponse)
+async def batch_query_knowledge_base(kb_id: int, payload: BatchQueryRequest):
+    """
+    批量检索知识库
+
+    一次解析知识库与检索器，先批量查询检索结果缓存，未命中的查询去重后通过一次批量
+    embed_queries 向量化（结果写入查询向量缓存，与单条检索共享），再并发检索，
+    返回每个查询的结果与各阶段耗时。
+    不更新分段命中计数（用于评测，不应影响统计）。
+    """
+    started = time.perf_counter()
+    timing: Dict[str, float] = {}
+
+    def _elapsed(since: float) -> float:
+        return round((time.perf_counter() - since) * 1000, 2)
+
+    # 1. 解析知识库与检索器（按知识库缓存）
+    stage = time.perf_counter()
+    kb, base_retriever = await get_knowledge_base_retriever(kb_id)
+    if not kb:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    update = {
+        "top_k": payload.top_k,
+        "alpha": payload.alpha,
+        "score_threshold": payload.score_threshold,
+        "filters": payload.filters,
+    }
+    if payload.retrieval_mode:
+        update["mode"] = payload.retrieval_mode
+    retriever = base_retriever.model_copy(update=update)
+    timing["resolve"] = _elapsed(stage)
+
+    # 2. 检索结果缓存（命中的查询跳过向量化与检索）
+    stage = time.perf_counter()
+    cache_entries = await retriever.cached_results_many(payload.queries)
+    pending = [i for i, (_, cached) in enumerate(cache_entries) if cached is None]
+    timing["cache"] = _elapsed(stage)
+
+    # 3. 批量向量化（查询向量缓存未命中的查询合并为一次批量请求，提供方批次切分在 embedder 内完成）
+    stage = time.perf_counter()
+    vectors: Dict[str, List[float]] = {}
+    if pending and RetrievalMode(retriever.mode) != RetrievalMode.KEYWORD:
+        unique_queries = list(dict.fromkeys(payload.queries[i] for i in pending))
+        try:
+            embedded = await get_query_embedding_cache().get_or_embed_many(
+                retriever.embedding_service, unique_queries
+            )
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Embedding failed: {e}")
+        vectors = dict(zip(unique_queries, embedded))
+    timing["embed"] = _elapsed(stage)
+
+    # 4. 并发检索
+    stage = time.perf_counter()
+    semaphore = asyncio.Semaphore(payload.concurrency)
+    item_timing: List[Dict[str, float]] = [{} for _ in payload.queries]
+
+    async def _search(index: int, query: str):
+        cache_key, cached = cache_entries[index]
+        if cached is not None:
+            item_timing[index]["search"] = 0.0
+            return cached
+        async with semaphore:
+            search_started = time.perf_counter()
+            try:
+                results = await retriever.retrieve_raw(query, query_vector=vectors.get(query), use_cache=False)
+            finally:
+                item_timing[index]["search"] = _elapsed(search_started)
+        await retriever.store_cached(cache_key, results)
+        return results
+
+    outcomes = await asyncio.gather(
+        *[_search(i, q) for i, q in enumerate(payload.queries)],
+        return_exceptions=True
+    )
+    timing["search"] = _elapsed(stage)
+
+    # 已禁用或归档的文档/分段已由检索器在向量存储中过滤
+    candidates_per_query = list(outcomes)
+
+    # 5. 可选 Rerank（并发）
+    stage = time.perf_counter()
+    if payload.rerank:
+        reranker = await get_reranker(kb.rerank_provider, kb.rerank_model)
+
+        async def _rerank(index: int, query: str, candidates):
+            if isinstance(candidates, BaseException) or not candidates:
+                return candidates
+            async with semaphore:
+                rerank_started = time.perf_counter()
+                try:
+                    reranked = await reranker.rerank(
+                        query=query,
+                        documents=[{"content": r.content, "metadata": r.metadata} for r in candidates],
+                        top_k=payload.rerank_top_k
+                    )
+                finally:
+                    item_timing[index]["rerank"] = _elapsed(rerank_started)
+                return reranked
+
+        candidates_per_query = await asyncio.gather(
+            *[_rerank(i, q, c) for i, (q, c) in enumerate(zip(payload.queries, candidates_per_query))],
+            return_exceptions=True
+        )
+    timing["rerank"] = _elapsed(stage)
+
+    items = []
+    for query, candidates, t, (_, cached) in zip(payload.queries, candidates_per_query, item_timing, cache_entries):
+        if isinstance(candidates, BaseException):
+            items.append(BatchQueryItem(query=query, results=[], total=0, error=str(candidates), timing_ms=t))
+            continue
+        results = [
+            QueryResult(
+                content=r.content,
+                score=r.score,
+                doc_name=r.metadata.get("doc_name"),
+                chunk_index=r.metadata.get("chunk_index", 0),
+                metadata=r.metadata
+            )
+            for r in candidates
+        ]
+        items.append(BatchQueryItem(
+            query=query,
+            results=results,
+            total=len(results),
+            cached=cached is not None,
+            timing_ms=t
+        ))
+
+    timing["total"] = _elapsed(started)
+    return BatchQueryResponse(results=items, total=len(items), timing_ms=timing)
+
+
 # ============== 知识库更新 API ==============
 
 @router.put("/datasets/{kb_id}", response_model=KnowledgeBaseDetailResponse)
@@ -545,6 +736,7 @@ async def update_knowledge_base(kb_id: int, payload: UpdateKnowledgeBaseRequest)
     kb = await KnowledgeBase.get_or_none(id=kb_id)
     if not kb:
         raise HTTPException(status_code=404, detail="Knowledge base not found")
+    old_collection = kb_collection_name(kb)
 
     # 更新字段
     if payload.name is not None:
@@ -561,11 +753,37 @@ async def update_knowledge_base(kb_id: int, payload: UpdateKnowledgeBaseRequest)
          kb.rerank_provider = payload.rerank_provider
     if payload.retrieval_mode is not None:
         kb.retrieval_mode = payload.retrieval_mode
+    index_changed = False
     if payload.indexing_config is not None:
+        _validate_indexing_config(payload.indexing_config)
+        old_config = kb.indexing_config or {}
+        if (
+            payload.indexing_config.get("dimensions") != old_config.get("dimensions")
+            and await Document.filter(knowledge_base_id=kb.id).exists()
+        ):
+            raise HTTPException(status_code=400, detail="知识库已有文档，修改向量维度需要重建索引")
+        index_changed = (
+            payload.indexing_config.get("vector_index") != old_config.get("vector_index")
+            or payload.indexing_config.get("compression") != old_config.get("compression")
+        )
         kb.indexing_config = payload.indexing_config
 
+    # 多租户模式下 embedding 模型 / 维度决定所属的共享 Collection
+    new_collection = kb_collection_name(kb)
+    if new_collection != old_collection and await Document.filter(knowledge_base_id=kb.id).exists():
+        raise HTTPException(status_code=400, detail="知识库已有文档，修改 embedding 模型需要重建索引")
+
     await kb.save()
 
+    if new_collection != old_collection:
+        weaviate = get_vector_store()
+        await weaviate.create_collection(new_collection, kb.indexing_config)
+        await weaviate.delete_collection(old_collection)
+    elif index_changed:
+        # 已存在的 Collection 只应用可在线修改的索引参数
+        weaviate = get_vector_store()
+        await weaviate.create_collection(new_collection, kb.indexing_config)
+
     # 统计
     doc_count = await Document.filter(knowledge_base_id=kb.id).count()
     docs = await Document.filter(knowledge_base_id=kb.id).all()
@@ -711,6 +929,11 @@ async def update_document(kb_id: int, doc_id: int, payload: UpdateDocumentReques
             doc.enabled = False  # 归档自动禁用
 
     await doc.save()
+    if payload.enabled is not None or payload.archived is not None:
+        kb = await KnowledgeBase.get_or_none(id=kb_id)
+        if kb:
+            await _sync_document_status(kb, doc)
+        await bump_index_version(kb_id)
 
     return DocumentResponse(
         id=doc.id,
@@ -739,14 +962,14 @@ async def batch_operate_documents(kb_id: int, payload: BatchDocumentRequest):
 
     if payload.action == "delete":
         # 需要清理 Weaviate 向量
-        weaviate = get_weaviate_client()
-        collection_name = f"kb_{kb_id}"
+        weaviate = get_vector_store()
+        collection_name = kb_collection_name(kb)
 
         for doc in docs:
             try:
                 # 1. 删除 Weaviate 向量 (Best Effort)
                 try:
-                    await weaviate.delete_by_filter(collection_name, {"doc_id": str(doc.id)})
+                    await weaviate.delete_documents(collection_name, {"doc_id": str(doc.id)})
                 except Exception as e:
                     logger.warning(f"Failed to delete vector for doc {doc.id}: {e}")
 
@@ -755,6 +978,7 @@ async def batch_operate_documents(kb_id: int, payload: BatchDocumentRequest):
 
                 # 3. 删除文档
                 await doc.delete()
+                _remove_upload(doc)
                 count += 1
             except Exception as e:
                 logger.error(f"Failed to delete document {doc.id}: {e}")
@@ -764,6 +988,7 @@ async def batch_operate_documents(kb_id: int, payload: BatchDocumentRequest):
             doc.archived = True
             doc.enabled = False
             await doc.save()
+            await _sync_document_status(kb, doc)
             count += 1
 
     elif payload.action == "enable":
@@ -771,30 +996,57 @@ async def batch_operate_documents(kb_id: int, payload: BatchDocumentRequest):
             if not doc.archived:
                 doc.enabled = True
                 await doc.save()
+                await _sync_document_status(kb, doc)
                 count += 1
 
     elif payload.action == "disable":
         for doc in docs:
             doc.enabled = False
             await doc.save()
+            await _sync_document_status(kb, doc)
             count += 1
 
+    if count:
+        await bump_index_version(kb_id)
+
     return {"action": payload.action, "count": count}
 
 
+@router.post("/datasets/{kb_id}/sync-status")
+async def sync_knowledge_base_status(kb_id: int):
+    """
+    将知识库全部文档 / 分段的启用、归档状态重新同步到向量存储
+
+    状态切换会实时同步；用于修复同步失败或早期版本切换时未同步的数据。
+    """
+    kb = await KnowledgeBase.get_or_none(id=kb_id)
+    if not kb:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    docs = await Document.filter(knowledge_base_id=kb_id).all()
+    for doc in docs:
+        await _sync_document_status(kb, doc)
+    await bump_index_version(kb_id)
+
+    return {"synced": len(docs)}
+
+
 @router.delete("/datasets/{kb_id}/documents/{doc_id}")
 async def delete_document(kb_id: int, doc_id: int):
     """删除文档"""
     doc = await Document.get_or_none(id=doc_id, knowledge_base_id=kb_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
+    kb = await KnowledgeBase.get_or_none(id=kb_id)
+    if not kb:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
 
     # 从 Weaviate 删除相关向量
-    weaviate =get_weaviate_client()
-    collection_name = f"kb_{kb_id}"
+    weaviate = get_vector_store()
+    collection_name = kb_collection_name(kb)
 
     try:
-        await weaviate.delete_by_filter(
+        await weaviate.delete_documents(
             collection_name=collection_name,
             filters={"doc_id": str(doc_id)}
         )
@@ -806,6 +1058,8 @@ async def delete_document(kb_id: int, doc_id: int):
     await DocumentSegment.filter(document_id=doc_id).delete()
     # 删除文档
     await doc.delete()
+    _remove_upload(doc)
+    await bump_index_version(kb_id)
 
     return {"deleted": True, "document_id": doc_id}
 
@@ -894,13 +1148,14 @@ async def update_segment(kb_id: int, doc_id: int, seg_id: int, payload: UpdateSe
                 # 1. 生成新的 Embedding
                 embedding_service = EmbeddingService(
                     provider=kb.embedding_provider,
-                    model=kb.embedding_model
+                    model=kb.embedding_model,
+                    dimensions=(kb.indexing_config or {}).get("dimensions")
                 )
-                new_vector = embedding_service.embed_query(payload.content)
+                new_vector = (await embedding_service.embed_documents([payload.content]))[0]
 
                 # 2. 更新 Weaviate
-                weaviate = get_weaviate_client()
-                collection_name = f"kb_{kb_id}"
+                weaviate = get_vector_store()
+                collection_name = kb_collection_name(kb)
 
                 try:
                     # 查找 UUID
@@ -933,6 +1188,12 @@ async def update_segment(kb_id: int, doc_id: int, seg_id: int, payload: UpdateSe
         seg.enabled = payload.enabled
 
     await seg.save()
+    if payload.enabled is not None:
+        kb = await KnowledgeBase.get_or_none(id=kb_id)
+        if kb:
+            await _sync_segment_status(kb, doc, seg)
+    if payload.content is not None or payload.enabled is not None:
+        await bump_index_version(kb_id)
 
     return SegmentResponse(
         id=seg.id,
@@ -956,15 +1217,16 @@ async def hit_testing(kb_id: int, payload: HitTestingRequest):
         raise HTTPException(status_code=404, detail="Knowledge base not found")
 
     # 初始化服务
-    weaviate = get_weaviate_client()
+    weaviate = get_vector_store()
     embedding = EmbeddingService(
         provider=kb.embedding_provider,
-        model=kb.embedding_model
+        model=kb.embedding_model,
+        dimensions=(kb.indexing_config or {}).get("dimensions")
     )
 
     mode_str = payload.retrieval_mode or kb.retrieval_mode
 
-    collection_name = f"kb_{kb_id}"
+    collection_name = kb_collection_name(kb)
 
     retriever = WeaviateHybridRetriever(
         weaviate_client=weaviate,
@@ -972,7 +1234,8 @@ async def hit_testing(kb_id: int, payload: HitTestingRequest):
         collection_name=collection_name,
         mode=mode_str,
         top_k=payload.top_k,
-        score_threshold=payload.score_threshold
+        score_threshold=payload.score_threshold,
+        knowledge_base_id=kb_id
     )
 
     # ✅ 修复：在 try 之前初始化变量，确保无论是否报错，变量都存在
@@ -990,8 +1253,7 @@ async def hit_testing(kb_id: int, payload: HitTestingRequest):
 
         # Rerank
         if payload.rerank and results:
-            from core.rag.reranker import DashScopeReranker
-            reranker = DashScopeReranker()
+            reranker = await get_reranker(kb.rerank_provider, kb.rerank_model)
             docs_for_rerank = [
                 {"content": r.content, "metadata": r.metadata}
                 for r in results
@@ -1015,50 +1277,19 @@ async def hit_testing(kb_id: int, payload: HitTestingRequest):
         else:
             candidates = results
 
-        # 过滤已禁用或归档的文档/分段
-        # 将 QueryResult 转换为 Candidates 以便统一过滤逻辑（这里可复用逻辑）
-        # 为简单起见，这里直接重写一遍过滤逻辑
-
-        final_results = []
-        if candidates:
-            doc_ids = set()
-            seg_ids = set()
-            for r in candidates:
-                if d_id := r.metadata.get("doc_id"):
-                    doc_ids.add(int(d_id))
-                if s_id := r.metadata.get("segment_id"):
-                    seg_ids.add(int(s_id))
-
-            # 1. 查找有效文档
-            valid_docs = await Document.filter(
-                id__in=list(doc_ids),
-                knowledge_base_id=kb_id,
-                enabled=True,
-                archived=False
-            ).values_list("id", flat=True)
-            valid_doc_ids = set(valid_docs)
-
-            # 2. 查找有效分段
-            valid_segs = await DocumentSegment.filter(
-                id__in=list(seg_ids),
-                enabled=True
-            ).values_list("id", flat=True)
-            valid_seg_ids = set(valid_segs)
-
-            for r in candidates:
-                doc_id = int(r.metadata.get("doc_id", 0))
-                seg_id = int(r.metadata.get("segment_id", 0))
-
-                if doc_id in valid_doc_ids and seg_id in valid_seg_ids:
-                    final_results.append(HitTestingResult(
-                        content=r.content,
-                        score=r.score,
-                        document_id=doc_id,
-                        document_name=r.metadata.get("doc_name", ""),
-                        segment_id=seg_id,
-                        position=r.metadata.get("chunk_index", 0),
-                        word_count=len(r.content)
-                    ))
+        # 已禁用或归档的文档/分段已由检索器在向量存储中过滤
+        final_results = [
+            HitTestingResult(
+                content=r.content,
+                score=r.score,
+                document_id=int(r.metadata.get("doc_id", 0)),
+                document_name=r.metadata.get("doc_name", ""),
+                segment_id=int(r.metadata.get("segment_id", 0)),
+                position=r.metadata.get("chunk_index", 0),
+                word_count=len(r.content)
+            )
+            for r in candidates
+        ]
     except Exception as e:
         print(f"Failed to retrieve documents: {e}")
 
@@ -38,6 +38,8 @@ class Settings(BaseSettings):
         alias="REDIS_URL"
     )
 
+    cache_redis_enabled: bool = Field(default=False, alias="CACHE_REDIS_ENABLED")
+
     # ============== LLM ==============
     dashscope_api_key: str = Field(default="sk-hLshRr7Ejn", alias="DASHSCOPE_API_KEY")
     dashscope_base_url: str = Field(
@@ -56,10 +58,79 @@ class Settings(BaseSettings):
     # ============== Weaviate ==============
     weaviate_url: str = Field(default="http://localhost:8080", alias="WEAVIATE_URL")
     weaviate_api_key: str = Field(default="weaviate-admin", alias="WEAVIATE_API_KEY")
+    weaviate_grpc_port: int = Field(default=50051, alias="WEAVIATE_GRPC_PORT")
+    weaviate_grpc_pool_size: int = Field(default=2, alias="WEAVIATE_GRPC_POOL_SIZE")  # 每个事件循环的 gRPC 通道数
+    weaviate_http_pool_connections: int = Field(default=20, alias="WEAVIATE_HTTP_POOL_CONNECTIONS")
+    weaviate_http_pool_maxsize: int = Field(default=100, alias="WEAVIATE_HTTP_POOL_MAXSIZE")
+    # 多租户：同一 embedding 模型 / 维度的知识库作为租户共享一个 Collection
+    weaviate_multi_tenancy: bool = Field(default=False, alias="WEAVIATE_MULTI_TENANCY")
+    weaviate_tenant_idle_hours: float = Field(default=72, alias="WEAVIATE_TENANT_IDLE_HOURS")
+    # 闲置租户的目标状态：offloaded（对象存储，需要 offload-s3 模块）/ inactive（本地磁盘）
+    weaviate_tenant_idle_status: str = Field(default="offloaded", alias="WEAVIATE_TENANT_IDLE_STATUS")
+    weaviate_tenant_offload_interval: int = Field(default=3600, alias="WEAVIATE_TENANT_OFFLOAD_INTERVAL")  # 秒
+
+    # ============== 向量存储 ==============
+    vector_store_backend: str = Field(default="weaviate", alias="VECTOR_STORE_BACKEND")  # weaviate/local
+    local_vector_store_path: str = Field(default="./data/vector_store", alias="LOCAL_VECTOR_STORE_PATH")
+    local_vector_index: str = Field(default="flat", alias="LOCAL_VECTOR_INDEX")  # flat/hnsw（需要 hnswlib）
+
+    # ============== 分块 ==============
+    chunker_workers: int = Field(default=0, alias="CHUNKER_WORKERS")  # 0 为全部 CPU 核，1 为单进程
+    chunker_section_size: int = Field(default=1_000_000, alias="CHUNKER_SECTION_SIZE")  # 流式分块的片段大小（字符）
+    upload_dir: str = Field(default="./data/uploads", alias="UPLOAD_DIR")  # 上传文档存放目录，API 与 Celery Worker 需共享
+    indexing_batch_size: int = Field(default=1024, alias="INDEXING_BATCH_SIZE")  # 索引任务每批向量化 / 写入的分块数（批内再按提供方上限打包请求）
 
     # ============== 向量化 ==============
     embedding_provider: str = Field(default="dashscope", alias="EMBEDDING_PROVIDER")
     embedding_model: str = Field(default="text-embedding-v3", alias="EMBEDDING_MODEL")
+    embedding_max_concurrency: int = Field(default=4, alias="EMBEDDING_MAX_CONCURRENCY")
+    embedding_cache_backend: str = Field(default="sqlite", alias="EMBEDDING_CACHE_BACKEND")  # none/sqlite/redis
+    embedding_cache_path: str = Field(default="./data/embedding_cache.sqlite3", alias="EMBEDDING_CACHE_PATH")
+    embedding_cache_dtype: str = Field(default="float16", alias="EMBEDDING_CACHE_DTYPE")  # float16/float32
+    embedding_cache_ttl: int = Field(default=0, alias="EMBEDDING_CACHE_TTL")  # 秒，redis 为键过期、sqlite 为未使用时长，0 表示不过期
+    embedding_cache_max_rows: int = Field(default=500_000, alias="EMBEDDING_CACHE_MAX_ROWS")  # 仅 sqlite，超出后按最近使用时间淘汰，0 表示不限
+    # 本地模型（sentence-transformers，CPU）
+    local_inference_workers: int = Field(default=1, alias="LOCAL_INFERENCE_WORKERS")
+    local_embedding_backend: str = Field(default="torch", alias="LOCAL_EMBEDDING_BACKEND")  # torch/onnx
+    local_embedding_device: str = Field(default="cpu", alias="LOCAL_EMBEDDING_DEVICE")
+    local_embedding_max_batch_size: int = Field(default=32, alias="LOCAL_EMBEDDING_MAX_BATCH_SIZE")
+    local_embedding_max_wait_ms: float = Field(default=5.0, alias="LOCAL_EMBEDDING_MAX_WAIT_MS")
+    query_embedding_cache_size: int = Field(default=2048, alias="QUERY_EMBEDDING_CACHE_SIZE")
+    query_embedding_cache_ttl: float = Field(default=600, alias="QUERY_EMBEDDING_CACHE_TTL")
+    # 检索结果缓存（进程内 LRU + Redis，按知识库索引版本失效；需要开启 CACHE_REDIS_ENABLED）
+    retrieval_cache_enabled: bool = Field(default=True, alias="RETRIEVAL_CACHE_ENABLED")
+    retrieval_cache_size: int = Field(default=4096, alias="RETRIEVAL_CACHE_SIZE")
+    retrieval_cache_ttl: int = Field(default=300, alias="RETRIEVAL_CACHE_TTL")
+    # 检索结果再按数据库状态校验启用 / 归档（每次检索多两次查询）；状态已通过 /sync-status 同步后无需开启
+    retrieval_verify_status: bool = Field(default=False, alias="RETRIEVAL_VERIFY_STATUS")
+
+    # ============== 重排序 ==============
+    dashscope_rerank_url: str = Field(
+        default="https://dashscope.aliyuncs.com/api/v1/services/rerank/text-rerank/text-rerank",
+        alias="DASHSCOPE_RERANK_URL"
+    )
+    rerank_batch_size: int = Field(default=100, alias="RERANK_BATCH_SIZE")  # 单次请求最多送审的文档数
+    rerank_max_concurrency: int = Field(default=4, alias="RERANK_MAX_CONCURRENCY")
+    rerank_timeout: float = Field(default=30.0, alias="RERANK_TIMEOUT")
+    # 本地 cross-encoder（rerank_provider=local / cascade）
+    local_rerank_model: str = Field(default="BAAI/bge-reranker-base", alias="LOCAL_RERANK_MODEL")
+    local_rerank_backend: str = Field(default="torch", alias="LOCAL_RERANK_BACKEND")  # torch/onnx
+    local_rerank_max_batch_size: int = Field(default=64, alias="LOCAL_RERANK_MAX_BATCH_SIZE")
+    local_rerank_max_wait_ms: float = Field(default=5.0, alias="LOCAL_RERANK_MAX_WAIT_MS")
+    rerank_cascade_candidates: int = Field(default=20, alias="RERANK_CASCADE_CANDIDATES")  # 级联模式交给远程模型的候选数
+
+    # ============== Agent ==============
+    agent_tool_concurrency: int = Field(default=4, alias="AGENT_TOOL_CONCURRENCY")
+    agent_tool_result_max_chars: int = Field(default=2000, alias="AGENT_TOOL_RESULT_MAX_CHARS")
+    agent_tool_context_budget: int = Field(default=8000, alias="AGENT_TOOL_CONTEXT_BUDGET")
+    agent_tool_result_compact_chars: int = Field(default=300, alias="AGENT_TOOL_RESULT_COMPACT_CHARS")
+    agent_stable_prompt_prefix: bool = Field(default=False, alias="AGENT_STABLE_PROMPT_PREFIX")
+
+    chat_message_flush_interval: float = Field(default=2.0, alias="CHAT_MESSAGE_FLUSH_INTERVAL")
+
+    # ============== MCP ==============
+    mcp_session_max_concurrency: int = Field(default=8, alias="MCP_SESSION_MAX_CONCURRENCY")
+    mcp_health_check_interval: float = Field(default=30.0, alias="MCP_HEALTH_CHECK_INTERVAL")
 
 
 @lru_cache
@@ -6,15 +6,18 @@ Agent 执行核心模块
 Author: chunlin
 """
 
+import asyncio
 import json
 import logging
 from collections.abc import AsyncGenerator
 from typing import Any, Dict, List, Optional
 
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import ToolException
 
+from configs import get_settings
 from core.llm import create_llm_instance
-from core.tools import resolve_tools
+from core.tools import resolve_tools, get_tool_cache
 from core.mcp import mcp_connection_manager
 
 logger = logging.getLogger(__name__)
@@ -26,8 +29,12 @@ async def _invoke_tool(tool_obj: Any, args: Dict[str, Any]) -> str:
     """
     try:
         # LangChain 所有工具都支持 ainvoke，内部会自动处理同步/异步
-        result = await tool_obj.ainvoke(args)
+        # 幂等工具的结果走缓存，失败不缓存
+        result = await get_tool_cache().invoke(tool_obj, args, lambda: tool_obj.ainvoke(args))
         return str(result)
+    except ToolException as e:
+        # 工具主动报告的失败，错误信息直接交给模型
+        return str(e)
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -47,6 +54,69 @@ async def _invoke_tool(tool_obj: Any, args: Dict[str, Any]) -> str:
             return f"工具 '{tool_name}' 执行失败: {error_msg}\nDebug Trace: {error_trace}"
 
 
+def _truncate_tool_result(content: str, limit: int, total_chars: Optional[int] = None) -> str:
+    """
+    截断过长的工具结果，保留开头部分并注明被截断的字符数
+
+    total_chars 为原始结果长度（content 已是截断后的正文时传入，保证注明的字符数准确）。
+    """
+    total = len(content) if total_chars is None else total_chars
+    if limit <= 0 or len(content) <= limit:
+        return content
+    return f"{content[:limit]}\n...[结果过长，已截断 {total - limit} 字符]"
+
+
+def _tool_message(
+    result: str,
+    limit: int,
+    tool_call_id: str,
+    name: Optional[str],
+    total_chars: Optional[int] = None
+) -> ToolMessage:
+    """
+    构造截断后的工具结果消息
+
+    additional_kwargs 记录原始长度与保留的正文长度，压缩时据此判断，
+    不会把截断提示计入长度而反复截断已压缩的结果。
+    """
+    total = len(result) if total_chars is None else total_chars
+    kept = min(len(result), limit) if limit > 0 else len(result)
+    return ToolMessage(
+        content=_truncate_tool_result(result, limit, total),
+        tool_call_id=tool_call_id,
+        name=name,
+        additional_kwargs={"result_chars": total, "kept_chars": kept},
+    )
+
+
+def _compact_tool_messages(messages: List[BaseMessage], budget: int, compact_chars: int) -> None:
+    """
+    压缩上下文中较早的工具结果，使所有工具结果的总长度不超过 budget。
+
+    从最早的工具结果开始压缩到 compact_chars，最近一轮（最后一条 AIMessage 之后）
+    的工具结果保持不变，因为模型马上要基于它们继续推理。
+    """
+    if budget <= 0:
+        return
+
+    last_ai = max((i for i, m in enumerate(messages) if isinstance(m, AIMessage)), default=-1)
+    total = sum(len(m.content) for m in messages if isinstance(m, ToolMessage))
+
+    for i, msg in enumerate(messages[:last_ai]):
+        if total <= budget:
+            break
+        if not isinstance(msg, ToolMessage):
+            continue
+        # 按保留的正文长度判断（不含截断提示），已压缩的结果不会再次被截断
+        kept = msg.additional_kwargs.get("kept_chars", len(msg.content))
+        if kept <= compact_chars:
+            continue
+        result_chars = msg.additional_kwargs.get("result_chars", len(msg.content))
+        compacted = _tool_message(msg.content[:kept], compact_chars, msg.tool_call_id, msg.name, result_chars)
+        total -= len(msg.content) - len(compacted.content)
+        messages[i] = compacted
+
+
 async def _retrieve_from_knowledge_bases(
     kb_ids: List[int],
     query: str,
@@ -61,6 +131,9 @@ async def _retrieve_from_knowledge_bases(
     """
     从多个知识库中检索相关内容。
 
+    同一 (provider, model) 的知识库共享一次查询 embedding，各知识库并发检索，
+    结果通过 RRF 融合排序。
+
     Args:
         kb_ids: 知识库 ID 列表
         query: 用户查询
@@ -73,60 +146,83 @@ async def _retrieve_from_knowledge_bases(
         格式化的检索结果文本
     """
     from database.models import KnowledgeBase, ModelProvider
-    from core.rag.db_conn import get_weaviate_client
-    from core.rag.retriever import WeaviateHybridRetriever, RetrievalMode
+    from core.rag.db_conn import get_vector_store, kb_collection_name
+    from core.rag.retriever import WeaviateHybridRetriever, reciprocal_rank_fusion
     from core.rag.embedding import EmbeddingService
 
-    all_results = []
+    kbs = await KnowledgeBase.filter(id__in=kb_ids)
+    if not kbs:
+        return ""
 
-    for kb_id in kb_ids:
+    # 一次性加载所有涉及的 embedding 凭证
+    provider_names = {kb.embedding_provider for kb in kbs}
+    providers = {p.name: p for p in await ModelProvider.filter(name__in=list(provider_names))}
+
+    # 按 (provider, model, dimensions) 分组，同组知识库共享同一个 EmbeddingService；
+    # 查询向量在检索器内按需计算（检索结果缓存命中时跳过），并发的相同查询由
+    # QueryEmbeddingCache 合并为一次请求
+    groups: Dict[tuple, List[Any]] = {}
+    for kb in kbs:
+        if kb.embedding_provider not in providers:
+            logger.warning(f"知识库 {kb.name} 的 embedding provider 未配置")
+            continue
+        dimensions = (kb.indexing_config or {}).get("dimensions")
+        groups.setdefault((kb.embedding_provider, kb.embedding_model, dimensions), []).append(kb)
+
+    client = get_vector_store()
+
+    async def _search(kb, embedding_svc):
+        retriever = WeaviateHybridRetriever(
+            weaviate_client=client,
+            collection_name=kb_collection_name(kb),
+            embedding_service=embedding_svc,
+            mode=retrieval_mode,
+            top_k=top_k,
+            alpha=0.5,
+            score_threshold=score_threshold,
+            knowledge_base_id=kb.id
+        )
+        results = await retriever.retrieve_raw(query)
+        for r in results:
+            r.metadata["kb_name"] = kb.name
+        return results
+
+    search_kbs = []
+    search_tasks = []
+    for (provider_name, model, dimensions), group in groups.items():
+        provider_obj = providers[provider_name]
         try:
-            kb = await KnowledgeBase.get_or_none(id=kb_id)
-            if not kb:
-                continue
-
-            # 获取 embedding 凭证
-            provider_obj = await ModelProvider.get_or_none(name=kb.embedding_provider)
-            if not provider_obj:
-                logger.warning(f"知识库 {kb.name} 的 embedding provider 未配置")
-                continue
-
-            # 创建 embedding 服务
             embedding_svc = EmbeddingService(
-                provider=kb.embedding_provider,
-                model=kb.embedding_model,
+                provider=provider_name,
+                model=model,
                 api_key=provider_obj.api_key,
-                api_base=provider_obj.api_base
+                api_base=provider_obj.api_base,
+                dimensions=dimensions
             )
-
-            # 创建检索器
-            client = get_weaviate_client()
-            retriever = WeaviateHybridRetriever(
-                weaviate_client=client,
-                collection_name=f"kb_{kb_id}",
-                embedding_service=embedding_svc,
-                mode=retrieval_mode,
-                top_k=top_k,
-                alpha=0.5,
-                score_threshold=score_threshold
-            )
-
-            # 检索
-            results = await retriever.retrieve_raw(query)
-
-            for r in results:
-                all_results.append({
-                    "kb_name": kb.name,
-                    "content": r.content,
-                    "score": r.score or 0
-                })
-
         except Exception as e:
-            logger.error(f"知识库 {kb_id} 检索失败: {e}")
+            logger.error(f"初始化 embedding 失败 {(provider_name, model, dimensions)}: {e}")
             continue
-
-    # 按分数排序并格式化输出
-    all_results.sort(key=lambda x: x.get("score", 0), reverse=True)
+        for kb in group:
+            search_kbs.append(kb)
+            search_tasks.append(_search(kb, embedding_svc))
+
+    # 并发检索所有知识库
+    ranked_lists = []
+    for kb, outcome in zip(search_kbs, await asyncio.gather(*search_tasks, return_exceptions=True)):
+        if isinstance(outcome, BaseException):
+            logger.error(f"知识库 {kb.id} 检索失败: {outcome}")
+            continue
+        ranked_lists.append(outcome)
+
+    # 不同知识库 / 检索模式的原始分数不可直接比较，使用 RRF 融合排序
+    all_results = [
+        {
+            "kb_name": r.metadata.get("kb_name", ""),
+            "content": r.content,
+            "score": r.score
+        }
+        for r in reciprocal_rank_fusion(ranked_lists)
+    ]
 
     if not all_results:
         return ""
@@ -134,20 +230,11 @@ async def _retrieve_from_knowledge_bases(
     # 如果启用了 rerank 且有 rerank 配置，进行重排序
     if rerank_enabled and all_results:
         try:
-            from core.rag.reranker import DashScopeReranker
-            from database.models import ModelProvider
-            
-            # 获取 rerank 供应商凭证（优先使用传入的配置，否则使用默认 dashscope）
-            provider_name = rerank_provider or "dashscope"
-            provider_obj = await ModelProvider.get_or_none(name=provider_name)
+            from core.rag.reranker import get_reranker
             
-            if provider_obj and rerank_model:
-                # 创建 reranker 实例
-                reranker = DashScopeReranker(
-                    model_name=rerank_model,
-                    top_n=rerank_top_k,
-                    api_key=provider_obj.api_key
-                )
+            if rerank_model or rerank_provider == "local":
+                # 创建 reranker 实例（dashscope / local / cascade，远程凭证来自 ModelProvider）
+                reranker = await get_reranker(rerank_provider, rerank_model, top_n=rerank_top_k)
                 
                 # 准备用于 rerank 的文档列表
                 documents = [{"content": r["content"], "metadata": {"kb_name": r["kb_name"]}} for r in all_results]
@@ -185,10 +272,38 @@ async def agent_stream(
     knowledge_base_ids: Optional[List[int]] = None,
     knowledge_settings: Optional[Dict[str, Any]] = None,
     max_iters: int = 8,
+    tool_concurrency: Optional[int] = None,
+    tool_result_max_chars: Optional[int] = None,
+    tool_context_budget: Optional[int] = None,
+    stable_prompt_prefix: Optional[bool] = None,
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """
     流式生成器，输出事件数据包。
+
+    同一轮 LLM 返回的多个工具调用会并发执行，并发上限由 tool_concurrency
+    指定（未指定时使用配置项 AGENT_TOOL_CONCURRENCY）。
+
+    工具调用在参数形成完整 JSON 且后续调用已开始（或流已结束）时即提前派发，
+    与 LLM 的剩余生成过程重叠执行；消息仍按调用顺序组装。
+
+    工具结果进入上下文前按 tool_result_max_chars 截断；所有工具结果的总长度
+    超过 tool_context_budget 时，较早的结果会被进一步压缩。完整结果只出现在
+    trace_result 事件中。
+
+    stable_prompt_prefix 开启时 system prompt 保持字节稳定（不拼接检索内容），
+    工具按名称排序，检索内容作为独立消息放在历史之后，以命中提供方的前缀缓存；
+    每轮的 token 用量（含 cached_tokens）记录在 assistant 消息的 metadata 中，
+    结束前输出汇总的 usage 事件。
     """
+    settings = get_settings()
+    concurrency = tool_concurrency or settings.agent_tool_concurrency
+    result_max_chars = tool_result_max_chars or settings.agent_tool_result_max_chars
+    context_budget = tool_context_budget or settings.agent_tool_context_budget
+    compact_chars = min(settings.agent_tool_result_compact_chars, result_max_chars)
+    stable_prefix = (
+        stable_prompt_prefix if stable_prompt_prefix is not None
+        else settings.agent_stable_prompt_prefix
+    )
     try:
         if not llm_config:
             raise ValueError("缺少 llm_config 参数。请在请求中提供模型配置。")
@@ -237,16 +352,22 @@ async def agent_stream(
 
         # 构建增强的 system prompt
         enhanced_prompt = system_prompt or ""
+        context_message: Optional[HumanMessage] = None
         if rag_context:
             # 有检索结果：让模型参考这些信息回答
-            enhanced_prompt = f"""{enhanced_prompt}
-
-## 相关参考资料
+            reference = f"""## 相关参考资料
 以下是从知识库中检索到的相关内容，请在回答时参考这些信息：
 
 {rag_context}
 
 请根据以上参考资料和你的知识来回答用户的问题。如果参考资料中没有相关信息，请基于你的知识回答。"""
+            if stable_prefix:
+                # 保持 system prompt 字节稳定，参考资料作为独立消息放在历史之后
+                context_message = HumanMessage(content=reference)
+            else:
+                enhanced_prompt = f"""{enhanced_prompt}
+
+{reference}"""
         elif knowledge_base_ids and len(knowledge_base_ids) > 0 and not kb_fallback_to_model:
             # 启用了知识库但没有检索到内容，且禁止使用模型知识回退
             # 直接返回固定消息，不调用 LLM（避免模型不遵守指示）
@@ -262,6 +383,9 @@ async def agent_stream(
         async with mcp_connection_manager(mcp_servers) as mcp_tools:
             # 合并工具
             tools = local_tools + mcp_tools
+            if stable_prefix:
+                # 工具 schema 顺序固定，避免 MCP 加载顺序变化破坏前缀缓存
+                tools = sorted(tools, key=lambda t: t.name)
 
             if tools:
                 llm_with_tools = llm.bind_tools(tools)
@@ -271,125 +395,193 @@ async def agent_stream(
             all_messages = messages.copy()
             if enhanced_prompt:
                 all_messages.insert(0, SystemMessage(content=enhanced_prompt))
+            if context_message is not None:
+                # 插入到历史之后、当前用户问题之前
+                last_human = max(
+                    (i for i, m in enumerate(all_messages) if isinstance(m, HumanMessage)),
+                    default=len(all_messages)
+                )
+                all_messages.insert(last_human, context_message)
+
+            # token 用量统计（含命中提供方前缀缓存的 token 数）
+            usage_totals = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+
+            tool_objs = {t.name: t for t in tools}
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def _run_tool_call(index: int, tc: Dict[str, Any]):
+                tool_obj = tool_objs.get(tc.get("name"))
+                if tool_obj is None:
+                    return index, f"工具 {tc.get('name')} 未找到"
+                async with semaphore:
+                    return index, await _invoke_tool(tool_obj, tc.get("args", {}))
 
             # ✅ 整个循环必须在 async with 内部！
             for iteration in range(max_iters):
                 # 流式调用 LLM
                 ai_msg_content = ""
+                usage = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
                 tool_calls_dict: Dict[int, Dict[str, Any]] = {}
-
-                async for chunk in llm_with_tools.astream(all_messages):
-                    # 文本内容
-                    if hasattr(chunk, "content") and chunk.content:
-                        ai_msg_content += chunk.content
-                        yield {"type": "text", "content": chunk.content}
-
-                    # 工具调用 - 使用 tool_call_chunks 来正确累积
-                    if hasattr(chunk, "tool_call_chunks") and chunk.tool_call_chunks:
-                        for tc_chunk in chunk.tool_call_chunks:
-                            idx = tc_chunk.get("index", 0)
-                            if idx not in tool_calls_dict:
-                                tool_calls_dict[idx] = {"name": "", "args": "", "id": ""}
-
-                            if tc_chunk.get("name"):
-                                tool_calls_dict[idx]["name"] += tc_chunk["name"]
-                            if tc_chunk.get("args"):
-                                tool_calls_dict[idx]["args"] += tc_chunk["args"]
-                            if tc_chunk.get("id"):
-                                tool_calls_dict[idx]["id"] += tc_chunk["id"]
-
-                    elif hasattr(chunk, "tool_calls") and chunk.tool_calls:
-                        logger.info(f"OpenAI Chunk has tool_calls: {chunk.tool_calls}")
-                        for i, tc in enumerate(chunk.tool_calls):
-                            if i not in tool_calls_dict:
-                                tool_calls_dict[i] = {"name": "", "args": "", "id": ""}
-                            if tc.get("name"):
-                                tool_calls_dict[i]["name"] = tc["name"]
-                            if tc.get("args"):
-                                tool_calls_dict[i]["args"] = tc["args"] if isinstance(tc["args"], str) else json.dumps(
-                                    tc["args"])
-                            if tc.get("id"):
-                                tool_calls_dict[i]["id"] = tc["id"]
-
-                # 解析累积的工具调用
-                ai_msg_tool_calls = []
-                logger.info(f"Accumulated tool_calls_dict: {tool_calls_dict}")
-                for idx in sorted(tool_calls_dict.keys()):
+                # 已提前派发的工具调用：index -> (解析后的调用, Task)
+                dispatched: Dict[int, tuple] = {}
+
+                def _dispatch(idx: int, final: bool) -> Optional[Dict[str, Any]]:
+                    """
+                    参数已是完整 JSON 时立即派发工具调用，返回对应的 trace 事件。
+                    final=True（流已结束）时无法解析的参数按空参数处理。
+                    """
                     tc_data = tool_calls_dict[idx]
-                    if tc_data["name"]:
-                        try:
-                            args = json.loads(tc_data["args"]) if tc_data["args"] else {}
-                        except json.JSONDecodeError:
-                            args = {}
-
-                        ai_msg_tool_calls.append({
-                            "name": tc_data["name"],
-                            "args": args,
-                            "id": tc_data["id"]
-                        })
-
-                # 构建完整的 AI 消息
-                ai_msg = AIMessage(content=ai_msg_content, tool_calls=ai_msg_tool_calls)
-                all_messages.append(ai_msg)
-
-                yield {
-                    "type": "message",
-                    "role": "assistant",
-                    "content": ai_msg_content,
-                    "tool_calls": ai_msg_tool_calls
-                }
-
-                # 如果没有工具调用，结束
-                if not ai_msg_tool_calls:
-                    break
-
-                # 执行工具调用
-                for tc in ai_msg_tool_calls:
-                    tool_name = tc.get("name")
-                    tool_args = tc.get("args", {})
-                    tool_id = tc.get("id", "")
-
-                    # 先查找工具对象
-                    tool_obj = None
-                    for t in tools:
-                        if t.name == tool_name:
-                            tool_obj = t
-                            break
-
+                    if idx in dispatched or not tc_data["name"]:
+                        return None
+                    try:
+                        args = json.loads(tc_data["args"]) if tc_data["args"] else {}
+                    except json.JSONDecodeError:
+                        if not final:
+                            return None
+                        args = {}
+
+                    tc = {"name": tc_data["name"], "args": args, "id": tc_data["id"]}
+                    dispatched[idx] = (tc, asyncio.create_task(_run_tool_call(idx, tc)))
+
+                    tool_obj = tool_objs.get(tc["name"])
                     # 获取 MCP 服务器名称（如果是 MCP 工具）
                     mcp_server_name = getattr(tool_obj, 'mcp_server_name', None) if tool_obj else None
-
-                    yield {
+                    return {
                         "type": "trace",
-                        "id": tool_id,
-                        "name": tool_name,
-                        "args": tool_args,
+                        "id": tc["id"],
+                        "name": tc["name"],
+                        "args": args,
                         "mcp_server": mcp_server_name  # 如果是 MCP 工具则返回服务器名称，否则为 None
                     }
 
-                    if tool_obj is None:
-                        result = f"工具 {tool_name} 未找到"
-                    else:
-                        result = await _invoke_tool(tool_obj, tool_args)
+                try:
+                    async for chunk in llm_with_tools.astream(all_messages):
+                        # 文本内容
+                        if hasattr(chunk, "content") and chunk.content:
+                            ai_msg_content += chunk.content
+                            yield {"type": "text", "content": chunk.content}
+
+                        usage_metadata = getattr(chunk, "usage_metadata", None)
+                        if usage_metadata:
+                            usage["input_tokens"] += usage_metadata.get("input_tokens", 0) or 0
+                            usage["output_tokens"] += usage_metadata.get("output_tokens", 0) or 0
+                            details = usage_metadata.get("input_token_details") or {}
+                            usage["cached_tokens"] += details.get("cache_read", 0) or 0
+
+                        ready: List[int] = []
+                        # 工具调用 - 使用 tool_call_chunks 来正确累积
+                        if hasattr(chunk, "tool_call_chunks") and chunk.tool_call_chunks:
+                            for tc_chunk in chunk.tool_call_chunks:
+                                idx = tc_chunk.get("index", 0)
+                                if idx not in tool_calls_dict:
+                                    tool_calls_dict[idx] = {"name": "", "args": "", "id": ""}
+
+                                if tc_chunk.get("name"):
+                                    tool_calls_dict[idx]["name"] += tc_chunk["name"]
+                                if tc_chunk.get("args"):
+                                    tool_calls_dict[idx]["args"] += tc_chunk["args"]
+                                if tc_chunk.get("id"):
+                                    tool_calls_dict[idx]["id"] += tc_chunk["id"]
+
+                        elif hasattr(chunk, "tool_calls") and chunk.tool_calls:
+                            logger.info(f"OpenAI Chunk has tool_calls: {chunk.tool_calls}")
+                            for i, tc in enumerate(chunk.tool_calls):
+                                if i not in tool_calls_dict:
+                                    tool_calls_dict[i] = {"name": "", "args": "", "id": ""}
+                                if tc.get("name"):
+                                    tool_calls_dict[i]["name"] = tc["name"]
+                                if tc.get("args"):
+                                    tool_calls_dict[i]["args"] = tc["args"] if isinstance(tc["args"], str) else json.dumps(
+                                        tc["args"])
+                                if tc.get("id"):
+                                    tool_calls_dict[i]["id"] = tc["id"]
+
+                        # 后一个 index 已开始，前面的调用不会再有增量（流式 tool_calls 可能只解析了
+                        # 部分参数，同样等后一个调用开始或流结束后才派发）
+                        if tool_calls_dict:
+                            latest = max(tool_calls_dict)
+                            ready = [i for i in tool_calls_dict if i < latest]
+
+                        # 提前派发已完整的工具调用，与剩余生成过程重叠执行
+                        for idx in sorted(ready):
+                            trace = _dispatch(idx, final=False)
+                            if trace:
+                                yield trace
+
+                    # 流结束：派发剩余的工具调用
+                    logger.info(f"Accumulated tool_calls_dict: {tool_calls_dict}")
+                    for idx in sorted(tool_calls_dict.keys()):
+                        trace = _dispatch(idx, final=True)
+                        if trace:
+                            yield trace
+
+                    # 按调用顺序整理工具调用
+                    order = sorted(dispatched.keys())
+                    ai_msg_tool_calls = [dispatched[idx][0] for idx in order]
+
+                    # 构建完整的 AI 消息
+                    ai_msg = AIMessage(content=ai_msg_content, tool_calls=ai_msg_tool_calls)
+                    all_messages.append(ai_msg)
+
+                    for key, value in usage.items():
+                        usage_totals[key] += value
+                    if usage["input_tokens"]:
+                        logger.info(
+                            f"LLM usage: input={usage['input_tokens']} "
+                            f"cached={usage['cached_tokens']} output={usage['output_tokens']}"
+                        )
 
                     yield {
-                        "type": "trace_result",
-                        "id": tool_id,
-                        "result": result
+                        "type": "message",
+                        "role": "assistant",
+                        "content": ai_msg_content,
+                        "tool_calls": ai_msg_tool_calls,
+                        "metadata": {"usage": usage}
                     }
 
-                    tool_msg = ToolMessage(content=result, tool_call_id=tool_id, name=tool_name)
+                    # 如果没有工具调用，结束
+                    if not ai_msg_tool_calls:
+                        break
+
+                    results: Dict[int, str] = {}
+                    # 按完成顺序推送 trace_result
+                    for next_done in asyncio.as_completed([dispatched[idx][1] for idx in order]):
+                        index, result = await next_done
+                        results[index] = result
+                        yield {
+                            "type": "trace_result",
+                            "id": dispatched[index][0].get("id", ""),
+                            "result": result
+                        }
+                finally:
+                    for _, task in dispatched.values():
+                        if not task.done():
+                            task.cancel()
+
+                # ToolMessage 必须按原始调用顺序追加
+                for idx, tc in zip(order, ai_msg_tool_calls):
+                    result = results[idx]
+                    tool_name = tc.get("name")
+                    tool_id = tc.get("id", "")
+
+                    # 进入上下文（以及持久化历史）的是截断后的结果
+                    tool_msg = _tool_message(result, result_max_chars, tool_id, tool_name)
+                    content = tool_msg.content
                     all_messages.append(tool_msg)
 
                     yield {
                         "type": "message",
                         "role": "tool",
-                        "content": result,
+                        "content": content,
                         "name": tool_name,
                         "tool_call_id": tool_id
                     }
 
+                # 下一轮调用前压缩较早的工具结果
+                _compact_tool_messages(all_messages, context_budget, compact_chars)
+
             # ✅ 循环结束后，仍在 async with 内
+            yield {"type": "usage", **usage_totals}
             yield {"type": "done"}
 
     except BaseException as e:
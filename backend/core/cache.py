@@ -0,0 +1,125 @@
+"""
+通用缓存组件
+
+提供进程内 LRU + TTL 缓存、可选的 Redis 二级缓存连接以及命中统计。
+工具结果缓存、向量缓存、检索结果缓存等均基于此模块。
+
+Author: chunlin
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from configs import get_settings
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    """缓存命中统计"""
+    hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.redis_hits + self.misses
+        return (self.hits + self.redis_hits) / total if total else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+        }
+
+
+class LRUCache:
+    """
+    进程内 LRU 缓存（支持按条目 TTL）
+
+    仅在单个事件循环内使用，不做线程同步。
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[Any, Tuple[Optional[float], Any]]" = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        expires_at, value = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Any) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_redis_client = None
+_redis_unavailable = False
+
+
+def get_redis():
+    """
+    获取共享的异步 Redis 客户端（懒加载单例）
+
+    未开启 CACHE_REDIS_ENABLED 或未安装 redis 包时返回 None，
+    调用方应退化为仅使用进程内缓存。
+    """
+    global _redis_client, _redis_unavailable
+
+    if _redis_client is not None or _redis_unavailable:
+        return _redis_client
+
+    settings = get_settings()
+    if not settings.cache_redis_enabled:
+        _redis_unavailable = True
+        return None
+
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        logger.warning("CACHE_REDIS_ENABLED 已开启，但未安装 redis 包，仅使用进程内缓存")
+        _redis_unavailable = True
+        return None
+
+    _redis_client = redis.from_url(settings.redis_url)
+    return _redis_client
+
+
+async def close_redis() -> None:
+    """关闭共享 Redis 客户端（服务关闭时调用）"""
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
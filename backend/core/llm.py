@@ -43,6 +43,8 @@ async def create_llm_instance(
         "openai_api_base": base_url,
         "model": model,
         "temperature": float(temperature),
+        # 流式输出时也返回 usage（含 cached tokens）
+        "stream_usage": True,
     }
     
     if max_tokens:
@@ -2,86 +2,258 @@
 MCP (Model Context Protocol) 核心适配模块
 
 利用 langchain-mcp-adapters 将外部 MCP 服务器工具集成到 LangChain 生态中。
-使用 AsyncExitStack 管理多个 MCP 连接的生命周期。
+使用进程级会话池复用 MCP 连接，工具目录在服务端通知变更前保持缓存。
 
 Author: chunlin
 """
 
+import asyncio
 import logging
+import time
 from contextlib import asynccontextmanager, AsyncExitStack
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
 
 from langchain_core.tools import BaseTool
+from mcp import types
 from mcp.client.session import ClientSession
 from mcp.client.sse import sse_client
 from langchain_mcp_adapters.tools import load_mcp_tools
 
+from configs import get_settings
+
 logger = logging.getLogger(__name__)
 
+
+class _LimitedSession:
+    """
+    ClientSession 代理
+
+    load_mcp_tools 生成的工具只依赖 session.call_tool / list_tools，
+    通过代理统一加上并发限制，并在连接断开时自动重连。
+    """
+
+    def __init__(self, pooled: "PooledMCPSession"):
+        self._pooled = pooled
+
+    async def call_tool(self, *args, **kwargs):
+        session = await self._pooled.ensure_connected()
+        async with self._pooled.semaphore:
+            return await session.call_tool(*args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self._pooled.session, item)
+
+
+class PooledMCPSession:
+    """
+    单个 MCP 服务器的常驻会话
+
+    sse_client / ClientSession 基于 anyio，必须在同一个 Task 中进入和退出，
+    因此连接由一个后台 Task 持有，调用方只通过 ClientSession 收发消息。
+    """
+
+    def __init__(self, url: str, max_concurrency: int, health_check_interval: float):
+        self.url = url
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.health_check_interval = health_check_interval
+        self.session: Optional[ClientSession] = None
+
+        self._proxy = _LimitedSession(self)
+        self._runner: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._connect_error: Optional[BaseException] = None
+        self._lock = asyncio.Lock()
+        self._last_checked = 0.0
+        self._tools: Optional[List[BaseTool]] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.session is not None and self._runner is not None and not self._runner.done()
+
+    async def _message_handler(self, message) -> None:
+        """服务端通知工具列表变更时，丢弃已缓存的工具目录"""
+        if isinstance(message, types.ServerNotification) and isinstance(
+            message.root, types.ToolListChangedNotification
+        ):
+            logger.info(f"MCP: {self.url} 工具列表已变更，清除缓存")
+            self._tools = None
+
+    async def _run(self) -> None:
+        """后台 Task：持有连接直到被关闭或连接断开"""
+        try:
+            async with sse_client(self.url, timeout=30, sse_read_timeout=60 * 60) as (read_stream, write_stream):
+                async with ClientSession(
+                    read_stream, write_stream, message_handler=self._message_handler
+                ) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._last_checked = time.monotonic()
+                    self._ready.set()
+                    await self._closing.wait()
+        except BaseException as e:
+            self._connect_error = e
+            if not isinstance(e, asyncio.CancelledError):
+                logger.warning(f"MCP: 与 {self.url} 的连接已断开: {e!r}")
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def _connect(self) -> None:
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._connect_error = None
+        self._runner = asyncio.create_task(self._run(), name=f"mcp-session:{self.url}")
+        await self._ready.wait()
+        if self.session is None:
+            raise ConnectionError(f"MCP: 无法连接至 {self.url}: {self._connect_error!r}")
+        logger.info(f"MCP: 已建立常驻连接 {self.url}")
+
+    async def _health_check(self) -> bool:
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=5)
+            self._last_checked = time.monotonic()
+            return True
+        except Exception as e:
+            logger.warning(f"MCP: {self.url} 健康检查失败，准备重连: {e!r}")
+            return False
+
+    async def ensure_connected(self) -> ClientSession:
+        """返回可用的 ClientSession，必要时进行健康检查或重连"""
+        async with self._lock:
+            if self.connected and time.monotonic() - self._last_checked > self.health_check_interval:
+                if not await self._health_check():
+                    await self._disconnect()
+            if not self.connected:
+                await self._disconnect()
+                self._tools = None
+                await self._connect()
+            return self.session
+
+    async def get_tools(self) -> List[BaseTool]:
+        """获取工具目录（缓存直到服务端通知变更或重连）"""
+        await self.ensure_connected()
+        if self._tools is None:
+            self._tools = await load_mcp_tools(self._proxy)
+        return self._tools
+
+    async def _disconnect(self) -> None:
+        if self._runner is None:
+            return
+        self._closing.set()
+        try:
+            await asyncio.wait_for(self._runner, timeout=5)
+        except BaseException:
+            self._runner.cancel()
+        self._runner = None
+        self.session = None
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._disconnect()
+            self._tools = None
+
+
+class MCPSessionPool:
+    """进程级 MCP 会话池，按服务器 URL 复用连接"""
+
+    def __init__(self, max_concurrency: int = 8, health_check_interval: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.health_check_interval = health_check_interval
+        self._sessions: Dict[str, PooledMCPSession] = {}
+
+    def get(self, url: str) -> PooledMCPSession:
+        pooled = self._sessions.get(url)
+        if pooled is None:
+            pooled = PooledMCPSession(url, self.max_concurrency, self.health_check_interval)
+            self._sessions[url] = pooled
+        return pooled
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for pooled in sessions:
+            try:
+                await pooled.close()
+            except Exception as e:
+                logger.warning(f"MCP: 关闭连接失败 {pooled.url}: {e}")
+
+
+_mcp_pool: Optional[MCPSessionPool] = None
+
+
+def get_mcp_pool() -> MCPSessionPool:
+    """获取全局 MCP 会话池（懒加载单例）"""
+    global _mcp_pool
+    if _mcp_pool is None:
+        settings = get_settings()
+        _mcp_pool = MCPSessionPool(
+            max_concurrency=settings.mcp_session_max_concurrency,
+            health_check_interval=settings.mcp_health_check_interval,
+        )
+    return _mcp_pool
+
+
+async def close_mcp_pool() -> None:
+    """关闭全局会话池（服务关闭时调用）"""
+    global _mcp_pool
+    if _mcp_pool is not None:
+        await _mcp_pool.close()
+        _mcp_pool = None
+
+
 @asynccontextmanager
 async def mcp_connection_manager(mcp_servers: List[Dict[str, Any]]) -> AsyncGenerator[List[BaseTool], None]:
     """
-    上下文管理器：管理多个 MCP 服务器连接并产生工具列表。
+    上下文管理器：从会话池获取多个 MCP 服务器的工具列表。
+
+    连接由进程级会话池持有，退出上下文时不会断开。
 
     server_config:
     {
         "url": "http://localhost:8000/sse",
-        "name": "Server Name"
+        "name": "Server Name",
+        "cache_ttl": 60  # 可选：开启该服务器工具的结果缓存（秒）
     }
     """
     if not mcp_servers:
         yield []
         return
 
-    async with AsyncExitStack() as stack:
-        all_tools = []
+    pool = get_mcp_pool()
+    all_tools = []
 
-        for server in mcp_servers:
-            url = server.get("url")
-            name = server.get("name", "Unknown MCP")
-            print(url)
+    for server in mcp_servers:
+        url = server.get("url")
+        name = server.get("name", "Unknown MCP")
+        cache_ttl = server.get("cache_ttl")
 
-            if not url:
-                continue
+        if not url:
+            continue
 
-            try:
-                # 1. 建立 SSE 传输层连接
-                # 显式设置超时时间，防止长连接断开
-                # sse_client 是一个 async context manager，返回 (read_stream, write_stream)
-                read_stream, write_stream = await stack.enter_async_context(
-                    sse_client(url, timeout=30, sse_read_timeout=60 * 60)
-                )
-                
-                # 2. 初始化 ClientSession
-                # ClientSession 也是 async context manager
-                session = await stack.enter_async_context(ClientSession(read_stream, write_stream))
-
-                # 3. 初始化协议
-                await session.initialize()
-
-                # 4. 加载工具
-                # load_mcp_tools 需要传入 session 对象
-                tools = await load_mcp_tools(session)
-
-                # 5. 为每个工具添加 MCP 服务器名称元数据
-                for tool in tools:
-                    # 使用 object.__setattr__ 绕过 Pydantic 验证
-                    # 因为 StructuredTool 是 Pydantic 模型，不能直接设置任意属性
-                    object.__setattr__(tool, 'mcp_server_name', name)
-                
-                all_tools.extend(tools)
-                logger.info(f"MCP: 已连接至 {name}, 加载工具数: {len(tools)}")
+        try:
+            # 会话池中的工具实例被所有请求共享，元数据只写到本次的浅拷贝上
+            tools = [tool.model_copy() for tool in await pool.get(url).get_tools()]
 
-            except Exception as e:
-                logger.error(f"MCP: 连接服务器失败 {name} ({url})", exc_info=True)
-                if hasattr(e, 'exceptions'):
-                    for idx, sub_exc in enumerate(e.exceptions):
-                        logger.error(f"MCP Sub-exception {idx}: {sub_exc}")
-
-        # 将所有加载到的工具 yield 给调用方使用
-        # 连接会在退出此上下文时自动关闭
-        print(all_tools)
-        yield all_tools
+            # 为每个工具添加 MCP 服务器名称与地址元数据（地址用作工具结果缓存的命名空间）
+            for tool in tools:
+                # 使用 object.__setattr__ 绕过 Pydantic 验证
+                # 因为 StructuredTool 是 Pydantic 模型，不能直接设置任意属性
+                object.__setattr__(tool, 'mcp_server_name', name)
+                object.__setattr__(tool, 'mcp_server_url', url)
+                if cache_ttl is not None:
+                    object.__setattr__(tool, 'cache_ttl', cache_ttl)
+
+            all_tools.extend(tools)
+            logger.info(f"MCP: 已连接至 {name}, 加载工具数: {len(tools)}")
+
+        except Exception as e:
+            logger.error(f"MCP: 连接服务器失败 {name} ({url})", exc_info=True)
+            if hasattr(e, 'exceptions'):
+                for idx, sub_exc in enumerate(e.exceptions):
+                    logger.error(f"MCP Sub-exception {idx}: {sub_exc}")
+
+    yield all_tools
 
 
 async def fetch_mcp_tools(url: str) -> List[Dict[str, Any]]:
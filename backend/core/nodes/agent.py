@@ -29,6 +29,9 @@ async def execute_agent_node(
             "name": "gpt-4o-mini"
         },
         "max_iterations": 5,  # 最大迭代次数
+        "tool_result_max_chars": 2000,  # 可选：单条工具结果进入上下文的最大字符数
+        "tool_context_budget": 8000,  # 可选：上下文中工具结果的总字符预算
+        "stable_prompt_prefix": false,  # 可选：保持 system prompt 稳定以命中前缀缓存
         "knowledge_base_ids": [1, 2]  # 可选：关联知识库
     }
     """
@@ -43,6 +46,9 @@ async def execute_agent_node(
     max_iterations = node_data.get("max_iterations", 5)
     knowledge_base_ids = node_data.get("knowledge_base_ids", [])
     knowledge_settings = node_data.get("knowledge_settings", {})
+    tool_result_max_chars = node_data.get("tool_result_max_chars")
+    tool_context_budget = node_data.get("tool_context_budget")
+    stable_prompt_prefix = node_data.get("stable_prompt_prefix")
     
     # 解析变量
     query = resolve_variables(query_template, state)
@@ -83,7 +89,10 @@ async def execute_agent_node(
             llm_config=llm_config,
             knowledge_base_ids=knowledge_base_ids,
             knowledge_settings=knowledge_settings,
-            max_iters=max_iterations
+            max_iters=max_iterations,
+            tool_result_max_chars=tool_result_max_chars,
+            tool_context_budget=tool_context_budget,
+            stable_prompt_prefix=stable_prompt_prefix
         ):
             event_type = event.get("type")
             
@@ -1,9 +1,30 @@
 """知识库检索节点执行器
 
-从向量数据库检索相关文档（RAG）。
+从知识库（Weaviate / 本地向量存储）检索相关文档（RAG）。
 """
 
-from typing import Dict, Any, AsyncGenerator
+import asyncio
+import logging
+from typing import Dict, Any, AsyncGenerator, List
+
+from core.variable_resolver import resolve_variables
+
+logger = logging.getLogger(__name__)
+
+
+def _knowledge_base_ids(node_data: Dict[str, Any]) -> List[int]:
+    """兼容 dataset_ids（Dify 格式）、knowledgeBaseId（前端）和 knowledge_id（旧版）"""
+    ids = node_data.get("dataset_ids") or node_data.get("knowledge_base_ids")
+    if not ids:
+        single = node_data.get("knowledgeBaseId") or node_data.get("knowledge_id")
+        ids = [single] if single not in (None, "") else []
+    result = []
+    for kb_id in ids:
+        try:
+            result.append(int(kb_id))
+        except (TypeError, ValueError):
+            logger.warning(f"无效的知识库 ID: {kb_id}")
+    return result
 
 
 async def execute_knowledge_node(
@@ -14,67 +35,90 @@ async def execute_knowledge_node(
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """
     执行知识库检索节点：从向量库检索相关内容。
+
+    节点配置格式:
+    {
+        "query": "{{start.query}}",
+        "dataset_ids": [1, 2],        # 或 knowledgeBaseId / knowledge_id
+        "top_k": 3,                   # 或 topK
+        "score_threshold": 0.0,       # 或 threshold
+        "retrieval_mode": "hybrid",   # 可选，默认使用知识库配置
+        "rerank_enabled": true        # 知识库配置了 rerank 模型时生效
+    }
     """
-    from langchain_openai import OpenAIEmbeddings
-    from langchain_community.vectorstores import FAISS
-    import os
-    
-    query = node_data.get("query", "")
-    knowledge_id = node_data.get("knowledge_id", "")
-    top_k = node_data.get("top_k", 3)
-    
-    # 变量替换
-    for k, v in state["inputs"].items():
-        query = query.replace(f"{{{{{k}}}}}", str(v))
-    
-    for out_node_id, out_data in state["outputs"].items():
-        if isinstance(out_data, dict):
-            for out_key, out_val in out_data.items():
-                query = query.replace(f"{{{{{out_node_id}.{out_key}}}}}", str(out_val))
-    
+    from core.rag.retriever import get_knowledge_base_retriever, reciprocal_rank_fusion
+
+    query = resolve_variables(node_data.get("query", ""), state)
     if not query:
         query = state["inputs"].get("input", "")
-    
+
+    kb_ids = _knowledge_base_ids(node_data)
+    top_k = int(node_data.get("top_k") or node_data.get("topK") or 3)
+    score_threshold = float(node_data.get("score_threshold") or node_data.get("threshold") or 0.0)
+    retrieval_mode = node_data.get("retrieval_mode")
+    rerank_enabled = node_data.get("rerank_enabled", True)
+
+    async def _search(kb_id: int):
+        kb, retriever = await get_knowledge_base_retriever(kb_id)
+        if kb is None:
+            return None, []
+        update = {"top_k": top_k, "score_threshold": score_threshold}
+        if retrieval_mode:
+            update["mode"] = retrieval_mode
+        results = await retriever.model_copy(update=update).retrieve_raw(query)
+        return kb, results
+
     try:
-        # 加载向量库（简化版，实际应从数据库加载）
-        embeddings = OpenAIEmbeddings()
-        
-        # 尝试加载已保存的向量库
-        vector_store_path = f"./data/knowledge/{knowledge_id}"
-        
-        if os.path.exists(vector_store_path):
-            vectorstore = FAISS.load_local(
-                vector_store_path, 
-                embeddings,
-                allow_dangerous_deserialization=True
-            )
-            
-            # 检索
-            docs = vectorstore.similarity_search(query, k=top_k)
-            
-            results = [
-                {"content": doc.page_content, "metadata": doc.metadata}
-                for doc in docs
-            ]
-            
-            # 合并检索结果为上下文
-            context = "\n\n".join([doc.page_content for doc in docs])
-            
-            result = {
-                "context": context,
-                "documents": results,
-                "count": len(results)
-            }
-        else:
+        outcomes = await asyncio.gather(*[_search(kb_id) for kb_id in kb_ids], return_exceptions=True)
+
+        kbs = []
+        ranked_lists = []
+        missing = []
+        for kb_id, outcome in zip(kb_ids, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"知识库 {kb_id} 检索失败: {outcome}")
+                continue
+            kb, results = outcome
+            if kb is None:
+                missing.append(kb_id)
+                continue
+            kbs.append(kb)
+            ranked_lists.append(results)
+
+        if not kbs:
             result = {
                 "context": "",
                 "documents": [],
                 "count": 0,
-                "error": f"Knowledge base '{knowledge_id}' not found"
+                "error": f"Knowledge base '{', '.join(map(str, missing or kb_ids))}' not found"
+            }
+        else:
+            # 单个知识库保留原始分数，多个知识库用 RRF 融合
+            candidates = ranked_lists[0] if len(ranked_lists) == 1 else reciprocal_rank_fusion(ranked_lists)
+
+            # 已禁用或归档的文档/分段已由检索器在向量存储中过滤
+            # 重排序：使用第一个配置了 rerank 模型（或本地 rerank）的知识库
+            rerank_kb = next((kb for kb in kbs if kb.rerank_model or kb.rerank_provider == "local"), None)
+            documents = [{"content": r.content, "metadata": {**r.metadata, "score": r.score}} for r in candidates]
+            if rerank_enabled and rerank_kb and documents:
+                from core.rag.reranker import get_reranker
+
+                reranker = await get_reranker(rerank_kb.rerank_provider, rerank_kb.rerank_model, top_n=top_k)
+                reranked = await reranker.rerank(query=query, documents=documents, top_k=top_k)
+                documents = [
+                    {"content": rr.content, "metadata": {**rr.metadata, "score": rr.score}}
+                    for rr in reranked
+                ]
+
+            documents = documents[:top_k]
+            result = {
+                "context": "\n\n".join(d["content"] for d in documents),
+                "documents": documents,
+                "count": len(documents)
             }
     except Exception as e:
         result = {"error": str(e), "context": "", "documents": [], "count": 0}
-    
+
     state["outputs"][node_id] = result
     yield {
         "type": "result",
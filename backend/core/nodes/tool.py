@@ -9,6 +9,7 @@ Author: chunlin
 from typing import Dict, Any, AsyncGenerator
 from core.variable_resolver import resolve_variables
 from core.tools.registry import TOOL_REGISTRY
+from core.tools.cache import get_tool_cache
 
 
 async def execute_tool_node(
@@ -56,23 +57,26 @@ async def execute_tool_node(
         "parameters": resolved_params
     }
     
-    try:
-        # 调用工具
+    async def _call_tool():
         # LangChain 工具可通过 invoke 或 ainvoke 调用
         if hasattr(tool, "ainvoke"):
             # 异步调用
-            result = await tool.ainvoke(resolved_params)
+            return await tool.ainvoke(resolved_params)
         elif hasattr(tool, "invoke"):
             # 同步调用
-            result = tool.invoke(resolved_params)
+            return tool.invoke(resolved_params)
         elif hasattr(tool, "run"):
             # 旧版工具
-            result = tool.run(**resolved_params)
+            return tool.run(**resolved_params)
         elif callable(tool):
             # 普通函数
-            result = tool(**resolved_params)
+            return tool(**resolved_params)
         else:
             raise ValueError(f"工具 '{tool_name}' 不可调用")
+
+    try:
+        # 调用工具（幂等工具的结果走缓存）
+        result = await get_tool_cache().invoke(tool, resolved_params, _call_tool)
         
         # 标准化结果
         if isinstance(result, str):
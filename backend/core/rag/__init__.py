@@ -8,16 +8,27 @@ Author: chunlin
 
 from .chunker import DocumentChunker
 from .embedding import EmbeddingService
+from .vector_store import VectorStore, SearchResult
 from .weaviate_client import WeaviateClient
-from .retriever import WeaviateHybridRetriever, RetrievalMode
-from .reranker import DashScopeReranker, RerankResult
+from .local_store import LocalVectorStore
+from .retriever import WeaviateHybridRetriever, RetrievalMode, reciprocal_rank_fusion, get_knowledge_base_retriever
+from .reranker import BaseReranker, DashScopeReranker, LocalReranker, CascadeReranker, RerankResult, get_reranker
 
 __all__ = [
     "DocumentChunker",
     "EmbeddingService", 
+    "VectorStore",
+    "SearchResult",
     "WeaviateClient",
+    "LocalVectorStore",
     "WeaviateHybridRetriever",
     "RetrievalMode",
+    "reciprocal_rank_fusion",
+    "get_knowledge_base_retriever",
+    "BaseReranker",
     "DashScopeReranker",
+    "LocalReranker",
+    "CascadeReranker",
+    "get_reranker",
     "RerankResult",
 ]
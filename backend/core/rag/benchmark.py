@@ -0,0 +1,422 @@
+"""
+检索质量与延迟基准
+
+对标注查询集（查询 → 相关文档 / 分段 ID）运行 WeaviateHybridRetriever 与重排序器，
+输出 recall@k、MRR、nDCG@k，以及各阶段（embed / search / rerank / total）的
+p50 / p95 / p99 延迟。用于调整分块、检索模式、alpha、重排序与索引参数，
+并在上线前发现质量或性能回退。
+
+两种运行方式：
+
+1. 离线语料（不依赖数据库、Weaviate 与远程 API）：
+   从语料文件分块、向量化（默认本地 sentence-transformers 模型）后写入临时的
+   LocalVectorStore，再运行查询集。
+
+       cd backend
+       PYTHONPATH=. python -m core.rag.benchmark --corpus corpus.jsonl --queries queries.jsonl \\
+           --mode hybrid --alpha 0.5 --k 1,3,5,10 --rerank-provider local
+
+2. 已有知识库：使用知识库的检索器（embedding 配置、向量存储、默认检索模式）。
+   VECTOR_STORE_BACKEND=local 且知识库使用本地 embedding 时同样完全离线。
+
+       PYTHONPATH=. python -m core.rag.benchmark --kb-id 3 --queries queries.jsonl
+
+文件格式（JSON Lines）：
+- 语料：{"id": "doc-1", "content": "...", "name": "可选"}
+- 查询：{"query": "...", "relevant_doc_ids": ["doc-1"]}
+  或 {"query": "...", "relevant_segment_ids": [12, 15]}（仅知识库模式）；
+  相关 ID 也可以是 {id: 相关度等级} 字典，用于分级 nDCG
+
+说明：
+- 启用 / 归档状态过滤已下推到向量检索，计入 search 阶段，不单独计时
+  （开启 RETRIEVAL_VERIFY_STATUS 时的数据库校验同样计入 search 阶段）
+- 检索结果缓存不参与基准；查询向量会经过向量缓存，测量冷启动延迟时设置
+  EMBEDDING_CACHE_BACKEND=none
+- 文档级标注时，同一文档的多个分段只按首次出现计算排名
+
+Author: chunlin
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import math
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from configs import get_settings
+from .chunker import DocumentChunker
+from .embedding import EmbeddingService
+from .retriever import WeaviateHybridRetriever
+from .reranker import BaseReranker, get_reranker
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("embed", "search", "rerank", "total")
+
+
+@dataclass
+class LabeledQuery:
+    """标注查询"""
+    query: str
+    relevance: Dict[str, float]
+    id_field: str  # doc_id / segment_id
+
+
+@dataclass
+class QueryOutcome:
+    """单条查询的运行结果"""
+    query: str
+    ranked_ids: List[str]
+    timing_ms: Dict[str, float]
+    metrics: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_queries(path: str) -> List[LabeledQuery]:
+    """加载标注查询集"""
+    queries = []
+    for i, item in enumerate(_read_jsonl(path)):
+        if "relevant_segment_ids" in item:
+            id_field, labels = "segment_id", item["relevant_segment_ids"]
+        elif "relevant_doc_ids" in item:
+            id_field, labels = "doc_id", item["relevant_doc_ids"]
+        else:
+            raise ValueError(f"第 {i + 1} 条查询缺少 relevant_doc_ids / relevant_segment_ids")
+        if isinstance(labels, dict):
+            relevance = {str(k): float(v) for k, v in labels.items()}
+        else:
+            relevance = {str(k): 1.0 for k in labels}
+        queries.append(LabeledQuery(query=item["query"], relevance=relevance, id_field=id_field))
+    return queries
+
+
+# ============================
+# 指标
+# ============================
+
+def recall_at_k(ranked: List[str], relevance: Dict[str, float], k: int) -> float:
+    if not relevance:
+        return 0.0
+    return sum(1 for doc_id in ranked[:k] if doc_id in relevance) / len(relevance)
+
+
+def reciprocal_rank(ranked: List[str], relevance: Dict[str, float]) -> float:
+    for rank, doc_id in enumerate(ranked, 1):
+        if doc_id in relevance:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: List[str], relevance: Dict[str, float], k: int) -> float:
+    dcg = sum(
+        (2 ** relevance[doc_id] - 1) / math.log2(rank + 2)
+        for rank, doc_id in enumerate(ranked[:k])
+        if doc_id in relevance
+    )
+    ideal = sorted(relevance.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / idcg if idcg > 0 else 0.0
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "mean": round(float(np.mean(values)), 2),
+    }
+
+
+# ============================
+# 运行
+# ============================
+
+def _ranked_ids(results: List[Any], id_field: str) -> List[str]:
+    """结果映射为标注 ID（去重，保留首次出现的位置）"""
+    ranked: List[str] = []
+    seen = set()
+    for r in results:
+        doc_id = str(r.metadata.get(id_field, ""))
+        if doc_id not in seen:
+            seen.add(doc_id)
+            ranked.append(doc_id)
+    return ranked
+
+
+async def run_query(
+    retriever: WeaviateHybridRetriever,
+    reranker: Optional[BaseReranker],
+    item: LabeledQuery,
+    ks: List[int]
+) -> QueryOutcome:
+    """运行单条查询并计算指标"""
+    timing = {}
+    started = time.perf_counter()
+
+    query_vector = None
+    if retriever.mode != "keyword":
+        stage = time.perf_counter()
+        query_vector = await retriever.embedding_service.embed_query(item.query)
+        timing["embed"] = (time.perf_counter() - stage) * 1000
+
+    stage = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽检索器调试输出
+        results = await retriever.retrieve_raw(item.query, query_vector=query_vector, use_cache=False)
+    timing["search"] = (time.perf_counter() - stage) * 1000
+
+    if reranker is not None and results:
+        stage = time.perf_counter()
+        reranked = await reranker.rerank(
+            query=item.query,
+            documents=[{"content": r.content, "metadata": r.metadata} for r in results],
+            top_k=max(ks)
+        )
+        results = [results[rr.original_index] for rr in reranked]
+        timing["rerank"] = (time.perf_counter() - stage) * 1000
+
+    timing["total"] = (time.perf_counter() - started) * 1000
+
+    ranked = _ranked_ids(results, item.id_field)
+    metrics = {"mrr": reciprocal_rank(ranked, item.relevance)}
+    for k in ks:
+        metrics[f"recall@{k}"] = recall_at_k(ranked, item.relevance, k)
+        metrics[f"ndcg@{k}"] = ndcg_at_k(ranked, item.relevance, k)
+    return QueryOutcome(query=item.query, ranked_ids=ranked, timing_ms=timing, metrics=metrics)
+
+
+async def run_benchmark(
+    retriever: WeaviateHybridRetriever,
+    queries: List[LabeledQuery],
+    ks: List[int],
+    reranker: Optional[BaseReranker] = None,
+    concurrency: int = 1,
+    warmup: int = 0
+) -> Dict[str, Any]:
+    """
+    运行查询集，返回汇总报告
+
+    Args:
+        concurrency: 并发查询数（1 时延迟最稳定；更大时用于测量吞吐）
+        warmup: 预热查询数（加载本地模型、建立连接），不计入结果
+    """
+    for item in queries[:warmup]:
+        try:
+            await run_query(retriever, reranker, item, ks)
+        except Exception as e:
+            logger.warning(f"预热查询失败 {item.query!r}: {e}")
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(item: LabeledQuery) -> QueryOutcome:
+        async with semaphore:
+            try:
+                return await run_query(retriever, reranker, item, ks)
+            except Exception as e:
+                logger.warning(f"查询失败 {item.query!r}: {e}")
+                return QueryOutcome(query=item.query, ranked_ids=[], timing_ms={}, error=str(e))
+
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(*[_run(item) for item in queries])
+    elapsed = time.perf_counter() - started
+
+    succeeded = [o for o in outcomes if o.error is None]
+    metric_names = ["mrr"] + [f"{name}@{k}" for k in ks for name in ("recall", "ndcg")]
+    quality = {
+        name: round(float(np.mean([o.metrics[name] for o in succeeded])), 4) if succeeded else 0.0
+        for name in metric_names
+    }
+    latency = {
+        stage: _percentiles([o.timing_ms[stage] for o in succeeded if stage in o.timing_ms])
+        for stage in STAGES
+    }
+    return {
+        "config": {
+            "mode": retriever.mode,
+            "top_k": retriever.top_k,
+            "alpha": retriever.alpha,
+            "score_threshold": retriever.score_threshold,
+            "embedding": await retriever.embedding_service.get_cache_namespace(),
+            "reranker": type(reranker).__name__ if reranker else None,
+            "concurrency": concurrency,
+        },
+        "queries": len(queries),
+        "errors": len(outcomes) - len(succeeded),
+        "qps": round(len(queries) / elapsed, 2) if elapsed > 0 else 0.0,
+        "quality": quality,
+        "latency_ms": {stage: values for stage, values in latency.items() if values},
+        "details": [
+            {"query": o.query, "ranked_ids": o.ranked_ids, "metrics": o.metrics, "timing_ms": o.timing_ms, "error": o.error}
+            for o in outcomes
+        ],
+    }
+
+
+async def build_corpus_retriever(
+    corpus_path: str,
+    root: str,
+    embedding: EmbeddingService,
+    chunk_size: int = 500,
+    chunk_overlap: int = 50
+) -> Tuple[WeaviateHybridRetriever, Dict[str, Any]]:
+    """将语料分块、向量化后写入临时本地向量存储，返回检索器与建索引统计"""
+    from .local_store import LocalVectorStore
+
+    store = LocalVectorStore(root=root, index_type=get_settings().local_vector_index)
+    collection = "benchmark"
+    await store.create_collection(collection)
+
+    chunker = DocumentChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    objects = []
+    for doc in _read_jsonl(corpus_path):
+        doc_id = str(doc["id"])
+        for segment in chunker.chunk_document(doc.get("content", "")):
+            objects.append({
+                "content": segment.content,
+                "doc_id": doc_id,
+                "doc_name": doc.get("name", doc_id),
+                "chunk_index": segment.position,
+                "segment_id": len(objects) + 1,
+            })
+
+    started = time.perf_counter()
+    vectors = await embedding.embed_documents([o["content"] for o in objects])
+    embed_seconds = time.perf_counter() - started
+    await store.add_documents(collection, objects, vectors)
+
+    retriever = WeaviateHybridRetriever(
+        weaviate_client=store,
+        embedding_service=embedding,
+        collection_name=collection,
+    )
+    return retriever, {"segments": len(objects), "embed_seconds": round(embed_seconds, 2)}
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """格式化为终端输出"""
+    lines = [
+        f"配置: {json.dumps(report['config'], ensure_ascii=False)}",
+        f"查询: {report['queries']}  失败: {report['errors']}  QPS: {report['qps']}",
+    ]
+    if "index" in report:
+        lines.append(f"索引: {json.dumps(report['index'], ensure_ascii=False)}")
+    lines.append("")
+    lines.append("质量")
+    for name, value in report["quality"].items():
+        lines.append(f"  {name:<12} {value:.4f}")
+    lines.append("")
+    lines.append(f"延迟 (ms)      {'p50':>9} {'p95':>9} {'p99':>9} {'mean':>9}")
+    for stage, values in report["latency_ms"].items():
+        lines.append(
+            f"  {stage:<12} {values['p50']:>9.2f} {values['p95']:>9.2f} {values['p99']:>9.2f} {values['mean']:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="检索质量与延迟基准")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--corpus", help="离线语料（JSON Lines），建立临时本地向量存储")
+    source.add_argument("--kb-id", type=int, help="使用已有知识库")
+    parser.add_argument("--queries", required=True, help="标注查询集（JSON Lines）")
+    parser.add_argument("--k", default="1,3,5,10", help="评估的 k 值，逗号分隔")
+    parser.add_argument("--mode", choices=["semantic", "keyword", "hybrid"], help="检索模式")
+    parser.add_argument("--alpha", type=float, help="混合检索权重（0=BM25，1=向量）")
+    parser.add_argument("--top-k", type=int, help="检索数量（重排序前的候选数），默认为最大 k")
+    parser.add_argument("--score-threshold", type=float, default=0.0)
+    parser.add_argument("--rerank-provider", help="dashscope / local / cascade，不传则不重排序")
+    parser.add_argument("--rerank-model")
+    parser.add_argument("--embedding-provider", default="local", help="离线语料的 embedding 提供方")
+    parser.add_argument("--embedding-model", help="离线语料的 embedding 模型")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", help="完整报告（含逐条结果）写入的 JSON 文件")
+    return parser.parse_args(argv)
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    from .db_conn import close_vector_store_connections
+    from .local_inference import shutdown_inference_executor
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    queries = load_queries(args.queries)
+    update: Dict[str, Any] = {"top_k": args.top_k or max(ks), "score_threshold": args.score_threshold}
+    if args.mode:
+        update["mode"] = args.mode
+    if args.alpha is not None:
+        update["alpha"] = args.alpha
+
+    index_stats = None
+    db_ready = False
+    try:
+        with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as root:
+            if args.corpus:
+                embedding = EmbeddingService(provider=args.embedding_provider, model=args.embedding_model)
+                retriever, index_stats = await build_corpus_retriever(
+                    args.corpus, root, embedding, args.chunk_size, args.chunk_overlap
+                )
+            else:
+                from database.connection import init_db
+                from .retriever import get_knowledge_base_retriever
+
+                await init_db()
+                db_ready = True
+                kb, retriever = await get_knowledge_base_retriever(args.kb_id)
+                if kb is None:
+                    raise SystemExit(f"知识库 {args.kb_id} 不存在")
+
+            retriever = retriever.model_copy(update=update)
+            reranker = None
+            if args.rerank_provider:
+                reranker = await get_reranker(args.rerank_provider, args.rerank_model, top_n=max(ks))
+
+            try:
+                report = await run_benchmark(
+                    retriever, queries, ks,
+                    reranker=reranker,
+                    concurrency=args.concurrency,
+                    warmup=min(args.warmup, len(queries))
+                )
+            finally:
+                if args.corpus:
+                    await retriever.weaviate_client.aclose()
+            if index_stats:
+                report["index"] = index_stats
+            return report
+    finally:
+        await close_vector_store_connections()
+        shutdown_inference_executor()
+        if db_ready:
+            from database.connection import close_db
+            await close_db()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    args = _parse_args(argv)
+    report = asyncio.run(_main(args))
+    print(format_report(report))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,32 @@
 
 支持多种分块策略：固定大小、递归字符、语义分块。
 
+超大文档使用 DocumentChunker.iter_chunks 流式分块：按固定窗口读取文件 / 迭代器，
+在段落等分隔符处切成互不依赖的片段，交给进程池并行分块，按顺序惰性产出
+DocumentSegment，内存占用与文档大小无关。
+
 Author: chunlin
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, TextIO, Tuple, Union
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from collections import deque
 from dataclasses import dataclass
+from pathlib import Path
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+import atexit
 import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
 import uuid
 
+from configs import get_settings
+from .tokenizer import TokenCounter, get_token_counter
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class DocumentSegment:
@@ -37,10 +54,17 @@ class DocumentChunker:
         self,
         chunk_size: int = 500,
         chunk_overlap: int = 50,
-        separators: Optional[List[str]] = None
+        separators: Optional[List[str]] = None,
+        token_counter: Optional[TokenCounter] = None
     ):
+        """
+        Args:
+            token_counter: 计算分段 tokens 的计数器（通常来自知识库的 embedding 提供方 / 模型），
+                默认按字符类别估算
+        """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.token_counter = token_counter or get_token_counter()
         self.separators = separators or ["\n\n", "\n", "。", ".", " ", ""]
         
         self.splitter = RecursiveCharacterTextSplitter(
@@ -114,11 +138,211 @@ class DocumentChunker:
             all_segments.extend(segments)
         
         return all_segments
+
+    def iter_chunks(
+        self,
+        source: Union[str, Path, TextIO, Iterable[str]],
+        metadata: Optional[Dict[str, Any]] = None,
+        section_size: Optional[int] = None
+    ) -> Iterator[DocumentSegment]:
+        """
+        流式分块（超大文档）
+
+        按窗口读取 source，在分隔符（段落、换行、句号……）处切成约 section_size
+        字符的片段，片段在分块进程池中并行切分，按原顺序惰性产出。进行中的片段数
+        受进程数限制，内存占用约为 section_size × 进程数 × 2。
+        片段边界处的两个分块之间没有重叠，其余与 chunk_document 一致。
+
+        Args:
+            source: 文件路径（str / Path）、文本文件对象，或文本块迭代器
+            metadata: 文档元数据
+            section_size: 片段大小（字符），默认 CHUNKER_SECTION_SIZE
+
+        Yields:
+            文档片段（metadata 不含 total_chunks，总数在迭代结束后才能确定）
+        """
+        metadata = metadata or {}
+        section_size = max(section_size or get_settings().chunker_section_size, self.chunk_size * 4)
+        # 流式读取无法预先得到全文哈希：优先使用文档 ID，否则随机生成
+        doc_key = str(metadata["doc_id"]) if metadata.get("doc_id") else uuid.uuid4().hex[:8]
+
+        sections = _iter_sections(_read_blocks(source, section_size), section_size, self.separators)
+        position = 0
+        for chunks in _map_ordered(_split_section, self._config(), sections):
+            for chunk in chunks:
+                yield DocumentSegment(
+                    id=f"{doc_key}_{position}",
+                    content=chunk,
+                    metadata={**metadata, "chunk_index": position, "doc_hash": doc_key},
+                    position=position,
+                    tokens=self._estimate_tokens(chunk)
+                )
+                position += 1
+
+    def _config(self) -> Tuple[int, int, Tuple[str, ...]]:
+        """在 worker 进程中重建分块器所需的参数"""
+        return self.chunk_size, self.chunk_overlap, tuple(self.separators)
     
     def _estimate_tokens(self, text: str) -> int:
-        """估算 token 数量（粗略：中文按字符，英文按词）"""
-        # 简单估算：平均每 4 个字符约 1 个 token
-        return len(text) // 4
+        """计算 token 数量"""
+        return self.token_counter.count(text)
+
+
+# ============================
+# 流式读取与进程池
+# ============================
+
+def _read_blocks(source: Union[str, Path, TextIO, Iterable[str]], block_size: int) -> Iterator[str]:
+    """将文件路径 / 文件对象 / 文本迭代器统一为文本块迭代器"""
+    if isinstance(source, (str, Path)):
+        with open(source, encoding="utf-8") as f:
+            yield from _read_blocks(f, block_size)
+    elif hasattr(source, "read"):
+        while True:
+            block = source.read(block_size)
+            if not block:
+                break
+            yield block
+    else:
+        yield from source
+
+
+def _cut_point(text: str, start: int, size: int, separators: Iterable[str]) -> int:
+    """在 text[start + size//2 : start + size] 中按分隔符优先级寻找最靠后的切分位置"""
+    for separator in separators:
+        if not separator:
+            continue
+        index = text.rfind(separator, start + size // 2, start + size)
+        if index != -1:
+            return index + len(separator)
+    return start + size
+
+
+def _iter_sections(blocks: Iterable[str], section_size: int, separators: Iterable[str]) -> Iterator[str]:
+    """将文本块重新切成约 section_size 字符、在分隔符处断开的片段"""
+    buffer = ""
+    for block in blocks:
+        buffer = buffer + block if buffer else block
+        start = 0
+        # 记录偏移而不是反复截断 buffer，整篇文档作为单个文本块传入时也是线性时间
+        while len(buffer) - start >= section_size:
+            cut = _cut_point(buffer, start, section_size, separators)
+            yield buffer[start:cut]
+            start = cut
+        buffer = buffer[start:]
+    if buffer:
+        yield buffer
+
+
+# worker 进程内的分块器缓存
+_worker_splitters: Dict[Tuple[int, int, Tuple[str, ...]], DocumentChunker] = {}
+
+
+def _worker_chunker(config: Tuple[int, int, Tuple[str, ...]]) -> DocumentChunker:
+    chunker = _worker_splitters.get(config)
+    if chunker is None:
+        chunk_size, chunk_overlap, separators = config
+        chunker = DocumentChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=list(separators))
+        _worker_splitters[config] = chunker
+    return chunker
+
+
+def _split_section(config: Tuple[int, int, Tuple[str, ...]], text: str) -> List[str]:
+    return _worker_chunker(config).splitter.split_text(text)
+
+
+_executor: Optional[Executor] = None
+_executor_workers = 0
+
+
+class _BilliardExecutor(Executor):
+    """
+    billiard 进程池的 Executor 适配
+
+    Celery prefork worker 是守护进程，标准库进程池不能在其中创建子进程；
+    billiard（Celery 的 multiprocessing 分支）没有这一限制。
+    """
+
+    def __init__(self, workers: int):
+        import billiard
+        self._pool = billiard.get_context("spawn").Pool(processes=workers)
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        self._pool.apply_async(
+            fn, args, kwargs,
+            callback=future.set_result,
+            error_callback=lambda e: future.set_exception(getattr(e, "exception", e)),
+        )
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        if wait and not cancel_futures:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+
+
+def _in_daemon_process() -> bool:
+    """当前进程是否为守护进程（包括 Celery prefork worker 的子进程）"""
+    if multiprocessing.current_process().daemon:
+        return True
+    try:
+        import billiard
+    except ImportError:
+        return False
+    return bool(billiard.current_process().daemon)
+
+
+def get_chunk_executor() -> Optional[Executor]:
+    """
+    获取分块进程池（懒加载单例）
+
+    CHUNKER_WORKERS 为 0 时使用全部 CPU 核，为 1 时返回 None（在当前进程中顺序分块）。
+    守护进程（Celery prefork worker）中使用 billiard 进程池，worker 退出时关闭。
+    """
+    global _executor, _executor_workers
+    if _executor is None:
+        workers = get_settings().chunker_workers or os.cpu_count() or 1
+        if workers <= 1:
+            return None
+        if _in_daemon_process():
+            _executor = _BilliardExecutor(workers)
+            atexit.register(shutdown_chunk_executor)
+        else:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _executor_workers = workers
+    return _executor
+
+
+def shutdown_chunk_executor() -> None:
+    """关闭分块进程池（服务关闭时调用）"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _map_ordered(func, config, items: Iterable[Any]) -> Iterator[Any]:
+    """按顺序产出 func(config, item)；有进程池时最多同时提交 2 × 进程数个任务"""
+    items = iter(items)
+    head = list(itertools.islice(items, 2))
+    # 只有一个片段（普通大小的文档）时不经过进程池
+    executor = get_chunk_executor() if len(head) > 1 else None
+    if executor is None:
+        for item in itertools.chain(head, items):
+            yield func(config, item)
+        return
+
+    max_pending = 2 * _executor_workers
+    pending = deque()
+    for item in itertools.chain(head, items):
+        pending.append(executor.submit(func, config, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 class FixedSizeChunker(DocumentChunker):
@@ -135,8 +359,13 @@ class SemanticChunker:
     适用于结构化文档（Markdown、HTML 等）。
     """
     
-    def __init__(self, max_chunk_size: int = 1000):
+    def __init__(self, max_chunk_size: int = 1000, token_counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            token_counter: 计算分段 tokens 的计数器，默认按字符类别估算（同 DocumentChunker）
+        """
         self.max_chunk_size = max_chunk_size
+        self.token_counter = token_counter or get_token_counter()
     
     def chunk_markdown(self, content: str, metadata: Optional[Dict[str, Any]] = None) -> List[DocumentSegment]:
         """按 Markdown 标题分块"""
@@ -166,7 +395,7 @@ class SemanticChunker:
                         content=current_content.strip(),
                         metadata={**metadata, "heading": current_heading, "chunk_index": position},
                         position=position,
-                        tokens=len(current_content) // 4
+                        tokens=self.token_counter.count(current_content.strip())
                     ))
                     position += 1
                 
@@ -187,7 +416,7 @@ class SemanticChunker:
                 content=current_content.strip(),
                 metadata={**metadata, "heading": current_heading, "chunk_index": position},
                 position=position,
-                tokens=len(current_content) // 4
+                tokens=self.token_counter.count(current_content.strip())
             ))
         
         return segments
@@ -1,16 +1,18 @@
 """
 core/rag/db_conn.py
-负责管理 Weaviate 的全局连接实例（单例模式）
+负责管理 Weaviate 的全局连接实例（单例模式），以及按配置选择向量存储后端
 """
 import logging
-from typing import Optional
+from typing import Any, Optional
 from configs import get_settings
-from core.rag.weaviate_client import WeaviateClient
+from core.rag.weaviate_client import WeaviateClient, tenant_collection_name
+from core.rag.vector_store import VectorStore
 
 logger = logging.getLogger(__name__)
 
 # 模块级私有变量，存储单例
 _weaviate_instance: Optional[WeaviateClient] = None
+_local_store_instance: Optional[VectorStore] = None
 
 
 def get_weaviate_client() -> WeaviateClient:
@@ -28,16 +30,13 @@ def get_weaviate_client() -> WeaviateClient:
         _weaviate_instance = WeaviateClient(
             url=settings.weaviate_url,
             api_key=settings.weaviate_api_key,
+            grpc_port=settings.weaviate_grpc_port,
+            grpc_pool_size=settings.weaviate_grpc_pool_size,
+            http_pool_connections=settings.weaviate_http_pool_connections,
+            http_pool_maxsize=settings.weaviate_http_pool_maxsize,
         )
 
-    # 确保它是连接状态
-    if not _weaviate_instance.client.is_connected():
-        try:
-            _weaviate_instance.client.connect()
-        except Exception as e:
-            logger.error(f"Failed to connect to Weaviate: {e}")
-            raise e
-
+    # 连接在各事件循环首次使用时建立（异步客户端绑定事件循环）
     return _weaviate_instance
 
 
@@ -48,3 +47,53 @@ def close_weaviate_client():
         logger.info("Closing global WeaviateClient...")
         _weaviate_instance.close()
         _weaviate_instance = None
+
+
+def get_vector_store() -> VectorStore:
+    """
+    获取全局向量存储实例
+
+    VECTOR_STORE_BACKEND=local 时使用本地内存映射存储（无需 Weaviate 服务），
+    否则返回 Weaviate 客户端。
+    """
+    global _local_store_instance
+
+    settings = get_settings()
+    if settings.vector_store_backend == "local":
+        if _local_store_instance is None:
+            from core.rag.local_store import LocalVectorStore
+            logger.info(f"Using local vector store at {settings.local_vector_store_path}")
+            _local_store_instance = LocalVectorStore(
+                root=settings.local_vector_store_path,
+                index_type=settings.local_vector_index,
+            )
+        return _local_store_instance
+
+    return get_weaviate_client()
+
+
+def kb_collection_name(kb: Any) -> str:
+    """
+    知识库在向量存储中的 Collection 名称
+
+    WEAVIATE_MULTI_TENANCY 开启时（仅 Weaviate 后端），同一 embedding 模型 / 维度的
+    知识库作为租户共享一个 Collection，返回 "Collection::kb_{id}"；否则为 kb_{id}。
+    """
+    name = f"kb_{kb.id}"
+    settings = get_settings()
+    if settings.vector_store_backend == "local" or not settings.weaviate_multi_tenancy:
+        return name
+    return tenant_collection_name(
+        kb.embedding_provider,
+        kb.embedding_model,
+        (kb.indexing_config or {}).get("dimensions"),
+        name
+    )
+
+
+async def close_vector_store_connections():
+    """关闭当前事件循环上的向量存储连接（服务关闭或 Celery 任务结束时调用）"""
+    if _weaviate_instance is not None:
+        await _weaviate_instance.aclose()
+    if _local_store_instance is not None:
+        await _local_store_instance.aclose()
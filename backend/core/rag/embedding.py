@@ -1,18 +1,27 @@
 """
 向量化服务
 
-支持 OpenAI 和本地模型向量化。
+支持 OpenAI、DashScope 和本地模型向量化。
+远程提供方复用长连接异步客户端，文档按提供方批次上限切分后并发请求。
+EmbeddingService 的结果经过持久化向量缓存（见 embedding_cache.py）。
 
 Author: chunlin
 """
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from abc import ABC, abstractmethod
 from configs import get_settings
+from .embedding_cache import get_embedding_cache
+from .tokenizer import get_token_counter
 
+import asyncio
+import logging
 import os
+import weakref
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
 class BaseEmbedding(ABC):
     """向量化基类"""
@@ -33,33 +42,173 @@ class BaseEmbedding(ABC):
         """向量维度"""
         pass
 
+    async def get_dimension(self) -> int:
+        """向量维度（需要加载模型才能确定时使用异步接口，不阻塞事件循环）"""
+        return self.dimension
+
+    async def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化多个查询
+
+        现有提供方的查询向量与文档向量相同，直接走 embed_documents 的批量请求；
+        查询需要单独 input type / 指令前缀的提供方应覆盖此方法。
+        """
+        return await self.embed_documents(texts)
+
+
+_client_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], Tuple[Any, asyncio.Semaphore]]]" = weakref.WeakKeyDictionary()
+
+
+def _get_pooled_client(api_key: Optional[str], base_url: Optional[str]) -> Tuple[Any, asyncio.Semaphore]:
+    """
+    获取长连接的 AsyncOpenAI 客户端及其并发信号量
+
+    按 (api_key, base_url) 复用；httpx 连接池绑定事件循环，
+    因此每个事件循环（FastAPI 主循环、Celery 任务循环）各自维护一份。
+    """
+    from openai import AsyncOpenAI
+
+    loop = asyncio.get_running_loop()
+    pool = _client_pools.setdefault(loop, {})
+    key = (api_key or "", base_url or "")
+    if key not in pool:
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        pool[key] = (client, asyncio.Semaphore(get_settings().embedding_max_concurrency))
+    return pool[key]
+
+
+def _is_retryable(error: Exception) -> bool:
+    """限流、超时、连接错误和 5xx 可重试；400 / 401 / 413 等客户端错误重试也不会成功"""
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+
+    # APITimeoutError 是 APIConnectionError 的子类
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
 
-class OpenAIEmbedding(BaseEmbedding):
-    """OpenAI 向量化"""
 
-    def __init__(self, model: str = "text-embedding-3-small", api_key: Optional[str] = None, api_base: Optional[str] = None):
+class OpenAICompatibleEmbedding(BaseEmbedding):
+    """
+    基于 OpenAI 兼容 /embeddings 接口的向量化基类
+
+    - 复用长连接异步客户端
+    - 按提供方的单次请求文本数与 token 上限打包批次，批次并发请求（受信号量限制）
+    - 失败的批次单独重试（仅限流、超时、连接错误和 5xx），输出顺序与输入一致
+    """
+
+    provider: str = ""
+    # 单次请求最多包含的文本数
+    max_batch_size: int = 256
+    # 单次请求的 token 总数上限（None 表示只受文本数限制）
+    max_batch_tokens: Optional[int] = None
+    # 单条文本的 token 上限（超出时服务端会拒绝或截断）
+    max_input_tokens: Optional[int] = None
+    max_retries: int = 3
+
+    def __init__(self, model: str, api_key: Optional[str] = None, api_base: Optional[str] = None):
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
-        self._dimension = 1536 if "3-small" in model else 3072
+        self.token_counter = get_token_counter(self.provider, model)
+
+    def _request_kwargs(self) -> Dict[str, Any]:
+        """附加到 embeddings.create 的参数"""
+        return {}
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        client, semaphore = _get_pooled_client(self.api_key, self.api_base)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    response = await client.embeddings.create(
+                        model=self.model,
+                        input=texts,
+                        **self._request_kwargs()
+                    )
+                data = sorted(response.data, key=lambda d: d.index)
+                return [d.embedding for d in data]
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Embedding 批次失败（{len(texts)} 条），{delay}s 后重试: {e}")
+                await asyncio.sleep(delay)
 
     async def embed_query(self, text: str) -> List[float]:
-        from langchain_openai import OpenAIEmbeddings
-        embeddings = OpenAIEmbeddings(
-            model=self.model,
-            openai_api_key=self.api_key,
-            openai_api_base=self.api_base
-        )
-        return await embeddings.aembed_query(text)
+        return (await self._embed_batch([text]))[0]
+
+    def _pack_batches(self, texts: List[str]) -> List[List[str]]:
+        """按顺序把文本打包进批次，每批不超过文本数与 token 上限"""
+        if self.max_batch_tokens is None and self.max_input_tokens is None:
+            return [
+                texts[i:i + self.max_batch_size]
+                for i in range(0, len(texts), self.max_batch_size)
+            ]
+
+        batches: List[List[str]] = []
+        batch: List[str] = []
+        batch_tokens = 0
+        oversized = 0
+        for text in texts:
+            tokens = self.token_counter.count(text)
+            if self.max_input_tokens and tokens > self.max_input_tokens:
+                oversized += 1
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or (self.max_batch_tokens and batch_tokens + tokens > self.max_batch_tokens)
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        if oversized:
+            logger.warning(f"{oversized} 条文本超过 {self.model} 单条上限 {self.max_input_tokens} tokens")
+        return batches
 
     async def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        from langchain_openai import OpenAIEmbeddings
-        embeddings = OpenAIEmbeddings(
-            model=self.model,
-            openai_api_key=self.api_key,
-            openai_api_base=self.api_base
-        )
-        return await embeddings.aembed_documents(texts)
+        if not texts:
+            return []
+        batches = self._pack_batches(texts)
+        results = await asyncio.gather(*[self._embed_batch(batch) for batch in batches])
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+class OpenAIEmbedding(OpenAICompatibleEmbedding):
+    """
+    OpenAI 向量化
+
+    text-embedding-3-* 支持 Matryoshka 截断：通过 dimensions 参数让服务端直接
+    返回低维向量（如 3-large 截断到 1024 / 256 维），显著降低向量库内存占用。
+    """
+
+    provider = "openai"
+    max_batch_size = 2048
+    max_batch_tokens = 300_000
+    max_input_tokens = 8191
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        dimensions: Optional[int] = None
+    ):
+        super().__init__(model=model, api_key=api_key, api_base=api_base)
+        native_dimension = 1536 if "3-small" in model else 3072
+        self.dimensions = None
+        if dimensions:
+            if not model.startswith("text-embedding-3"):
+                logger.warning(f"模型 {model} 不支持 dimensions 参数，已忽略")
+            elif not 0 < dimensions <= native_dimension:
+                raise ValueError(f"dimensions 必须在 1 ~ {native_dimension} 之间")
+            else:
+                self.dimensions = dimensions
+        self._dimension = self.dimensions or native_dimension
+
+    def _request_kwargs(self) -> Dict[str, Any]:
+        return {"dimensions": self.dimensions} if self.dimensions else {}
 
     @property
     def dimension(self) -> int:
@@ -74,12 +223,77 @@ class LocalEmbedding(BaseEmbedding):
     - all-MiniLM-L6-v2（轻量级，384 维）
     - bge-base-zh-v1.5（中文优化，768 维）
     - bge-large-zh-v1.5（中文大模型，1024 维）
+
+    推理在专用进程池中执行（模型每个 worker 只加载一次）；并发的 embed_query
+    经动态批处理队列合并为一次前向计算。
     """
-# ... (LocalEmbedding remains same)
 
-class DashScopeEmbedding(BaseEmbedding):
+    _dimensions = {
+        "all-MiniLM-L6-v2": 384,
+        "bge-small-zh-v1.5": 512,
+        "bge-base-zh-v1.5": 768,
+        "bge-large-zh-v1.5": 1024,
+    }
+    # 运行时解析出的未知模型维度（按模型名缓存，跨实例复用）
+    _resolved_dimensions: Dict[str, int] = {}
+
+    def __init__(self, model_name: str = "BAAI/bge-base-zh-v1.5", normalize: bool = True):
+        settings = get_settings()
+        self.model_name = model_name
+        self.normalize = normalize
+        self.backend = settings.local_embedding_backend
+        self.device = settings.local_embedding_device
+        self.max_batch_size = settings.local_embedding_max_batch_size
+        self.max_wait_ms = settings.local_embedding_max_wait_ms
+        self._dimension = (
+            self._dimensions.get(model_name.split("/")[-1])
+            or self._resolved_dimensions.get(model_name)
+        )
+
+    async def _encode(self, texts: List[str]) -> List[List[float]]:
+        from .local_inference import _worker_encode, run_in_inference_pool
+        return await run_in_inference_pool(
+            _worker_encode, self.model_name, self.backend, self.device, texts, self.normalize
+        )
+
+    async def embed_query(self, text: str) -> List[float]:
+        from .local_inference import DynamicBatcher, get_batcher
+        batcher = get_batcher(
+            ("embedding", self.model_name, self.backend, self.device, self.normalize),
+            lambda: DynamicBatcher(self._encode, self.max_batch_size, self.max_wait_ms)
+        )
+        return await batcher.submit(text)
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [
+            texts[i:i + self.max_batch_size]
+            for i in range(0, len(texts), self.max_batch_size)
+        ]
+        results = await asyncio.gather(*[self._encode(batch) for batch in batches])
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def get_dimension(self) -> int:
+        if self._dimension is None:
+            # 未知模型：在 worker 中加载一次并读取维度（仅首次）
+            from .local_inference import _worker_dimension, run_in_inference_pool
+            self._dimension = await run_in_inference_pool(
+                _worker_dimension, self.model_name, self.backend, self.device
+            )
+            self._resolved_dimensions[self.model_name] = self._dimension
+        return self._dimension
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            raise RuntimeError(f"模型 {self.model_name} 的向量维度尚未解析，请先 await get_dimension()")
+        return self._dimension
+
+
+class DashScopeEmbedding(OpenAICompatibleEmbedding):
     """
-    阿里云 DashScope 向量化
+    阿里云 DashScope 向量化（OpenAI 兼容模式）
 
     支持：
     - text-embedding-v1（通用，1536 维）
@@ -87,8 +301,15 @@ class DashScopeEmbedding(BaseEmbedding):
     - text-embedding-v3（多语言，1024 维）
     """
 
-    def __init__(self, model: str = "text-embedding-v3", api_key: Optional[str] = None):
-        self.model = model
+    provider = "dashscope"
+
+    def __init__(self, model: str = "text-embedding-v3", api_key: Optional[str] = None, api_base: Optional[str] = None):
+        settings = get_settings()
+        super().__init__(
+            model=model,
+            api_key=api_key or settings.dashscope_api_key,
+            api_base=api_base or settings.dashscope_base_url
+        )
         # 维度映射
         self._dimensions = {
             "text-embedding-v1": 1536,
@@ -98,29 +319,11 @@ class DashScopeEmbedding(BaseEmbedding):
             "text-embedding-async-v2": 1536,
         }
         self._dimension = self._dimensions.get(model, 1024)
-        self.dashscope_api_key = api_key or get_settings().dashscope_api_key
-
-    async def embed_query(self, text: str) -> List[float]:
-        from langchain_community.embeddings import DashScopeEmbeddings
-        import asyncio
-        embeddings = DashScopeEmbeddings(model=self.model, dashscope_api_key=self.dashscope_api_key)
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: embeddings.embed_query(text)
-        )
-        return result
-
-    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        from langchain_community.embeddings import DashScopeEmbeddings
-        import asyncio
-        embeddings = DashScopeEmbeddings(model=self.model, dashscope_api_key=self.dashscope_api_key)
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: embeddings.embed_documents(texts)
-        )
-        return result
+        # v3 单次最多 10 条、单条 8192 tokens；v1/v2 最多 25 条、单条 2048 tokens
+        if model.startswith("text-embedding-v3"):
+            self.max_batch_size, self.max_input_tokens = 10, 8192
+        else:
+            self.max_batch_size, self.max_input_tokens = 25, 2048
 
     @property
     def dimension(self) -> int:
@@ -137,24 +340,59 @@ class EmbeddingService:
     - dashscope: 阿里云 DashScope
     """
 
-    def __init__(self, provider: str = "openai", model: Optional[str] = None, api_key: Optional[str] = None, api_base: Optional[str] = None):
+    def __init__(
+        self,
+        provider: str = "openai",
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        dimensions: Optional[int] = None
+    ):
+        """
+        Args:
+            dimensions: 输出向量维度（仅 OpenAI text-embedding-3-* 支持，来自知识库 indexing_config）
+        """
         self.provider = provider
 
         if provider == "openai":
-            self.embedder = OpenAIEmbedding(model=model or "text-embedding-3-small", api_key=api_key, api_base=api_base)
+            self.embedder = OpenAIEmbedding(
+                model=model or "text-embedding-3-small",
+                api_key=api_key,
+                api_base=api_base,
+                dimensions=dimensions
+            )
         elif provider == "local":
             self.embedder = LocalEmbedding(model_name=model or "BAAI/bge-base-zh-v1.5")
         elif provider == "dashscope":
-            self.embedder = DashScopeEmbedding(model=model or "text-embedding-v3", api_key=api_key)
+            self.embedder = DashScopeEmbedding(model=model or "text-embedding-v3", api_key=api_key, api_base=api_base)
         else:
             raise ValueError(f"Unknown embedding provider: {provider}")
+        self._cache_namespace: Optional[str] = None
+
+    async def get_cache_namespace(self) -> str:
+        """向量缓存命名空间：provider / model / dimension（首次解析后缓存）"""
+        if self._cache_namespace is None:
+            model = getattr(self.embedder, "model", None) or getattr(self.embedder, "model_name", "")
+            self._cache_namespace = f"{self.provider}:{model}:{await self.embedder.get_dimension()}"
+        return self._cache_namespace
 
     async def embed_query(self, text: str) -> List[float]:
+        """向量化查询（不写入持久化缓存，热门查询由 QueryEmbeddingCache 缓存）"""
         return await self.embedder.embed_query(text)
 
+    async def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量向量化多个查询（结果由调用方的查询向量缓存保存）"""
+        return await self.embedder.embed_queries(texts)
+
     async def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return await self.embedder.embed_documents(texts)
+        cache = get_embedding_cache()
+        if cache is None:
+            return await self.embedder.embed_documents(texts)
+        return await cache.embed(await self.get_cache_namespace(), texts, self.embedder.embed_documents)
 
     @property
     def dimension(self) -> int:
         return self.embedder.dimension
+
+    async def get_dimension(self) -> int:
+        return await self.embedder.get_dimension()
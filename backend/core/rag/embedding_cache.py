@@ -0,0 +1,380 @@
+"""
+持久化向量缓存
+
+以 (provider, model, dimension, xxhash(text)) 为键缓存 embedding 结果，
+重新上传文档、相同配置重建索引、重复的模板分块、更新分段时无需再次调用 embedding API。
+
+后端：
+- sqlite: 本地磁盘（默认，./data/embedding_cache.sqlite3）
+- redis: 多进程 / 多机共享
+
+向量以 float16 或 float32 的紧凑二进制存储。sqlite 后端按最近使用时间淘汰
+（EMBEDDING_CACHE_MAX_ROWS 行数上限 + EMBEDDING_CACHE_TTL 过期），redis 后端使用键过期。
+只缓存文档 / 分段向量；查询向量由进程内的 QueryEmbeddingCache 缓存，不落盘。
+
+另提供检索热路径使用的查询向量 LRU + single-flight（QueryEmbeddingCache）。
+
+Author: chunlin
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import xxhash
+
+from configs import get_settings
+from core.cache import CacheStats, LRUCache, get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCacheBackend(ABC):
+    """向量缓存存储后端"""
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """批量读取，返回命中的 key -> blob"""
+        pass
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        """批量写入"""
+        pass
+
+
+class SQLiteEmbeddingCache(EmbeddingCacheBackend):
+    """
+    本地 SQLite 后端（同步 sqlite3 在线程中执行）
+
+    每行记录最近使用时间（命中时刷新），每写入 _SWEEP_INTERVAL 行清理一次：
+    删除超过 ttl 未使用的行，行数超过 max_rows 时按最近使用时间淘汰最旧的行。
+    """
+
+    _CHUNK = 500  # SQLite 单条语句的参数数量有限，分批查询
+    _SWEEP_INTERVAL = 1000
+
+    def __init__(self, path: str, max_rows: int = 0, ttl: int = 0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL DEFAULT 0)"
+        )
+        # 旧版本创建的表没有 last_used 列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(embedding_cache)")}
+        if "last_used" not in columns:
+            self._conn.execute(
+                "ALTER TABLE embedding_cache ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._writes_since_sweep = 0
+        self._sweep()
+
+    def _get_many_sync(self, keys: List[str]) -> Dict[str, bytes]:
+        found: Dict[str, bytes] = {}
+        now = int(time.time())
+        with self._lock:
+            for i in range(0, len(keys), self._CHUNK):
+                chunk = keys[i:i + self._CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _set_many_sync(self, items: Dict[str, bytes]) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, blob, now) for key, blob in items.items()]
+            )
+            self._conn.commit()
+            self._writes_since_sweep += len(items)
+            if self._writes_since_sweep >= self._SWEEP_INTERVAL:
+                self._sweep()
+
+    def _sweep(self) -> None:
+        """清理过期行并把行数控制在 max_rows 以内（调用方持有锁或处于初始化阶段）"""
+        self._writes_since_sweep = 0
+        removed = 0
+        if self.ttl > 0:
+            removed += self._conn.execute(
+                "DELETE FROM embedding_cache WHERE last_used < ?", (int(time.time()) - self.ttl,)
+            ).rowcount
+        if self.max_rows > 0:
+            excess = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0] - self.max_rows
+            if excess > 0:
+                removed += self._conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN "
+                    "(SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?)", (excess,)
+                ).rowcount
+        self._conn.commit()
+        if removed:
+            logger.info(f"向量缓存淘汰 {removed} 行")
+
+    async def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        return await asyncio.to_thread(self._get_many_sync, keys)
+
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        await asyncio.to_thread(self._set_many_sync, items)
+
+
+class RedisEmbeddingCache(EmbeddingCacheBackend):
+    """Redis 后端"""
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl
+
+    async def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        redis = get_redis()
+        if redis is None or not keys:
+            return {}
+        values = await redis.mget(keys)
+        return {k: v for k, v in zip(keys, values) if v is not None}
+
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        redis = get_redis()
+        if redis is None or not items:
+            return
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, blob in items.items():
+                pipe.set(key, blob, ex=self.ttl)
+            await pipe.execute()
+
+
+class EmbeddingCache:
+    """
+    内容寻址的向量缓存
+
+    命名空间由 provider / model / dimension 组成，模型或维度变化时自然失效。
+    """
+
+    def __init__(self, backend: EmbeddingCacheBackend, dtype: str = "float16"):
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
+        self.stats = CacheStats()
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        return f"emb:{namespace}:{xxhash.xxh3_128_hexdigest(text.encode('utf-8'))}"
+
+    def _encode(self, vector: List[float]) -> bytes:
+        return np.asarray(vector, dtype=self.dtype).tobytes()
+
+    def _decode(self, blob: bytes) -> List[float]:
+        return np.frombuffer(blob, dtype=self.dtype).astype(np.float32).tolist()
+
+    async def embed(
+        self,
+        namespace: str,
+        texts: List[str],
+        compute: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        """
+        先查缓存，仅对未命中（且去重后）的文本调用 compute，结果回写缓存。
+
+        缓存读写失败时退化为直接计算，不影响主流程。
+        """
+        if not texts:
+            return []
+
+        keys = [self.make_key(namespace, t) for t in texts]
+        unique_keys = list(dict.fromkeys(keys))
+
+        try:
+            cached = await self.backend.get_many(unique_keys)
+        except Exception as e:
+            logger.warning(f"读取向量缓存失败: {e}")
+            cached = {}
+
+        vectors: Dict[str, List[float]] = {k: self._decode(v) for k, v in cached.items()}
+
+        missing_keys = [k for k in unique_keys if k not in vectors]
+        if missing_keys:
+            first_text = {}
+            for k, t in zip(keys, texts):
+                first_text.setdefault(k, t)
+            computed = await compute([first_text[k] for k in missing_keys])
+            new_items = {}
+            for k, vector in zip(missing_keys, computed):
+                vectors[k] = vector
+                new_items[k] = self._encode(vector)
+            try:
+                await self.backend.set_many(new_items)
+            except Exception as e:
+                logger.warning(f"写入向量缓存失败: {e}")
+
+        hits = len(texts) - len(missing_keys)
+        self.stats.hits += hits
+        self.stats.misses += len(missing_keys)
+        if len(texts) > 1:
+            logger.info(
+                f"Embedding cache [{namespace}]: {hits}/{len(texts)} 命中，"
+                f"累计命中率 {self.stats.hit_rate:.1%}"
+            )
+
+        return [vectors[k] for k in keys]
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_disabled = False
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    获取全局向量缓存（懒加载单例）
+
+    EMBEDDING_CACHE_BACKEND: none / sqlite / redis
+    """
+    global _embedding_cache, _embedding_cache_disabled
+
+    if _embedding_cache is not None or _embedding_cache_disabled:
+        return _embedding_cache
+
+    settings = get_settings()
+    backend_name = settings.embedding_cache_backend
+    try:
+        if backend_name == "sqlite":
+            backend = SQLiteEmbeddingCache(
+                settings.embedding_cache_path,
+                max_rows=settings.embedding_cache_max_rows,
+                ttl=settings.embedding_cache_ttl
+            )
+        elif backend_name == "redis":
+            backend = RedisEmbeddingCache(ttl=settings.embedding_cache_ttl or None)
+        else:
+            _embedding_cache_disabled = True
+            return None
+    except Exception as e:
+        logger.error(f"初始化向量缓存失败（{backend_name}），已禁用: {e}")
+        _embedding_cache_disabled = True
+        return None
+
+    _embedding_cache = EmbeddingCache(backend, dtype=settings.embedding_cache_dtype)
+    return _embedding_cache
+
+
+class QueryEmbeddingCache:
+    """
+    查询向量的进程内 LRU（带 TTL）+ single-flight
+
+    检索热路径（知识库查询 API、召回测试、Agent RAG、知识检索节点）每次都要
+    embedding 查询文本；热门问题直接命中 LRU，并发的相同查询共享同一个进行中的请求。
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 600):
+        self.local = LRUCache(max_entries=max_entries, default_ttl=ttl)
+        self.stats = CacheStats()
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    async def get_or_embed(self, embedding_service: Any, query: str) -> List[float]:
+        key = (await embedding_service.get_cache_namespace(), query)
+
+        vector = self.local.get(key)
+        if vector is not None:
+            self.stats.hits += 1
+            return vector
+
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            # 合并到进行中的请求
+            self.stats.hits += 1
+            return await asyncio.shield(task)
+
+        self.stats.misses += 1
+        task = self._track(key, asyncio.ensure_future(embedding_service.embed_query(query)))
+        # shield：单个调用方被取消时不影响共享同一请求的其他调用方
+        return await asyncio.shield(task)
+
+    async def get_or_embed_many(self, embedding_service: Any, queries: List[str]) -> List[List[float]]:
+        """
+        批量获取查询向量（批量检索）
+
+        命中 LRU 或进行中请求的查询直接复用，其余查询合并为一次 embed_queries 批量请求，
+        结果按查询写入 LRU，与 get_or_embed 共享缓存键。
+        """
+        namespace = await embedding_service.get_cache_namespace()
+        loop = asyncio.get_running_loop()
+        pending: Dict[str, Any] = {}
+        missing: List[str] = []
+        for query in dict.fromkeys(queries):
+            key = (namespace, query)
+            vector = self.local.get(key)
+            task = self._inflight.get(key)
+            if vector is not None:
+                self.stats.hits += 1
+                pending[query] = vector
+            elif task is not None and task.get_loop() is loop:
+                self.stats.hits += 1
+                pending[query] = task
+            else:
+                missing.append(query)
+
+        if missing:
+            self.stats.misses += len(missing)
+            batch = asyncio.ensure_future(embedding_service.embed_queries(missing))
+
+            async def _pick(index: int) -> List[float]:
+                return (await asyncio.shield(batch))[index]
+
+            for index, query in enumerate(missing):
+                pending[query] = self._track((namespace, query), asyncio.ensure_future(_pick(index)))
+
+        tasks = {q: v for q, v in pending.items() if isinstance(v, asyncio.Future)}
+        if tasks:
+            results = await asyncio.gather(*[asyncio.shield(t) for t in tasks.values()])
+            pending.update(zip(tasks.keys(), results))
+        return [pending[query] for query in queries]
+
+    def _track(self, key: Tuple[str, str], task: asyncio.Future) -> asyncio.Future:
+        """登记进行中的请求，完成后移出并写入 LRU"""
+        self._inflight[key] = task
+
+        def _on_done(t: asyncio.Future) -> None:
+            if self._inflight.get(key) is t:
+                del self._inflight[key]
+            if not t.cancelled() and t.exception() is None:
+                self.local.set(key, t.result())
+
+        task.add_done_callback(_on_done)
+        return task
+
+
+_query_embedding_cache: Optional[QueryEmbeddingCache] = None
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """获取全局查询向量缓存（懒加载单例）"""
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        settings = get_settings()
+        _query_embedding_cache = QueryEmbeddingCache(
+            max_entries=settings.query_embedding_cache_size,
+            ttl=settings.query_embedding_cache_ttl,
+        )
+    return _query_embedding_cache
@@ -0,0 +1,198 @@
+"""
+本地 CPU 推理
+
+为本地 embedding 与本地 cross-encoder 重排序提供：
+- 专用进程池：模型在每个 worker 进程中只加载一次
+- 动态批处理队列：将并发的单条请求合并为一次前向计算
+
+依赖 sentence-transformers（可选安装）：
+    pip install sentence-transformers          # PyTorch 后端
+    pip install "sentence-transformers[onnx]"  # ONNX Runtime 后端
+
+Author: chunlin
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from configs import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# Worker 进程内执行的函数
+# ============================
+
+# worker 进程内的模型缓存：(kind, model_name, backend, device) -> model
+_worker_models: Dict[Tuple[str, str, str, str], Any] = {}
+
+
+def _load_model(kind: str, model_name: str, backend: str, device: str) -> Any:
+    key = (kind, model_name, backend, device)
+    model = _worker_models.get(key)
+    if model is None:
+        try:
+            from sentence_transformers import CrossEncoder, SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "本地模型需要安装 sentence-transformers：pip install sentence-transformers"
+            ) from e
+        model_class = CrossEncoder if kind == "cross_encoder" else SentenceTransformer
+        model = model_class(model_name, device=device, backend=backend)
+        _worker_models[key] = model
+    return model
+
+
+def _worker_encode(
+    model_name: str,
+    backend: str,
+    device: str,
+    texts: List[str],
+    normalize: bool
+) -> List[List[float]]:
+    model = _load_model("embedding", model_name, backend, device)
+    vectors = model.encode(
+        texts,
+        batch_size=len(texts),
+        normalize_embeddings=normalize,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return vectors.astype("float32").tolist()
+
+
+def _worker_predict(
+    model_name: str,
+    backend: str,
+    device: str,
+    pairs: List[Tuple[str, str]]
+) -> List[float]:
+    # 单输出 cross-encoder 默认经过 Sigmoid，分数在 0 ~ 1 之间
+    model = _load_model("cross_encoder", model_name, backend, device)
+    scores = model.predict(
+        pairs,
+        batch_size=len(pairs),
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return scores.astype("float32").reshape(-1).tolist()
+
+
+def _worker_dimension(model_name: str, backend: str, device: str) -> int:
+    model = _load_model("embedding", model_name, backend, device)
+    return int(model.get_sentence_embedding_dimension())
+
+
+# ============================
+# 进程池
+# ============================
+
+_executor: Optional[Executor] = None
+
+
+def get_inference_executor() -> Executor:
+    """
+    获取本地推理专用执行器（懒加载单例）
+
+    Celery prefork worker 等守护进程不能再创建子进程，此时退化为线程池
+    （PyTorch / ONNX Runtime 推理期间会释放 GIL）。
+    """
+    global _executor
+    if _executor is None:
+        workers = max(1, get_settings().local_inference_workers)
+        if multiprocessing.current_process().daemon:
+            logger.info("当前为守护进程，本地推理使用线程池")
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="local-inference")
+        else:
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _executor
+
+
+def shutdown_inference_executor() -> None:
+    """关闭本地推理执行器（服务关闭时调用）"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_in_inference_pool(func: Callable, *args) -> Any:
+    """在本地推理执行器中运行函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), func, *args)
+
+
+# ============================
+# 动态批处理
+# ============================
+
+class DynamicBatcher:
+    """
+    动态批处理队列
+
+    submit() 的单条请求先进入队列，后台任务最多等待 max_wait_ms 或凑满
+    max_batch_size 条后调用一次 run_batch，再把结果按顺序分发给各调用方。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any) -> Any:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await self.run_batch(items)
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Any, DynamicBatcher]]" = weakref.WeakKeyDictionary()
+
+
+def get_batcher(key: Any, factory: Callable[[], DynamicBatcher]) -> DynamicBatcher:
+    """按事件循环获取（或创建）指定 key 的批处理队列"""
+    batchers = _batchers.setdefault(asyncio.get_running_loop(), {})
+    if key not in batchers:
+        batchers[key] = factory()
+    return batchers[key]
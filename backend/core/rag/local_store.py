@@ -0,0 +1,729 @@
+"""
+本地向量存储
+
+无需 Weaviate 服务即可运行的 VectorStore 实现，适用于小规模部署、CI 和基准测试：
+- 向量：每个 Collection 一个追加写入的 float32 文件，通过 numpy.memmap 只读映射，不占用堆内存
+- 对象：追加写入的 JSONL 操作日志（init / add / update / delete），加载时重放；
+  add 记录带有其向量在向量文件中的起始行号，写入中途崩溃留下的多余向量
+  在下次写入前截断，重放时也按行号对齐，不会错位
+- 关键词：内存 BM25 倒排索引（中文按字二元组切分，英文和数字按词切分）
+- 向量检索：暴力余弦（矩阵乘），或可选的 HNSW 索引（pip install hnswlib）
+- 过滤：常用字段（enabled / archived / doc_id）按列维护，过滤时做向量化比较
+
+API 进程与 Celery worker 可以共享同一目录：写入时持有排它文件锁，
+每次访问前检查操作日志是否被其他进程追加，并增量同步。
+
+Author: chunlin
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import uuid as uuid_lib
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .vector_store import VectorStore, SearchResult, to_properties, to_search_result
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 失效行超过该数量且多于有效行时压缩文件
+_COMPACT_MIN_DEAD_ROWS = 1024
+# 混合检索中每路子检索的最少候选数
+_HYBRID_MIN_CANDIDATES = 100
+# 按列维护的过滤字段（状态过滤每次检索都会用到，按文档删除 / 更新也按 doc_id 过滤）
+_COLUMN_FIELDS = ("enabled", "archived", "doc_id")
+
+
+# ============================
+# BM25
+# ============================
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """英文/数字按词切分，连续汉字按字二元组切分（单字保留）"""
+    tokens: List[str] = []
+    for chunk in _TOKEN_RE.findall(text.lower()):
+        if "一" <= chunk[0] <= "鿿" and len(chunk) > 1:
+            tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+        else:
+            tokens.append(chunk)
+    return tokens
+
+
+class _BM25Index:
+    """内存 BM25 倒排索引（参数与 Weaviate 默认值一致：k1=1.2, b=0.75）"""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+
+    def add(self, row: int, text: str) -> None:
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[row] = tf
+        length = sum(terms.values())
+        self.doc_len[row] = length
+        self.total_len += length
+
+    def remove(self, row: int, text: str) -> None:
+        if row not in self.doc_len:
+            return
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(row, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(row)
+
+    def search(self, query: str, mask: Optional[np.ndarray]) -> Dict[int, float]:
+        n = len(self.doc_len)
+        if n == 0:
+            return {}
+        avg_len = self.total_len / n
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for row, tf in posting.items():
+                if mask is not None and not mask[row]:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[row] / avg_len)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return scores
+
+
+# ============================
+# Collection
+# ============================
+
+def _match(props: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    for key, value in filters.items():
+        actual = props.get(key)
+        if isinstance(value, list):
+            if actual not in value:
+                return False
+        elif isinstance(value, (str, int, float, bool)):
+            if actual != value:
+                return False
+    return True
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回分数最高的 k 个下标（降序）"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    idx = np.argpartition(-scores, k)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class _LocalCollection:
+    """单个 Collection 的文件与内存索引"""
+
+    def __init__(self, path: Path, index_type: str = "flat"):
+        self.path = path
+        self.index_type = index_type
+        self.vectors_path = path / "vectors.f32"
+        self.log_path = path / "objects.jsonl"
+        self.lock_path = path / ".lock"
+        self._thread_lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.dim: Optional[int] = None
+        self.ids: List[str] = []
+        self.props: List[Dict[str, Any]] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.row_of: Dict[str, int] = {}
+        self.vectors: Optional[np.ndarray] = None
+        self.bm25 = _BM25Index()
+        # 过滤字段的值（随日志重放增量维护）及其 numpy 列（写入后失效，按需重建）
+        self._values: Dict[str, List[Any]] = {field: [] for field in _COLUMN_FIELDS}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._hnsw = None
+        self._hnsw_rows = 0
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+
+    @contextmanager
+    def locked(self, exclusive: bool = False) -> Iterator[None]:
+        """线程锁 + 文件锁（跨进程）；进入后同步其他进程的写入"""
+        with self._thread_lock:
+            if not exclusive and not self.path.exists():
+                # 只读访问不存在的 Collection：不创建目录
+                self._reset()
+                yield
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    self._sync()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------- 日志重放 ----------
+
+    def _sync(self) -> None:
+        if not self.log_path.exists():
+            if self.ids or self.dim is not None:
+                self._reset()
+            return
+        st = os.stat(self.log_path)
+        if st.st_ino != self._log_inode or st.st_size < self._log_offset:
+            # 首次加载，或日志被其他进程压缩重写
+            self._reset()
+            self._log_inode = st.st_ino
+        if st.st_size == self._log_offset:
+            return
+
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._log_offset += end
+        self._remap()
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        op = record["op"]
+        if op == "init":
+            self.dim = record["dim"]
+        elif op == "add":
+            start = record.get("offset", len(self.ids))
+            if start < len(self.ids):
+                logger.error(f"本地向量存储 {self.path.name} 日志行号重叠（{start} < {len(self.ids)}），跳过该记录")
+                return
+            if start > len(self.ids):
+                # 崩溃遗留的孤立向量：占位为失效行，保持行号与向量文件对齐
+                gap = start - len(self.ids)
+                self.ids.extend([""] * gap)
+                self.props.extend({} for _ in range(gap))
+                for values in self._values.values():
+                    values.extend([None] * gap)
+                self.alive = np.concatenate([self.alive, np.zeros(gap, dtype=bool)])
+            alive = np.ones(len(record["rows"]), dtype=bool)
+            for offset, item in enumerate(record["rows"]):
+                row = start + offset
+                old_row = self.row_of.get(item["id"])
+                if old_row is not None:
+                    self._kill(old_row)
+                self.ids.append(item["id"])
+                self.props.append(item["properties"])
+                for field, values in self._values.items():
+                    values.append(item["properties"].get(field))
+                self.row_of[item["id"]] = row
+                self.bm25.add(row, item["properties"].get("content", ""))
+            self.alive = np.concatenate([self.alive, alive])
+            self._columns.clear()
+        elif op == "update":
+            row = self.row_of.get(record["id"])
+            if row is None:
+                return
+            if "content" in record["properties"]:
+                self.bm25.remove(row, self.props[row].get("content", ""))
+                self.bm25.add(row, record["properties"]["content"])
+            self.props[row].update(record["properties"])
+            for field, value in record["properties"].items():
+                if field in self._values:
+                    self._values[field][row] = value
+                    self._columns.pop(field, None)
+        elif op == "delete":
+            for object_id in record["ids"]:
+                row = self.row_of.pop(object_id, None)
+                if row is not None:
+                    self._kill(row)
+
+    def _kill(self, row: int) -> None:
+        if row < len(self.alive):
+            self.alive[row] = False
+        self.bm25.remove(row, self.props[row].get("content", ""))
+
+    def _remap(self) -> None:
+        n = len(self.ids)
+        if n and self.dim:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        else:
+            self.vectors = None
+
+    # ---------- 写入（调用方持有排它锁） ----------
+
+    def _append_log(self, records: List[Dict[str, Any]]) -> None:
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._sync()
+
+    def add(self, rows: List[Tuple[str, Dict[str, Any]]], vectors: np.ndarray) -> None:
+        records = []
+        if self.dim is None:
+            records.append({"op": "init", "dim": int(vectors.shape[1])})
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配：期望 {self.dim}，实际 {vectors.shape[1]}")
+
+        # 先写向量再写日志：其他进程看到日志时向量一定已经落盘。
+        # 上次写入若在两步之间崩溃，向量文件末尾会有日志中不存在的行，先截断
+        start = len(self.ids)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(start * vectors.shape[1] * 4)
+            f.write(_normalize(vectors).astype(np.float32).tobytes())
+        records.append({"op": "add", "offset": start, "rows": [{"id": i, "properties": p} for i, p in rows]})
+        self._append_log(records)
+
+    def update(self, object_id: str, properties: Dict[str, Any]) -> None:
+        self.update_many([object_id], properties)
+
+    def update_many(self, ids: List[str], properties: Dict[str, Any]) -> None:
+        if ids:
+            self._append_log([{"op": "update", "id": object_id, "properties": properties} for object_id in ids])
+
+    def delete(self, ids: List[str]) -> int:
+        ids = [i for i in ids if i in self.row_of]
+        if ids:
+            self._append_log([{"op": "delete", "ids": ids}])
+            self._maybe_compact()
+        return len(ids)
+
+    def _maybe_compact(self) -> None:
+        dead = len(self.ids) - int(self.alive.sum())
+        if dead < _COMPACT_MIN_DEAD_ROWS or dead <= len(self.row_of):
+            return
+        rows = np.flatnonzero(self.alive)
+        tmp_vectors = self.path / "vectors.f32.tmp"
+        tmp_log = self.path / "objects.jsonl.tmp"
+        with open(tmp_vectors, "wb") as f:
+            f.write(np.ascontiguousarray(self.vectors[rows]).tobytes())
+        with open(tmp_log, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "init", "dim": self.dim}) + "\n")
+            f.write(json.dumps({
+                "op": "add",
+                "offset": 0,
+                "rows": [{"id": self.ids[r], "properties": self.props[r]} for r in rows]
+            }, ensure_ascii=False) + "\n")
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_log, self.log_path)
+        logger.info(f"本地向量存储 {self.path.name} 已压缩：移除 {dead} 条失效记录")
+        self._sync()
+
+    # ---------- 检索（调用方持有锁） ----------
+
+    def _column(self, field: str) -> np.ndarray:
+        column = self._columns.get(field)
+        if column is None:
+            column = np.empty(len(self.ids), dtype=object)
+            column[:] = self._values[field]
+            self._columns[field] = column
+        return column
+
+    def mask(self, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        if not filters:
+            return self.alive
+        mask = self.alive.copy()
+        # 列字段做向量化比较，其余字段只在剩余的行上逐行匹配
+        rest: Dict[str, Any] = {}
+        for key, value in filters.items():
+            if key not in self._values:
+                rest[key] = value
+            elif isinstance(value, list):
+                column = self._column(key)
+                matched = np.zeros(len(column), dtype=bool)
+                for item in value:
+                    matched |= column == item
+                mask &= matched
+            elif isinstance(value, (str, int, float, bool)):
+                mask &= self._column(key) == value
+        if rest:
+            for row in np.flatnonzero(mask):
+                if not _match(self.props[row], rest):
+                    mask[row] = False
+        return mask
+
+    def vector_search(self, query_vector: np.ndarray, limit: int, mask: np.ndarray) -> List[Tuple[int, float]]:
+        """返回 [(row, cosine_similarity)]"""
+        if self.vectors is None or limit <= 0 or not mask.any():
+            return []
+        query = _normalize(query_vector.astype(np.float32))
+
+        if self.index_type == "hnsw":
+            hits = self._hnsw_search(query, limit, mask)
+            if hits is not None:
+                return hits
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == len(self.ids):
+            sims = self.vectors @ query
+            top = _top_k(sims, limit)
+            return [(int(r), float(sims[r])) for r in top]
+        sims = self.vectors[candidates] @ query
+        top = _top_k(sims, limit)
+        return [(int(candidates[i]), float(sims[i])) for i in top]
+
+    def _hnsw_search(self, query: np.ndarray, limit: int, mask: np.ndarray) -> Optional[List[Tuple[int, float]]]:
+        """HNSW 近似检索；hnswlib 不可用或过滤后结果不足时返回 None（回退暴力检索）"""
+        try:
+            import hnswlib
+        except ImportError:
+            logger.warning("未安装 hnswlib，本地向量存储使用暴力检索")
+            self.index_type = "flat"
+            return None
+
+        n = len(self.ids)
+        if self._hnsw is None or self._hnsw_rows > n:
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self._hnsw.init_index(max_elements=max(1024, n * 2), ef_construction=200, M=16)
+            self._hnsw_rows = 0
+        if self._hnsw_rows < n:
+            if n > self._hnsw.get_max_elements():
+                self._hnsw.resize_index(n * 2)
+            self._hnsw.add_items(np.asarray(self.vectors[self._hnsw_rows:n]), np.arange(self._hnsw_rows, n))
+            self._hnsw_rows = n
+
+        # 失效行与过滤条件通过过采样后过滤
+        live = int(mask.sum())
+        k = min(n, max(limit * 4, int(limit * n / max(live, 1))))
+        self._hnsw.set_ef(max(k, 64))
+        labels, distances = self._hnsw.knn_query(query, k=k)
+        hits = [
+            (int(row), float(1 - dist))
+            for row, dist in zip(labels[0], distances[0])
+            if mask[row]
+        ][:limit]
+        if len(hits) < min(limit, live):
+            return None
+        return hits
+
+
+# ============================
+# VectorStore 实现
+# ============================
+
+class LocalVectorStore(VectorStore):
+    """
+    本地向量存储
+
+    Args:
+        root: 数据目录，每个 Collection 一个子目录
+        index_type: flat（暴力检索，精确）或 hnsw（需要 hnswlib）
+    """
+
+    def __init__(self, root: str = "./data/vector_store", index_type: str = "flat"):
+        self.root = Path(root)
+        self.index_type = index_type
+        self._collections: Dict[str, _LocalCollection] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> _LocalCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = _LocalCollection(self.root / name, self.index_type)
+                self._collections[name] = collection
+            return collection
+
+    async def _run(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    # ============================
+    # Collection 管理
+    # ============================
+
+    async def create_collection(self, name: str, indexing_config: Optional[Dict[str, Any]] = None) -> bool:
+        (self.root / name).mkdir(parents=True, exist_ok=True)
+        return True
+
+    async def delete_collection(self, name: str) -> bool:
+        def _delete():
+            collection = self._get(name)
+            with collection.locked(exclusive=True):
+                shutil.rmtree(collection.path, ignore_errors=True)
+                collection._reset()
+        await self._run(_delete)
+        return True
+
+    async def list_collections(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir())
+
+    # ============================
+    # 写入
+    # ============================
+
+    async def add_documents(
+        self,
+        collection_name: str,
+        documents: List[Dict[str, Any]],
+        vectors: List[List[float]]
+    ) -> List[str]:
+        if len(documents) != len(vectors):
+            raise ValueError("Documents and vectors must have the same length.")
+        if not documents:
+            return []
+
+        rows = [(str(uuid_lib.uuid4()), to_properties(doc)) for doc in documents]
+        array = np.asarray(vectors, dtype=np.float32)
+
+        def _add():
+            collection = self._get(collection_name)
+            with collection.locked(exclusive=True):
+                collection.add(rows, array)
+
+        await self._run(_add)
+        return [object_id for object_id, _ in rows]
+
+    async def update_object(
+        self,
+        collection_name: str,
+        uuid: str,
+        properties: Optional[Dict[str, Any]] = None,
+        vector: Optional[List[float]] = None
+    ) -> bool:
+        def _update():
+            collection = self._get(collection_name)
+            with collection.locked(exclusive=True):
+                row = collection.row_of.get(uuid)
+                if row is None:
+                    return False
+                if vector is not None:
+                    # 向量变化时追加新行，旧行失效
+                    props = {**collection.props[row], **(properties or {})}
+                    collection.add([(uuid, props)], np.asarray([vector], dtype=np.float32))
+                elif properties:
+                    collection.update(uuid, properties)
+                return True
+
+        try:
+            return await self._run(_update)
+        except Exception as e:
+            logger.error(f"Update object failed: {e}")
+            return False
+
+    async def update_by_filter(
+        self,
+        collection_name: str,
+        filters: Dict[str, Any],
+        properties: Dict[str, Any]
+    ) -> int:
+        if not filters:
+            logger.warning("Update operation aborted: No filters provided (would update all).")
+            return 0
+
+        def _update():
+            collection = self._get(collection_name)
+            with collection.locked(exclusive=True):
+                ids = [collection.ids[r] for r in np.flatnonzero(collection.mask(filters))]
+                collection.update_many(ids, properties)
+                return len(ids)
+
+        try:
+            return await self._run(_update)
+        except Exception as e:
+            logger.error(f"Update by filter failed: {e}")
+            return 0
+
+    async def delete_documents(self, collection_name: str, filters: Dict[str, Any]) -> int:
+        if not filters:
+            logger.warning("Delete operation aborted: No filters provided (would delete all).")
+            return 0
+
+        def _delete():
+            collection = self._get(collection_name)
+            with collection.locked(exclusive=True):
+                mask = collection.mask(filters)
+                return collection.delete([collection.ids[r] for r in np.flatnonzero(mask)])
+
+        return await self._run(_delete)
+
+    async def delete_by_ids(self, collection_name: str, ids: List[str]) -> int:
+        def _delete():
+            collection = self._get(collection_name)
+            with collection.locked(exclusive=True):
+                return collection.delete(list(ids))
+
+        return await self._run(_delete)
+
+    # ============================
+    # 检索
+    # ============================
+
+    def _vector_hits(
+        self,
+        collection: _LocalCollection,
+        query_vector: List[float],
+        limit: int,
+        mask: np.ndarray
+    ) -> List[Tuple[int, float]]:
+        return collection.vector_search(np.asarray(query_vector, dtype=np.float32), limit, mask)
+
+    @staticmethod
+    def _bm25_hits(collection: _LocalCollection, query: str, limit: int, mask: np.ndarray) -> List[Tuple[int, float]]:
+        scores = collection.bm25.search(query, mask)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+    async def vector_search(
+        self,
+        collection_name: str,
+        query_vector: List[float],
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        def _search():
+            collection = self._get(collection_name)
+            with collection.locked():
+                hits = self._vector_hits(collection, query_vector, limit, collection.mask(filters))
+                results = []
+                for row, sim in hits:
+                    distance = 1.0 - sim
+                    results.append(to_search_result(
+                        collection.ids[row], collection.props[row], 1.0 / (1.0 + distance), distance
+                    ))
+                return results
+
+        try:
+            return await self._run(_search)
+        except Exception as e:
+            logger.error(f"Vector search failed: {e}")
+            return []
+
+    async def bm25_search(
+        self,
+        collection_name: str,
+        query: str,
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        def _search():
+            collection = self._get(collection_name)
+            with collection.locked():
+                hits = self._bm25_hits(collection, query, limit, collection.mask(filters))
+                return [
+                    to_search_result(collection.ids[row], collection.props[row], score)
+                    for row, score in hits
+                ]
+
+        try:
+            return await self._run(_search)
+        except Exception as e:
+            logger.error(f"BM25 search failed: {e}")
+            return []
+
+    async def hybrid_search(
+        self,
+        collection_name: str,
+        query: str,
+        query_vector: List[float],
+        alpha: float = 0.5,
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """
+        混合检索
+
+        与 Weaviate 默认的 relativeScoreFusion 一致：两路分数分别做 min-max 归一化后
+        按 alpha 加权求和。
+        """
+        def _normalized(hits: List[Tuple[int, float]]) -> Dict[int, float]:
+            if not hits:
+                return {}
+            values = [score for _, score in hits]
+            low, high = min(values), max(values)
+            span = high - low
+            return {row: (score - low) / span if span > 0 else 1.0 for row, score in hits}
+
+        def _search():
+            collection = self._get(collection_name)
+            with collection.locked():
+                mask = collection.mask(filters)
+                candidates = max(limit * 4, _HYBRID_MIN_CANDIDATES)
+                vector_hits = self._vector_hits(collection, query_vector, candidates, mask) if alpha > 0 else []
+                keyword_hits = self._bm25_hits(collection, query, candidates, mask) if alpha < 1 else []
+
+                similarities = dict(vector_hits)
+                vector_scores = _normalized(vector_hits)
+                keyword_scores = _normalized(keyword_hits)
+                fused = {
+                    row: alpha * vector_scores.get(row, 0.0) + (1 - alpha) * keyword_scores.get(row, 0.0)
+                    for row in set(vector_scores) | set(keyword_scores)
+                }
+                top = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:limit]
+                return [
+                    to_search_result(
+                        collection.ids[row],
+                        collection.props[row],
+                        score,
+                        1.0 - similarities[row] if row in similarities else None
+                    )
+                    for row, score in top
+                ]
+
+        try:
+            return await self._run(_search)
+        except Exception as e:
+            logger.error(f"Hybrid search failed: {e}")
+            return []
+
+    # ============================
+    # 查询与统计
+    # ============================
+
+    async def find_uuid(self, collection_name: str, filters: Dict[str, Any]) -> Optional[str]:
+        def _find():
+            collection = self._get(collection_name)
+            with collection.locked():
+                rows = np.flatnonzero(collection.mask(filters))
+                return collection.ids[rows[0]] if len(rows) else None
+
+        return await self._run(_find)
+
+    async def get_document_by_id(self, collection_name: str, doc_id: str) -> Optional[SearchResult]:
+        def _get():
+            collection = self._get(collection_name)
+            with collection.locked():
+                row = collection.row_of.get(doc_id)
+                if row is None:
+                    return None
+                return to_search_result(doc_id, collection.props[row], None)
+
+        return await self._run(_get)
+
+    async def count_documents(self, collection_name: str, filters: Optional[Dict[str, Any]] = None) -> int:
+        def _count():
+            collection = self._get(collection_name)
+            with collection.locked():
+                return int(collection.mask(filters).sum())
+
+        return await self._run(_count)
@@ -1,17 +1,38 @@
 """
 Reranker 重排序模块
 
-使用 LangChain 集成的 DashScope Rerank 模型对检索结果重排序。
+对检索结果重排序。提供方（KnowledgeBase.rerank_provider）：
+
+- dashscope（默认）：DashScope text-rerank 接口
+- local：本地 CPU cross-encoder（sentence-transformers / ONNX），在推理进程池中执行，
+  并发请求的 (query, 文档) 对经动态批处理合并为一次前向计算
+- cascade：本地 cross-encoder 先粗排剪枝到 RERANK_CASCADE_CANDIDATES 条，
+  再由远程模型（rerank_model）精排
+
+实现要点：
+- 异步接口：直接调用 DashScope text-rerank HTTP 接口，长连接客户端按事件循环复用
+- 请求隔离：top_k / score_threshold 均为调用参数，实例不保存请求状态，可在并发请求间共享
+- 结果按服务端返回的 index 映射回输入位置（内容相同的分段也不会错位）；
+  内容重复的文档只送审一次，分数回填到所有位置
+- 候选集较大时按 RERANK_BATCH_SIZE 切分批次并发请求（受 RERANK_MAX_CONCURRENCY 限制），
+  相关性分数与批次无关，合并后统一排序
 
 Author: chunlin
 """
 
-from typing import List, Optional
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import asyncio
+import logging
+import weakref
+
+from configs import get_settings
 
+logger = logging.getLogger(__name__)
 
-@dataclass 
+
+@dataclass
 class RerankResult:
     """重排序结果"""
     content: str
@@ -20,41 +41,14 @@ class RerankResult:
     metadata: dict
 
 
-class DashScopeReranker:
-    """
-    DashScope Reranker (基于 LangChain 集成)
-    
-    使用 langchain_community 的 DashScopeRerank 组件。
-    
-    模型选项：
-    - gte-rerank (默认)
-    """
-    
-    def __init__(
-        self, 
-        model_name: str = "gte-rerank",
-        top_n: int = 10,
-        api_key: Optional[str] = None
-    ):
-        self.model_name = model_name
-        self.top_n = top_n
-        self.api_key = api_key
-        self._reranker = None
-    
-    def _get_reranker(self):
-        """懒加载 LangChain DashScopeRerank 实例"""
-        if self._reranker is None:
-            from langchain_community.document_compressors.dashscope_rerank import DashScopeRerank
-            from configs import get_settings
-            
-            settings = get_settings()
-            self._reranker = DashScopeRerank(
-                model=self.model_name,
-                top_n=self.top_n,
-                dashscope_api_key=self.api_key or settings.dashscope_api_key
-            )
-        return self._reranker
-    
+class BaseReranker(ABC):
+    """重排序基类"""
+
+    @abstractmethod
+    async def score(self, query: str, texts: List[str]) -> List[float]:
+        """计算每个文本与查询的相关性分数，输出顺序与输入一致"""
+        pass
+
     async def rerank(
         self,
         query: str,
@@ -64,62 +58,230 @@ class DashScopeReranker:
     ) -> List[RerankResult]:
         """
         对文档进行重排序
-        
+
         Args:
             query: 查询文本
             documents: 文档列表，每个包含 content 和 metadata
-            top_k: 返回前 K 个结果
+            top_k: 返回前 K 个结果，为空时使用实例默认值
             score_threshold: 分数阈值
-            
+
         Returns:
-            重排序后的结果列表
+            重排序后的结果列表（按分数降序）
         """
         if not documents:
             return []
-        
-        from langchain_core.documents import Document as LCDocument
-        
-        # 转换为 LangChain Document 格式
-        lc_docs = [
-            LCDocument(
-                page_content=d.get("content", ""),
-                metadata=d.get("metadata", {})
-            )
-            for d in documents
-        ]
-        
-        # 在线程池中执行（reranker.compress_documents 是同步方法）
-        loop = asyncio.get_event_loop()
-        reranker = self._get_reranker()
-        
-        # 动态设置 top_n
-        if top_k:
-            reranker.top_n = top_k
-        
-        compressed_docs = await loop.run_in_executor(
-            None,
-            lambda: reranker.compress_documents(lc_docs, query)
-        )
-        
-        # 构建结果
+
+        # 内容去重：重复分段只送审一次
+        unique_texts: List[str] = []
+        positions: Dict[str, int] = {}
+        slots = []
+        for d in documents:
+            text = d.get("content", "")
+            if text not in positions:
+                positions[text] = len(unique_texts)
+                unique_texts.append(text)
+            slots.append(positions[text])
+
+        scores = await self.score(query, unique_texts)
+
+        order = sorted(range(len(documents)), key=lambda i: (-scores[slots[i]], i))
+        limit = top_k or getattr(self, "top_n", None)
         results = []
-        for i, doc in enumerate(compressed_docs):
-            score = doc.metadata.get("relevance_score", 0.0)
-            
+        for i in order:
+            score = scores[slots[i]]
             if score_threshold is not None and score < score_threshold:
-                continue
-            
-            # 查找原始索引
-            original_idx = next(
-                (j for j, d in enumerate(documents) if d.get("content") == doc.page_content),
-                i
-            )
-            
+                break
+            document = documents[i]
             results.append(RerankResult(
-                content=doc.page_content,
+                content=document.get("content", ""),
                 score=score,
-                original_index=original_idx,
-                metadata=doc.metadata
+                original_index=i,
+                metadata={**(document.get("metadata") or {}), "relevance_score": score}
             ))
-        
+            if limit and len(results) >= limit:
+                break
         return results
+
+
+_client_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[Any, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def _get_pooled_client() -> Tuple[Any, asyncio.Semaphore]:
+    """
+    获取长连接的 httpx.AsyncClient 及其并发信号量
+
+    httpx 连接池绑定事件循环，每个事件循环（FastAPI 主循环、Celery 任务循环）各自维护一份。
+    """
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    if loop not in _client_pools:
+        settings = get_settings()
+        client = httpx.AsyncClient(timeout=settings.rerank_timeout)
+        _client_pools[loop] = (client, asyncio.Semaphore(settings.rerank_max_concurrency))
+    return _client_pools[loop]
+
+
+class DashScopeReranker(BaseReranker):
+    """
+    DashScope Reranker
+
+    调用 DashScope text-rerank 接口。
+
+    模型选项：
+    - gte-rerank (默认)
+    """
+
+    max_retries: int = 2
+
+    def __init__(
+        self,
+        model_name: str = "gte-rerank",
+        top_n: int = 10,
+        api_key: Optional[str] = None
+    ):
+        settings = get_settings()
+        self.model_name = model_name
+        self.top_n = top_n
+        self.api_key = api_key or settings.dashscope_api_key
+        self.url = settings.dashscope_rerank_url
+        self.batch_size = max(1, settings.rerank_batch_size)
+
+    async def _score_batch(self, query: str, texts: List[str]) -> List[float]:
+        client, semaphore = _get_pooled_client()
+        payload = {
+            "model": self.model_name,
+            "input": {"query": query, "documents": texts},
+            "parameters": {"top_n": len(texts), "return_documents": False},
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    response = await client.post(self.url, json=payload, headers=headers)
+                response.raise_for_status()
+                scores = [0.0] * len(texts)
+                for item in response.json()["output"]["results"]:
+                    scores[item["index"]] = float(item["relevance_score"])
+                return scores
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Rerank 批次失败（{len(texts)} 条），{delay}s 后重试: {e}")
+                await asyncio.sleep(delay)
+
+    async def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        batches = [
+            texts[i:i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        results = await asyncio.gather(*[self._score_batch(query, batch) for batch in batches])
+        return [score for batch_scores in results for score in batch_scores]
+
+
+class LocalReranker(BaseReranker):
+    """
+    本地 cross-encoder 重排序（CPU）
+
+    推荐模型：
+    - BAAI/bge-reranker-base（中英文，默认）
+    - cross-encoder/ms-marco-MiniLM-L-6-v2（英文，轻量）
+    """
+
+    def __init__(self, model_name: Optional[str] = None, top_n: int = 10):
+        settings = get_settings()
+        self.model_name = model_name or settings.local_rerank_model
+        self.top_n = top_n
+        self.backend = settings.local_rerank_backend
+        self.device = settings.local_embedding_device
+        self.max_batch_size = settings.local_rerank_max_batch_size
+        self.max_wait_ms = settings.local_rerank_max_wait_ms
+
+    async def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        from .local_inference import _worker_predict, run_in_inference_pool
+        return await run_in_inference_pool(_worker_predict, self.model_name, self.backend, self.device, pairs)
+
+    async def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        from .local_inference import DynamicBatcher, get_batcher
+        batcher = get_batcher(
+            ("cross_encoder", self.model_name, self.backend, self.device),
+            lambda: DynamicBatcher(self._predict, self.max_batch_size, self.max_wait_ms)
+        )
+        return list(await asyncio.gather(*[batcher.submit((query, text)) for text in texts]))
+
+
+class CascadeReranker(BaseReranker):
+    """
+    级联重排序：本地模型剪枝 + 远程模型精排
+
+    本地 cross-encoder 对全部候选打分，只把前 candidates 条交给远程模型，
+    远程调用量与候选集大小无关，延迟可预期。最终分数为远程模型分数。
+    """
+
+    def __init__(self, local: BaseReranker, remote: BaseReranker, candidates: int = 20, top_n: int = 10):
+        self.local = local
+        self.remote = remote
+        self.candidates = candidates
+        self.top_n = top_n
+
+    async def score(self, query: str, texts: List[str]) -> List[float]:
+        return await self.remote.score(query, texts)
+
+    async def rerank(
+        self,
+        query: str,
+        documents: List[dict],
+        top_k: Optional[int] = None,
+        score_threshold: Optional[float] = None
+    ) -> List[RerankResult]:
+        if len(documents) <= self.candidates:
+            return await self.remote.rerank(query, documents, top_k=top_k or self.top_n, score_threshold=score_threshold)
+
+        pruned = await self.local.rerank(query, documents, top_k=self.candidates)
+        results = await self.remote.rerank(
+            query,
+            [documents[r.original_index] for r in pruned],
+            top_k=top_k or self.top_n,
+            score_threshold=score_threshold
+        )
+        for r in results:
+            r.original_index = pruned[r.original_index].original_index
+        return results
+
+
+async def get_reranker(provider: Optional[str], model: Optional[str], top_n: int = 10) -> BaseReranker:
+    """
+    按提供方创建重排序器（远程提供方的凭证来自 ModelProvider）
+
+    Args:
+        provider: dashscope / local / cascade，为空时使用 dashscope
+        model: 模型名称；cascade 模式下为远程精排模型，本地模型由 LOCAL_RERANK_MODEL 指定
+        top_n: 调用方未传 top_k 时的默认返回条数
+    """
+    provider = provider or "dashscope"
+    if provider == "local":
+        return LocalReranker(model_name=model, top_n=top_n)
+    if provider not in ("dashscope", "cascade"):
+        raise ValueError(f"Unknown rerank provider: {provider}")
+
+    from database.models import ModelProvider
+
+    provider_obj = await ModelProvider.get_or_none(name="dashscope")
+    remote = DashScopeReranker(
+        model_name=model or "gte-rerank",
+        top_n=top_n,
+        api_key=provider_obj.api_key if provider_obj else None
+    )
+    if provider == "dashscope":
+        return remote
+    return CascadeReranker(
+        local=LocalReranker(top_n=top_n),
+        remote=remote,
+        candidates=get_settings().rerank_cascade_candidates,
+        top_n=top_n
+    )
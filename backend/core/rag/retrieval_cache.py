@@ -0,0 +1,131 @@
+"""
+检索结果缓存
+
+命中测试、知识库查询 API、Agent RAG、知识检索节点会反复发起完全相同的检索
+（同一知识库、查询、模式、top_k、alpha、过滤条件）。命中时直接返回结果，
+跳过查询向量化和向量检索。
+
+- 进程内 LRU 为一级缓存，Redis 为二级缓存
+- 缓存键包含知识库的索引版本号；索引任务、文档/分段启用禁用、分段更新、删除时
+  调用 bump_index_version() 递增版本，旧条目不再被命中，随 LRU / TTL 自然淘汰
+- 版本号保存在 Redis，API 多进程与 Celery Worker 共享，任一进程的写操作对其他进程
+  立即可见。因此缓存依赖 Redis：未开启 CACHE_REDIS_ENABLED 时不启用（进程内版本号
+  感知不到其他进程的写入，会返回过期结果）
+
+Author: chunlin
+"""
+
+import json
+import logging
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
+
+import xxhash
+
+from configs import get_settings
+from core.cache import CacheStats, LRUCache, get_redis
+from .vector_store import SearchResult
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalCache:
+    """带索引版本号的检索结果缓存"""
+
+    def __init__(self, max_entries: int = 4096, ttl: int = 300, key_prefix: str = "retrieval_cache:"):
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.local = LRUCache(max_entries=max_entries, default_ttl=ttl)
+        self.stats = CacheStats()
+
+    def _version_key(self, kb_id: int) -> str:
+        return f"{self.key_prefix}version:{kb_id}"
+
+    async def get_version(self, kb_id: int) -> str:
+        """获取知识库当前的索引版本号（Redis 不可用时抛出异常，调用方按未命中处理）"""
+        redis = get_redis()
+        if redis is None:
+            raise RuntimeError("检索缓存需要 Redis")
+        value = await redis.get(self._version_key(kb_id))
+        return f"r{int(value or 0)}"
+
+    async def bump_version(self, kb_id: int) -> None:
+        """递增知识库的索引版本号，使该知识库的全部缓存条目失效"""
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.incr(self._version_key(kb_id))
+            except Exception as e:
+                logger.warning(f"递增检索缓存版本失败: {e}")
+
+    def make_key(self, kb_id: int, version: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return f"{self.key_prefix}{kb_id}:{version}:{xxhash.xxh3_128_hexdigest(payload.encode('utf-8'))}"
+
+    @staticmethod
+    def _copy(results: List[SearchResult]) -> List[SearchResult]:
+        # 调用方可能原地修改 metadata，返回副本避免污染缓存
+        return [SearchResult(id=r.id, content=r.content, score=r.score, metadata=dict(r.metadata)) for r in results]
+
+    async def get(self, key: str) -> Optional[List[SearchResult]]:
+        results = self.local.get(key)
+        if results is not None:
+            self.stats.hits += 1
+            return self._copy(results)
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(key)
+                if raw is not None:
+                    results = [SearchResult(**item) for item in json.loads(raw)]
+                    self.local.set(key, results)
+                    self.stats.redis_hits += 1
+                    return self._copy(results)
+            except Exception as e:
+                logger.warning(f"读取检索缓存失败: {e}")
+
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, results: List[SearchResult]) -> None:
+        self.local.set(key, self._copy(results))
+        redis = get_redis()
+        if redis is not None:
+            try:
+                payload = json.dumps([asdict(r) for r in results], ensure_ascii=False, default=str)
+                await redis.set(key, payload, ex=self.ttl or None)
+            except Exception as e:
+                logger.warning(f"写入检索缓存失败: {e}")
+
+
+_retrieval_cache: Optional[RetrievalCache] = None
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """获取全局检索结果缓存（懒加载单例），RETRIEVAL_CACHE_ENABLED 关闭或 Redis 不可用时返回 None"""
+    global _retrieval_cache
+    settings = get_settings()
+    if not settings.retrieval_cache_enabled or get_redis() is None:
+        return None
+    if _retrieval_cache is None:
+        _retrieval_cache = RetrievalCache(
+            max_entries=settings.retrieval_cache_size,
+            ttl=settings.retrieval_cache_ttl,
+        )
+    return _retrieval_cache
+
+
+async def bump_index_version(kb_id: int) -> None:
+    """
+    知识库索引内容变化后调用（写穿失效）
+
+    失败只记录日志，不影响写操作本身。
+    """
+    cache = get_retrieval_cache()
+    if cache is None:
+        return
+    try:
+        await cache.bump_version(int(kb_id))
+    except Exception as e:
+        logger.warning(f"知识库 {kb_id} 检索缓存失效失败: {e}")
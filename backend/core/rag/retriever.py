@@ -6,7 +6,9 @@
 Author: chunlin
 """
 
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Tuple
 from enum import Enum
 
 from pydantic import Field
@@ -14,8 +16,17 @@ from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
 
-from .weaviate_client import WeaviateClient, SearchResult
+from configs import get_settings
+from core.cache import LRUCache
+from .vector_store import ACTIVE_FILTERS, SearchResult
 from .embedding import EmbeddingService
+from .embedding_cache import get_query_embedding_cache
+from .retrieval_cache import get_retrieval_cache
+
+logger = logging.getLogger(__name__)
+
+# 结果被过滤后自适应扩大检索数量的最大轮数（每轮 limit 翻倍）
+_MAX_OVERFETCH_ROUNDS = 3
 
 
 class RetrievalMode(Enum):
@@ -36,10 +47,11 @@ class WeaviateHybridRetriever(BaseRetriever):
     - 纯 BM25 检索 (keyword)
     - 混合检索（向量 + BM25）(hybrid)
     - Metadata 过滤
+    - 启用 / 归档状态过滤下推到向量存储（active_only）；可选按数据库状态校验（RETRIEVAL_VERIFY_STATUS）
     """
     
     # Pydantic 字段声明
-    weaviate_client: Any = Field(description="Weaviate client instance")
+    weaviate_client: Any = Field(description="VectorStore instance (Weaviate or local)")
     embedding_service: Any = Field(description="Embedding service instance")
     collection_name: str = Field(description="Weaviate collection name")
     mode: str = Field(default="hybrid", description="Retrieval mode: semantic, keyword, hybrid")
@@ -47,6 +59,8 @@ class WeaviateHybridRetriever(BaseRetriever):
     alpha: float = Field(default=0.5, description="Hybrid search weight (0=BM25, 1=Vector)")
     score_threshold: float = Field(default=0.0, description="Minimum score threshold")
     filters: Optional[Dict[str, Any]] = Field(default=None, description="Metadata filters")
+    knowledge_base_id: Optional[int] = Field(default=None, description="Knowledge base ID (enables the retrieval result cache)")
+    active_only: bool = Field(default=True, description="Only return enabled, non-archived segments (filtered in the vector store)")
     
     # Pydantic v2 配置
     model_config = {"arbitrary_types_allowed": True}
@@ -92,64 +106,266 @@ class WeaviateHybridRetriever(BaseRetriever):
             for r in results
         ]
     
-    async def retrieve_raw(self, query: str) -> List[SearchResult]:
+    async def retrieve_raw(
+        self,
+        query: str,
+        query_vector: Optional[List[float]] = None,
+        use_cache: bool = True
+    ) -> List[SearchResult]:
         """
         异步检索，返回原始 SearchResult 格式
         
         供需要直接访问 SearchResult 的场景使用。
+
+        Args:
+            query: 查询文本
+            query_vector: 预先计算好的查询向量（多个知识库共享同一向量时传入，避免重复 embedding）
+            use_cache: 是否读写检索结果缓存（调用方已通过 cached_results_many 批量查询过时传 False）
         """
         print(f"[RETRIEVER DEBUG] retrieve_raw called, mode={self.mode}")
+        cache_key = None
+        if use_cache:
+            cache_key, cached = await self.cached_results(query)
+            if cached is not None:
+                return cached
+
         mode = RetrievalMode(self.mode)
-        
-        if mode == RetrievalMode.SEMANTIC:
-            results = await self._semantic_search(query)
-        elif mode == RetrievalMode.KEYWORD:
-            results = await self._keyword_search(query)
-        else:
-            results = await self._hybrid_search(query)
-        
-        print(f"[RETRIEVER DEBUG] retrieve_raw got {len(results)} results before threshold filter")
-        
-        # 分数过滤
-        if self.score_threshold > 0:
-            print(f"[RETRIEVER DEBUG] score_threshold={self.score_threshold}, first result score={results[0].score if results else 'N/A'}")
-            results = [r for r in results if r.score is not None and r.score >= self.score_threshold]
-            print(f"[RETRIEVER DEBUG] retrieve_raw got {len(results)} results after threshold filter")
-        
+        if query_vector is None and mode != RetrievalMode.KEYWORD:
+            query_vector = await get_query_embedding_cache().get_or_embed(self.embedding_service, query)
+
+        # 状态过滤已下推到向量存储；开启 RETRIEVAL_VERIFY_STATUS 时再按数据库状态过滤，
+        # 过滤掉结果时逐轮扩大 limit 补足 top_k，直到结果足够或已取尽
+        limit = self.top_k
+        for _ in range(_MAX_OVERFETCH_ROUNDS):
+            if mode == RetrievalMode.SEMANTIC:
+                candidates = await self._semantic_search(query, query_vector, limit)
+            elif mode == RetrievalMode.KEYWORD:
+                candidates = await self._keyword_search(query, limit)
+            else:
+                candidates = await self._hybrid_search(query, query_vector, limit)
+            print(f"[RETRIEVER DEBUG] retrieve_raw got {len(candidates)} results before threshold filter")
+
+            active = await self._drop_inactive(candidates)
+            results = [
+                r for r in active
+                if self.score_threshold <= 0 or (r.score is not None and r.score >= self.score_threshold)
+            ]
+            # 分数阈值过滤掉的是排序靠后的结果，扩大 limit 无法补足，只对状态过滤补取
+            if len(results) >= self.top_k or len(candidates) < limit or len(active) == len(candidates):
+                break
+            limit *= 2
+        results = results[:self.top_k]
+
+        if cache_key is not None:
+            await self.store_cached(cache_key, results)
+
         return results
-    
-    async def _semantic_search(self, query: str) -> List[SearchResult]:
+
+    async def store_cached(self, cache_key: Optional[str], results: List[SearchResult]) -> None:
+        """写入检索结果缓存（cache_key 来自 cached_results / cached_results_many）"""
+        cache = get_retrieval_cache()
+        if cache is None or cache_key is None:
+            return
+        await cache.set(cache_key, results)
+
+    async def _drop_inactive(self, results: List[SearchResult]) -> List[SearchResult]:
+        """
+        按数据库状态过滤已禁用 / 归档的文档和已禁用的分段
+
+        默认关闭（状态由切换接口和 /sync-status 同步到向量存储）；RETRIEVAL_VERIFY_STATUS
+        开启时对知识库检索器（设置了 knowledge_base_id）生效，每轮检索两条查询。
+        用于升级后、/sync-status 执行完成前的过渡期。
+        """
+        if not get_settings().retrieval_verify_status:
+            return results
+        if not self.active_only or self.knowledge_base_id is None or not results:
+            return results
+
+        from database.models import Document, DocumentSegment
+        from tortoise.expressions import Q
+
+        doc_ids = {int(r.metadata["doc_id"]) for r in results if str(r.metadata.get("doc_id") or "").isdigit()}
+        segment_ids = {int(r.metadata["segment_id"]) for r in results if r.metadata.get("segment_id")}
+        inactive_docs, inactive_segments = await asyncio.gather(
+            Document.filter(id__in=doc_ids).filter(Q(enabled=False) | Q(archived=True)).values_list("id", flat=True),
+            DocumentSegment.filter(id__in=segment_ids, enabled=False).values_list("id", flat=True),
+        )
+        inactive_docs = {str(d) for d in inactive_docs}
+        inactive_segments = set(inactive_segments)
+        if not inactive_docs and not inactive_segments:
+            return results
+        return [
+            r for r in results
+            if str(r.metadata.get("doc_id")) not in inactive_docs
+            and r.metadata.get("segment_id") not in inactive_segments
+        ]
+
+    def _store_filters(self) -> Optional[Dict[str, Any]]:
+        """传给向量存储的过滤条件（合并状态过滤）"""
+        if not self.active_only:
+            return self.filters
+        return {**ACTIVE_FILTERS, **(self.filters or {})}
+
+    async def cached_results(self, query: str) -> Tuple[Optional[str], Optional[List[SearchResult]]]:
+        """
+        查询检索结果缓存
+
+        缓存键由知识库索引版本、查询及全部检索参数组成。
+
+        Returns:
+            (缓存键, 命中的结果)；未设置 knowledge_base_id 或缓存关闭时为 (None, None)
+        """
+        return (await self.cached_results_many([query]))[0]
+
+    async def cached_results_many(
+        self,
+        queries: List[str]
+    ) -> List[Tuple[Optional[str], Optional[List[SearchResult]]]]:
+        """批量查询检索结果缓存（索引版本只读取一次）"""
+        cache = get_retrieval_cache()
+        if cache is None or self.knowledge_base_id is None:
+            return [(None, None)] * len(queries)
+
+        # 数值统一类型：model_copy(update=...) 不做校验，保证与单条检索的缓存键一致
+        params = {
+            "collection": self.collection_name,
+            "embedding": await self.embedding_service.get_cache_namespace(),
+            "mode": RetrievalMode(self.mode).value,
+            "top_k": int(self.top_k),
+            "alpha": float(self.alpha),
+            "score_threshold": float(self.score_threshold),
+            "filters": self._store_filters(),
+        }
+        try:
+            version = await cache.get_version(self.knowledge_base_id)
+            keys = [cache.make_key(self.knowledge_base_id, version, {**params, "query": q}) for q in queries]
+            return list(zip(keys, await asyncio.gather(*[cache.get(key) for key in keys])))
+        except Exception as e:
+            logger.warning(f"检索缓存不可用: {e}")
+            return [(None, None)] * len(queries)
+
+    async def _semantic_search(self, query: str, query_vector: List[float], limit: int) -> List[SearchResult]:
         """纯向量检索"""
-        query_vector = await self.embedding_service.embed_query(query)
         print(f"[RETRIEVER DEBUG] _semantic_search called, collection: {self.collection_name}")
         
         results = await self.weaviate_client.vector_search(
             collection_name=self.collection_name,
             query_vector=query_vector,
-            limit=self.top_k,
-            filters=self.filters
+            limit=limit,
+            filters=self._store_filters()
         )
         print(f"[RETRIEVER DEBUG] _semantic_search got {len(results)} results")
         return results
     
-    async def _keyword_search(self, query: str) -> List[SearchResult]:
+    async def _keyword_search(self, query: str, limit: int) -> List[SearchResult]:
         """纯 BM25 检索"""
         return await self.weaviate_client.bm25_search(
             collection_name=self.collection_name,
             query=query,
-            limit=self.top_k,
-            filters=self.filters
+            limit=limit,
+            filters=self._store_filters()
         )
     
-    async def _hybrid_search(self, query: str) -> List[SearchResult]:
+    async def _hybrid_search(self, query: str, query_vector: List[float], limit: int) -> List[SearchResult]:
         """混合检索"""
-        query_vector = await self.embedding_service.embed_query(query)
-        
         return await self.weaviate_client.hybrid_search(
             collection_name=self.collection_name,
             query=query,
             query_vector=query_vector,
-            limit=self.top_k,
+            limit=limit,
             alpha=self.alpha,
-            filters=self.filters
+            filters=self._store_filters()
         )
+
+
+# 知识库 ID -> (指纹, 检索器)
+_kb_retrievers = LRUCache(max_entries=256)
+
+
+async def get_knowledge_base_retriever(kb_id: int) -> Tuple[Optional[Any], Optional[WeaviateHybridRetriever]]:
+    """
+    获取知识库的检索器（按知识库缓存）
+
+    检索器使用知识库的 embedding 配置（凭证来自 ModelProvider）和默认检索模式，
+    复用 EmbeddingService 与全局向量存储连接。知识库更新（updated_at 变化）或
+    凭证变化时重建。调用方需要不同的 top_k / 阈值时使用 model_copy(update=...)，
+    不要直接修改缓存的实例。
+
+    Returns:
+        (knowledge_base, retriever)，知识库不存在时为 (None, None)
+    """
+    from database.models import KnowledgeBase, ModelProvider
+    from .db_conn import get_vector_store, kb_collection_name
+
+    kb = await KnowledgeBase.get_or_none(id=kb_id)
+    if kb is None:
+        return None, None
+
+    api_key = None
+    api_base = None
+    if kb.embedding_provider and kb.embedding_provider != "local":
+        provider_obj = await ModelProvider.get_or_none(name=kb.embedding_provider)
+        if provider_obj:
+            api_key = provider_obj.api_key
+            api_base = provider_obj.api_base
+
+    fingerprint = (kb.updated_at, api_key, api_base)
+    cached = _kb_retrievers.get(kb_id)
+    if cached is not None and cached[0] == fingerprint:
+        return kb, cached[1]
+
+    retriever = WeaviateHybridRetriever(
+        weaviate_client=get_vector_store(),
+        embedding_service=EmbeddingService(
+            provider=kb.embedding_provider,
+            model=kb.embedding_model,
+            api_key=api_key,
+            api_base=api_base,
+            dimensions=(kb.indexing_config or {}).get("dimensions")
+        ),
+        collection_name=kb_collection_name(kb),
+        mode=kb.retrieval_mode or RetrievalMode.HYBRID.value,
+        knowledge_base_id=kb.id,
+    )
+    _kb_retrievers.set(kb_id, (fingerprint, retriever))
+    return kb, retriever
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: List[List[SearchResult]],
+    k: int = 60
+) -> List[SearchResult]:
+    """
+    RRF 融合多路检索结果
+
+    不同知识库、不同检索模式返回的原始分数量纲不同（距离换算分数、BM25 分数、
+    混合检索分数），不能直接比较。RRF 只依赖各路结果内部的排名：
+    score = Σ 1 / (k + rank)。
+
+    Args:
+        ranked_lists: 多路已按相关度排序的检索结果
+        k: 平滑常数（默认 60）
+
+    Returns:
+        按融合分数降序排列的结果，score 字段为融合分数，原始分数保存在 metadata["raw_score"]
+    """
+    fused: Dict[str, SearchResult] = {}
+    scores: Dict[str, float] = {}
+
+    for results in ranked_lists:
+        for rank, r in enumerate(results, 1):
+            key = f"{r.metadata.get('knowledge_base_id', '')}:{r.id}"
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            if key not in fused:
+                fused[key] = r
+
+    merged = []
+    for key in sorted(scores, key=scores.get, reverse=True):
+        r = fused[key]
+        merged.append(SearchResult(
+            id=r.id,
+            content=r.content,
+            score=scores[key],
+            metadata={**r.metadata, "raw_score": r.score}
+        ))
+    return merged
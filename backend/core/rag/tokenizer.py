@@ -0,0 +1,93 @@
+"""
+Token 计数
+
+按 embedding 提供方 / 模型计数，用于分段的 tokens 字段和向量化请求的批次打包。
+
+- openai：tiktoken（按模型选择编码，默认 cl100k_base）
+- dashscope：DashScope SDK 自带的通义千问分词器（离线可用）
+- 其他 / 分词器不可用（如 tiktoken 词表无法下载）时：按字符类别估算，
+  系数用对应分词器在中英文语料上标定并略微取大，宁可多估不少估
+
+Author: chunlin
+"""
+
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# CJK 统一表意文字、扩展 A、兼容表意文字、中文标点与全角字符
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+# 每个字符对应的 token 数：(CJK, 其他)
+# dashscope：通义千问分词器实测中文约 0.68、英文 / 代码约 0.23
+# openai：cl100k_base 中文约 1 ~ 1.2、英文约 0.25
+# 默认：本地 BERT 类模型中文按字切分
+_HEURISTIC_RATES = {
+    "dashscope": (0.7, 0.3),
+    "openai": (1.2, 0.3),
+    "default": (1.0, 0.3),
+}
+
+
+class TokenCounter:
+    """Token 计数器"""
+
+    def __init__(self, name: str, encode: Optional[Callable[[str], List]] = None, rates: Optional[tuple] = None):
+        self.name = name
+        self._encode = encode
+        self._rates = rates or _HEURISTIC_RATES["default"]
+
+    @property
+    def exact(self) -> bool:
+        """是否使用真实分词器"""
+        return self._encode is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encode is not None:
+            return len(self._encode(text))
+        cjk = len(_CJK.findall(text))
+        cjk_rate, other_rate = self._rates
+        return math.ceil(cjk * cjk_rate + (len(text) - cjk) * other_rate)
+
+
+def _tiktoken_counter(model: Optional[str]) -> Optional[TokenCounter]:
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model or "")
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        encode = encoding.encode
+        return TokenCounter(f"tiktoken:{encoding.name}", lambda text: encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning(f"tiktoken 不可用，按字符估算 token: {e}")
+        return None
+
+
+def _dashscope_counter() -> Optional[TokenCounter]:
+    try:
+        from dashscope import get_tokenizer
+        return TokenCounter("dashscope:qwen", get_tokenizer("qwen-turbo").encode)
+    except Exception as e:
+        logger.warning(f"DashScope 分词器不可用，按字符估算 token: {e}")
+        return None
+
+
+@lru_cache(maxsize=32)
+def get_token_counter(provider: Optional[str] = None, model: Optional[str] = None) -> TokenCounter:
+    """获取提供方 / 模型对应的 token 计数器（按参数缓存）"""
+    counter = None
+    if provider == "openai":
+        counter = _tiktoken_counter(model)
+    elif provider == "dashscope":
+        counter = _dashscope_counter()
+    if counter is None:
+        profile = provider if provider in _HEURISTIC_RATES else "default"
+        counter = TokenCounter(f"heuristic:{profile}", rates=_HEURISTIC_RATES[profile])
+    return counter
@@ -0,0 +1,195 @@
+"""
+向量存储抽象
+
+定义知识库检索依赖的 VectorStore 接口，当前实现：
+- WeaviateClient（weaviate_client.py）：Weaviate 服务
+- LocalVectorStore（local_store.py）：本地内存映射文件，无需外部服务
+
+通过 db_conn.get_vector_store() 按配置获取。
+
+Author: chunlin
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+# 检索时下推到向量存储的状态过滤（文档 / 分段启用、未归档）
+ACTIVE_FILTERS: Dict[str, Any] = {"enabled": True, "archived": False}
+
+
+@dataclass
+class SearchResult:
+    id: str
+    content: str
+    score: float
+    metadata: Dict[str, Any]
+
+
+def to_properties(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """将待写入的文档字典规范化为存储属性"""
+    return {
+        "content": doc.get("content", ""),
+        "doc_id": doc.get("doc_id", ""),
+        "doc_name": doc.get("doc_name", ""),
+        "chunk_index": doc.get("chunk_index", 0),
+        "knowledge_base_id": doc.get("knowledge_base_id", ""),
+        "source": doc.get("source", ""),
+        "segment_id": doc.get("segment_id", 0),
+        "enabled": doc.get("enabled", True),
+        "archived": doc.get("archived", False),
+    }
+
+
+def to_search_result(
+    id: str,
+    props: Dict[str, Any],
+    score: Optional[float],
+    distance: Optional[float] = None
+) -> SearchResult:
+    """将存储属性转换为 SearchResult"""
+    return SearchResult(
+        id=id,
+        content=props.get("content", ""),
+        score=score,
+        metadata={
+            "doc_id": props.get("doc_id", ""),
+            "doc_name": props.get("doc_name", ""),
+            "chunk_index": props.get("chunk_index", 0),
+            "knowledge_base_id": props.get("knowledge_base_id", ""),
+            "source": props.get("source", ""),
+            "segment_id": props.get("segment_id", 0),
+            "enabled": props.get("enabled", True),
+            "archived": props.get("archived", False),
+            "distance": distance,
+        }
+    )
+
+
+class VectorStore(ABC):
+    """
+    向量存储接口
+
+    filters 语义（各实现一致）：
+    - 标量值 -> 属性等于该值
+    - 列表 -> 属性等于列表中任意一个值
+    - 多个键之间为 AND
+
+    分数约定：向量检索 score = 1 / (1 + 余弦距离)，metadata["distance"] 为距离；
+    BM25 / 混合检索 score 为各自的相关度分数。
+    """
+
+    # ============================
+    # Collection 管理
+    # ============================
+
+    @abstractmethod
+    async def create_collection(self, name: str, indexing_config: Optional[Dict[str, Any]] = None) -> bool:
+        """创建 Collection（已存在时应用可修改的配置）"""
+
+    @abstractmethod
+    async def delete_collection(self, name: str) -> bool:
+        """删除 Collection"""
+
+    @abstractmethod
+    async def list_collections(self) -> List[str]:
+        """列出所有 Collection"""
+
+    # ============================
+    # 写入
+    # ============================
+
+    @abstractmethod
+    async def add_documents(
+        self,
+        collection_name: str,
+        documents: List[Dict[str, Any]],
+        vectors: List[List[float]]
+    ) -> List[str]:
+        """批量添加文档，返回对象 ID 列表"""
+
+    @abstractmethod
+    async def update_object(
+        self,
+        collection_name: str,
+        uuid: str,
+        properties: Optional[Dict[str, Any]] = None,
+        vector: Optional[List[float]] = None
+    ) -> bool:
+        """更新对象的属性和向量"""
+
+    @abstractmethod
+    async def update_by_filter(
+        self,
+        collection_name: str,
+        filters: Dict[str, Any],
+        properties: Dict[str, Any]
+    ) -> int:
+        """更新所有匹配对象的属性（不修改向量，filters 为空时不更新），返回更新数量"""
+
+    @abstractmethod
+    async def delete_documents(self, collection_name: str, filters: Dict[str, Any]) -> int:
+        """根据过滤条件批量删除文档（filters 为空时不删除）"""
+
+    @abstractmethod
+    async def delete_by_ids(self, collection_name: str, ids: List[str]) -> int:
+        """根据 ID 列表删除文档"""
+
+    # ============================
+    # 检索
+    # ============================
+
+    @abstractmethod
+    async def vector_search(
+        self,
+        collection_name: str,
+        query_vector: List[float],
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """纯向量检索"""
+
+    @abstractmethod
+    async def bm25_search(
+        self,
+        collection_name: str,
+        query: str,
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 关键词检索"""
+
+    @abstractmethod
+    async def hybrid_search(
+        self,
+        collection_name: str,
+        query: str,
+        query_vector: List[float],
+        alpha: float = 0.5,
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """混合检索（alpha=1 为纯向量，alpha=0 为纯 BM25）"""
+
+    # ============================
+    # 查询与统计
+    # ============================
+
+    @abstractmethod
+    async def find_uuid(self, collection_name: str, filters: Dict[str, Any]) -> Optional[str]:
+        """查找单个对象的 ID"""
+
+    @abstractmethod
+    async def get_document_by_id(self, collection_name: str, doc_id: str) -> Optional[SearchResult]:
+        """根据 ID 获取文档"""
+
+    @abstractmethod
+    async def count_documents(self, collection_name: str, filters: Optional[Dict[str, Any]] = None) -> int:
+        """统计文档数量"""
+
+    async def aclose(self):
+        """释放当前事件循环上的连接"""
+
+    def close(self):
+        """释放连接等资源"""
@@ -1,5 +1,5 @@
 """
-Weaviate + LangChain 客户端（v4 API）
+Weaviate 客户端（v4 异步 API）
 
 支持：
 - Collection 管理
@@ -8,38 +8,219 @@ Weaviate + LangChain 客户端（v4 API）
 - Metadata 过滤
 - 纯向量检索
 - BM25 检索
+- 按知识库配置向量索引类型（HNSW / flat / dynamic）与压缩（PQ / BQ / SQ）
+- 多租户：知识库作为共享 Collection 的租户存储（名称形如 "Collection::tenant"，
+  见 tenant_collection_name），闲置租户可卸载到冷存储
 
 Dependencies:
-    pip install weaviate-client>=4.0.0 langchain-community
+    pip install weaviate-client>=4.0.0
 """
 
-from typing import List, Dict, Any, Optional, Union
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Set, Tuple, Union
 from urllib.parse import urlparse
+import asyncio
+import json
 import logging
+import re
+import time
+import uuid as uuid_lib
+import weakref
 
 import weaviate
+from weaviate.client import WeaviateAsyncClient
 from weaviate.classes.init import Auth, AdditionalConfig, Timeout
-from weaviate.classes.config import Configure, Property, DataType
+from weaviate.config import ConnectionConfig
+from weaviate.classes.config import Configure, Reconfigure, Property, DataType, VectorDistances
+from weaviate.collections.classes.config import BQConfig, PQConfig, SQConfig
 from weaviate.classes.query import Filter, MetadataQuery
-from langchain_community.vectorstores import Weaviate
-from langchain_core.documents import Document
+from weaviate.classes.data import DataObject
+from weaviate.classes.tenants import Tenant, TenantActivityStatus
+
+from core.cache import LRUCache, get_redis
+from .vector_store import VectorStore, SearchResult, to_properties, to_search_result
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
+# insert_many 单批对象数与并发批次数
+_INSERT_BATCH_SIZE = 200
+_INSERT_CONCURRENCY = 2
+# update_by_filter 分页读取 UUID 的页大小与并发更新数
+_UPDATE_PAGE_SIZE = 1000
+_UPDATE_CONCURRENCY = 8
+
+# 多租户：逻辑名称 "Collection::tenant"
+TENANT_SEPARATOR = "::"
+# 租户最近访问时间（Redis ZSET，成员为逻辑名称），用于卸载闲置租户
+_TENANT_ACTIVITY_KEY = "weaviate_tenant_activity"
+# 同一租户的访问记录 / 状态检查间隔（秒）
+_TENANT_TOUCH_INTERVAL = 60
+# 租户从冷存储加载的最长等待时间（秒）
+_TENANT_ONLOAD_TIMEOUT = 120
+
+
+def tenant_collection_name(
+    provider: Optional[str],
+    model: Optional[str],
+    dimensions: Optional[int],
+    tenant: str
+) -> str:
+    """
+    多租户模式下知识库的逻辑 Collection 名称
+
+    同一 embedding provider / 模型 / 维度的知识库共享一个 Collection，
+    每个知识库是其中一个租户。
+    """
+    suffix = re.sub(r"[^0-9A-Za-z]+", "_", f"{provider or 'default'}_{model or 'default'}_{dimensions or 'default'}")
+    return f"KbShared_{suffix.strip('_')}{TENANT_SEPARATOR}{tenant}"
+
+
+def _split_tenant(name: str) -> Tuple[str, Optional[str]]:
+    if TENANT_SEPARATOR in name:
+        collection, tenant = name.split(TENANT_SEPARATOR, 1)
+        return collection, tenant
+    return name, None
+
+
+class _ClientPool:
+    """单个事件循环内的异步客户端池"""
+
+    def __init__(self):
+        self.clients: List[WeaviateAsyncClient] = []
+        self.next = 0
+        self.lock = asyncio.Lock()
+
+
+# ============================
+# 向量索引配置
+# ============================
+
+VECTOR_INDEX_TYPES = ("hnsw", "flat", "dynamic")
+COMPRESSION_TYPES = ("none", "pq", "bq", "sq")
+
+
+def _index_options(indexing_config: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    从 KnowledgeBase.indexing_config 中取出向量索引与压缩配置
+
+    indexing_config 示例：
+        {
+            "vector_index": {"type": "hnsw", "ef": 128, "ef_construction": 256, "max_connections": 32},
+            "compression": {"type": "pq", "segments": 96, "training_limit": 100000},
+            "dimensions": 512
+        }
+    """
+    config = indexing_config or {}
+    index = dict(config.get("vector_index") or {})
+    compression = dict(config.get("compression") or {})
+
+    index_type = index.setdefault("type", "hnsw")
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"不支持的向量索引类型: {index_type}，可选 {', '.join(VECTOR_INDEX_TYPES)}")
+    compression_type = compression.setdefault("type", "none")
+    if compression_type not in COMPRESSION_TYPES:
+        raise ValueError(f"不支持的压缩方式: {compression_type}，可选 {', '.join(COMPRESSION_TYPES)}")
+    if index_type == "flat" and compression_type in ("pq", "sq"):
+        raise ValueError("flat 索引仅支持 BQ 压缩")
+    if index_type == "dynamic" and compression_type in ("pq", "sq"):
+        raise ValueError("dynamic 索引仅支持 BQ 压缩")
+    return index, compression
+
+
+def _build_quantizer(compression: Dict[str, Any]):
+    compression_type = compression["type"]
+    if compression_type == "pq":
+        return Configure.VectorIndex.Quantizer.pq(
+            segments=compression.get("segments"),
+            centroids=compression.get("centroids"),
+            training_limit=compression.get("training_limit"),
+        )
+    if compression_type == "bq":
+        return Configure.VectorIndex.Quantizer.bq(rescore_limit=compression.get("rescore_limit"))
+    if compression_type == "sq":
+        return Configure.VectorIndex.Quantizer.sq(
+            rescore_limit=compression.get("rescore_limit"),
+            training_limit=compression.get("training_limit"),
+        )
+    return None
+
+
+def _build_quantizer_update(compression: Dict[str, Any]):
+    compression_type = compression["type"]
+    if compression_type == "pq":
+        return Reconfigure.VectorIndex.Quantizer.pq(
+            segments=compression.get("segments"),
+            centroids=compression.get("centroids"),
+            training_limit=compression.get("training_limit"),
+        )
+    if compression_type == "bq":
+        return Reconfigure.VectorIndex.Quantizer.bq(rescore_limit=compression.get("rescore_limit"))
+    if compression_type == "sq":
+        return Reconfigure.VectorIndex.Quantizer.sq(
+            rescore_limit=compression.get("rescore_limit"),
+            training_limit=compression.get("training_limit"),
+        )
+    return None
+
+
+def _quantizer_type(quantizer) -> str:
+    if isinstance(quantizer, PQConfig):
+        return "pq"
+    if isinstance(quantizer, BQConfig):
+        return "bq"
+    if isinstance(quantizer, SQConfig):
+        return "sq"
+    return "none"
+
+
+def build_vector_index_config(indexing_config: Optional[Dict[str, Any]]):
+    """
+    根据知识库索引配置构建 Weaviate 向量索引配置（创建 Collection 时使用）
+
+    未配置时返回 None，使用 Weaviate 默认的 HNSW + 不压缩。
+    dynamic 索引需要 Weaviate 服务端开启 ASYNC_INDEXING。
+    """
+    if not indexing_config or not (indexing_config.get("vector_index") or indexing_config.get("compression")):
+        return None
 
-@dataclass
-class SearchResult:
-    id: str
-    content: str
-    score: float
-    metadata: Dict[str, Any]
+    index, compression = _index_options(indexing_config)
+    distance = VectorDistances(index.get("distance", "cosine"))
+    quantizer = _build_quantizer(compression)
+
+    hnsw_kwargs = dict(
+        ef=index.get("ef"),
+        ef_construction=index.get("ef_construction"),
+        max_connections=index.get("max_connections"),
+        dynamic_ef_min=index.get("dynamic_ef_min"),
+        dynamic_ef_max=index.get("dynamic_ef_max"),
+        dynamic_ef_factor=index.get("dynamic_ef_factor"),
+        vector_cache_max_objects=index.get("vector_cache_max_objects"),
+    )
+
+    if index["type"] == "flat":
+        return Configure.VectorIndex.flat(
+            distance_metric=distance,
+            vector_cache_max_objects=index.get("vector_cache_max_objects"),
+            quantizer=quantizer,
+        )
+    if index["type"] == "dynamic":
+        return Configure.VectorIndex.dynamic(
+            distance_metric=distance,
+            threshold=index.get("threshold"),
+            hnsw=Configure.VectorIndex.hnsw(quantizer=quantizer, **hnsw_kwargs),
+            flat=Configure.VectorIndex.flat(quantizer=quantizer),
+        )
+    return Configure.VectorIndex.hnsw(distance_metric=distance, quantizer=quantizer, **hnsw_kwargs)
 
 
-class WeaviateClient:
+class WeaviateClient(VectorStore):
     """
     LangChain + Weaviate v4 封装 (gRPC Enabled)
+
+    基于异步客户端（WeaviateAsyncClient），检索和写入不阻塞事件循环。
+    gRPC 通道绑定事件循环，因此每个事件循环（FastAPI 主循环、Celery 任务循环）
+    各自维护 grpc_pool_size 个客户端，请求在其间轮询，避免所有并发查询挤在
+    同一条 HTTP/2 连接上。
     """
 
     def __init__(
@@ -49,9 +230,12 @@ class WeaviateClient:
         grpc_port: int = 50051,
         additional_headers: Optional[Dict[str, str]] = None,
         timeout_config: Optional[Dict[str, int]] = None,
+        grpc_pool_size: int = 1,
+        http_pool_connections: int = 20,
+        http_pool_maxsize: int = 100,
     ):
         """
-        初始化 Weaviate 客户端
+        初始化 Weaviate 客户端（连接在首次使用时按事件循环建立）
 
         Args:
             url: Weaviate HTTP 地址 (例如: http://localhost:8080)
@@ -59,9 +243,13 @@ class WeaviateClient:
             grpc_port: gRPC 端口（默认 50051）
             additional_headers: 额外的 headers（如 OpenAI API Key）
             timeout_config: 超时配置 {"init": 30, "query": 60, "insert": 120}
+            grpc_pool_size: 每个事件循环的客户端（gRPC 通道）数量
+            http_pool_connections: HTTP 连接池连接数
+            http_pool_maxsize: HTTP 连接池最大连接数
         """
         self.url = url
         self.additional_headers = additional_headers or {}
+        self.grpc_pool_size = max(1, grpc_pool_size)
 
         # 1. 解析 URL 以提取 host, port, scheme
         parsed = urlparse(url)
@@ -79,95 +267,390 @@ class WeaviateClient:
             insert=timeout_config.get("insert", 120) if timeout_config else 120,
         )
 
-        # 4. 初始化连接 (默认启用 gRPC)
-        try:
-            self.client = weaviate.connect_to_custom(
-                http_host=http_host,
-                http_port=http_port,
-                http_secure=http_secure,
-                grpc_host=http_host,  # 通常 gRPC host 与 HTTP host 相同
-                grpc_port=grpc_port,
-                grpc_secure=http_secure,
-                auth_credentials=auth_credentials,  # 这里已经处理了认证
-                headers=self.additional_headers,    # 这里只传其他的 headers (如 OpenAI key)
-                additional_config=AdditionalConfig(timeout=timeout_settings),
-                skip_init_checks=False  # 生产环境建议保持检查
-            )
+        # 4. 连接参数 (默认启用 gRPC)
+        self._connect_kwargs = dict(
+            http_host=http_host,
+            http_port=http_port,
+            http_secure=http_secure,
+            grpc_host=http_host,  # 通常 gRPC host 与 HTTP host 相同
+            grpc_port=grpc_port,
+            grpc_secure=http_secure,
+            auth_credentials=auth_credentials,  # 这里已经处理了认证
+            headers=self.additional_headers,    # 这里只传其他的 headers (如 OpenAI key)
+            additional_config=AdditionalConfig(
+                connection=ConnectionConfig(
+                    session_pool_connections=http_pool_connections,
+                    session_pool_maxsize=http_pool_maxsize,
+                ),
+                timeout=timeout_settings,
+            ),
+            skip_init_checks=False  # 生产环境建议保持检查
+        )
 
-            if self.client.is_connected():
-                logger.info(f"Connected to Weaviate at {url} (gRPC: {grpc_port})")
-            else:
-                logger.warning("Weaviate client initialized but connection test failed.")
+        # 事件循环 -> 客户端池
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ClientPool]" = weakref.WeakKeyDictionary()
+        # 已确认存在（且已应用索引配置）的 Collection：(name, 配置指纹)
+        self._known_collections: Set[Tuple[str, str]] = set()
+        # 逻辑名称 -> (Collection, 租户)；租户名对应的旧版独立 Collection 仍存在时优先使用
+        self._resolved: Dict[str, Tuple[str, Optional[str]]] = {}
+        # 近期确认为 ACTIVE / 已记录访问的租户
+        self._active_tenants = LRUCache(max_entries=10000, default_ttl=_TENANT_TOUCH_INTERVAL)
+
+    async def _get_client(self) -> WeaviateAsyncClient:
+        """获取当前事件循环的异步客户端（轮询）"""
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools.setdefault(loop, _ClientPool())
+
+        if not pool.clients:
+            async with pool.lock:
+                if not pool.clients:
+                    clients = []
+                    try:
+                        for _ in range(self.grpc_pool_size):
+                            client = weaviate.use_async_with_custom(**self._connect_kwargs)
+                            await client.connect()
+                            clients.append(client)
+                    except Exception as e:
+                        logger.error(f"Failed to connect to Weaviate: {e}")
+                        for client in clients:
+                            await client.close()
+                        raise
+                    pool.clients = clients
+                    logger.info(
+                        f"Connected to Weaviate at {self.url} "
+                        f"(gRPC: {self._connect_kwargs['grpc_port']}, pool: {len(clients)})"
+                    )
+
+        client = pool.clients[pool.next % len(pool.clients)]
+        pool.next += 1
+        if not client.is_connected():
+            await client.connect()
+        return client
+
+    async def _resolve(self, name: str) -> Tuple[str, Optional[str]]:
+        """
+        解析逻辑名称为 (Collection, 租户)
 
-        except Exception as e:
-            logger.error(f"Failed to connect to Weaviate: {e}")
-            raise e
+        开启多租户前创建的知识库仍保存在独立的 kb_{id} Collection 中，
+        存在时继续使用，无需迁移。
+        """
+        resolved = self._resolved.get(name)
+        if resolved is not None:
+            return resolved
+
+        collection, tenant = _split_tenant(name)
+        if tenant is not None and await (await self._get_client()).collections.exists(tenant):
+            collection, tenant = tenant, None
+        self._resolved[name] = (collection, tenant)
+        return collection, tenant
+
+    async def _collection(self, name: str):
+        collection_name, tenant = await self._resolve(name)
+        collection = (await self._get_client()).collections.get(collection_name)
+        if tenant is None:
+            return collection
+        await self._ensure_tenant_active(collection, tenant, name)
+        return collection.with_tenant(tenant)
+
+    async def _ensure_tenant_active(self, collection, tenant: str, name: str) -> None:
+        """确保租户处于 ACTIVE 状态（已卸载的租户先从冷存储加载），并记录访问时间"""
+        if name in self._active_tenants:
+            return
+
+        info = await collection.tenants.get_by_name(tenant)
+        if info is not None and info.activity_status != TenantActivityStatus.ACTIVE:
+            logger.info(f"Activating tenant '{name}' (status: {info.activity_status.value})")
+            if info.activity_status not in (TenantActivityStatus.ONLOADING, TenantActivityStatus.OFFLOADING):
+                await collection.tenants.update(Tenant(name=tenant, activity_status=TenantActivityStatus.ACTIVE))
+            deadline = time.monotonic() + _TENANT_ONLOAD_TIMEOUT
+            while info is not None and info.activity_status != TenantActivityStatus.ACTIVE:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"租户 {name} 激活超时（状态: {info.activity_status.value}）")
+                await asyncio.sleep(0.5)
+                info = await collection.tenants.get_by_name(tenant)
+                if info is not None and info.activity_status == TenantActivityStatus.OFFLOADED:
+                    # 卸载过程中收到激活请求时，卸载完成后需再次激活
+                    await collection.tenants.update(Tenant(name=tenant, activity_status=TenantActivityStatus.ACTIVE))
+
+        self._active_tenants.set(name, True)
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.zadd(_TENANT_ACTIVITY_KEY, {name: time.time()})
+            except Exception as e:
+                logger.warning(f"记录租户访问时间失败: {e}")
+
+    async def aclose(self):
+        """关闭当前事件循环的连接（Celery 任务结束、服务关闭时调用）"""
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool:
+            for client in pool.clients:
+                await client.close()
 
     def close(self):
-        """关闭连接"""
-        if self.client and self.client.is_connected():
-            self.client.close()
-
-    def __enter__(self):
-        return self
+        """
+        释放所有连接池引用
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
+        异步客户端只能在所属事件循环内关闭（见 aclose），这里仅丢弃引用。
+        """
+        self._pools.clear()
 
     # ============================
     # Collection 管理
     # ============================
 
-    async def create_collection(self, name: str) -> bool:
-        """创建 Collection (Schema 定义)，如果存在则检查并补全缺失字段"""
+    @staticmethod
+    def _expected_properties() -> List[Property]:
+        return [
+            Property(name="content", data_type=DataType.TEXT),
+            Property(name="doc_id", data_type=DataType.TEXT, skip_vectorization=True),
+            Property(name="doc_name", data_type=DataType.TEXT, skip_vectorization=True),
+            Property(name="chunk_index", data_type=DataType.INT, skip_vectorization=True),
+            Property(name="knowledge_base_id", data_type=DataType.TEXT, skip_vectorization=True),
+            Property(name="source", data_type=DataType.TEXT, skip_vectorization=True),
+            Property(name="segment_id", data_type=DataType.INT, skip_vectorization=True),
+            Property(name="enabled", data_type=DataType.BOOL, skip_vectorization=True),
+            Property(name="archived", data_type=DataType.BOOL, skip_vectorization=True),
+        ]
+
+    async def create_collection(self, name: str, indexing_config: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        创建 Collection (Schema 定义)，如果存在则检查并补全缺失字段
+
+        indexing_config 为知识库的索引配置：新建时决定向量索引类型与压缩方式；
+        已存在时只应用可在线修改的部分（见 _apply_vector_index_config）。
+
+        name 为 "Collection::tenant" 时创建（或确认）共享的多租户 Collection 及其租户；
+        向量索引配置属于整个 Collection，租户不单独应用知识库的 indexing_config。
+
+        已确认过的 (Collection, 索引配置) 会被记住，重复调用（如每个索引任务）
+        不再读取 Schema。
+        """
+        cache_key = (name, json.dumps(indexing_config or {}, sort_keys=True))
+        if cache_key in self._known_collections:
+            return True
+
         try:
-            # 定义期望的 Properties
-            expected_properties = [
-                Property(name="content", data_type=DataType.TEXT),
-                Property(name="doc_id", data_type=DataType.TEXT, skip_vectorization=True),
-                Property(name="doc_name", data_type=DataType.TEXT, skip_vectorization=True),
-                Property(name="chunk_index", data_type=DataType.INT, skip_vectorization=True),
-                Property(name="knowledge_base_id", data_type=DataType.TEXT, skip_vectorization=True),
-                Property(name="source", data_type=DataType.TEXT, skip_vectorization=True),
-                Property(name="segment_id", data_type=DataType.INT, skip_vectorization=True),
-                Property(name="enabled", data_type=DataType.BOOL, skip_vectorization=True),
-                Property(name="archived", data_type=DataType.BOOL, skip_vectorization=True),
-            ]
+            collection_name, tenant = await self._resolve(name)
+            client = await self._get_client()
 
-            if self.client.collections.exists(name):
-                # 检查并更新 Schema
-                collection = self.client.collections.get(name)
-                existing_props = {p.name for p in collection.config.get().properties}
-                
-                for prop in expected_properties:
-                    if prop.name not in existing_props:
-                        logger.info(f"Adding missing property '{prop.name}' to collection '{name}'...")
-                        collection.config.add_property(prop)
-                return True
-
-            self.client.collections.create(
-                name=name,
-                # 显式禁用内置 Vectorizer，因为我们使用外部 embedding
-                vectorizer_config=Configure.Vectorizer.none(),
-                properties=expected_properties
-            )
-            logger.info(f"Collection '{name}' created.")
+            if tenant is None:
+                await self._ensure_collection(client, collection_name, indexing_config)
+            else:
+                if indexing_config and (indexing_config.get("vector_index") or indexing_config.get("compression")):
+                    logger.info(f"Tenant '{name}' uses the shared collection's vector index settings")
+                shared_key = (collection_name, "")
+                if shared_key not in self._known_collections:
+                    await self._ensure_collection(client, collection_name, None, multi_tenancy=True)
+                    self._known_collections.add(shared_key)
+                collection = client.collections.get(collection_name)
+                if not await collection.tenants.exists(tenant):
+                    await collection.tenants.create(Tenant(name=tenant))
+                    logger.info(f"Tenant '{tenant}' created in collection '{collection_name}'.")
+                await self._ensure_tenant_active(collection, tenant, name)
+
+            self._known_collections.add(cache_key)
             return True
         except Exception as e:
             logger.error(f"Error creating/updating collection {name}: {e}")
             return False
 
+    async def _ensure_collection(
+        self,
+        client: WeaviateAsyncClient,
+        name: str,
+        indexing_config: Optional[Dict[str, Any]],
+        multi_tenancy: bool = False
+    ) -> None:
+        expected_properties = self._expected_properties()
+
+        if await client.collections.exists(name):
+            # 检查并更新 Schema
+            collection = client.collections.get(name)
+            existing_props = {p.name for p in (await collection.config.get()).properties}
+
+            for prop in expected_properties:
+                if prop.name not in existing_props:
+                    logger.info(f"Adding missing property '{prop.name}' to collection '{name}'...")
+                    await collection.config.add_property(prop)
+            if indexing_config:
+                await self._apply_vector_index_config(collection, indexing_config)
+            return
+
+        await client.collections.create(
+            name=name,
+            # 显式禁用内置 Vectorizer，因为我们使用外部 embedding
+            vectorizer_config=Configure.Vectorizer.none(),
+            vector_index_config=build_vector_index_config(indexing_config),
+            multi_tenancy_config=Configure.multi_tenancy(
+                enabled=True,
+                auto_tenant_activation=True
+            ) if multi_tenancy else None,
+            properties=expected_properties
+        )
+        logger.info(f"Collection '{name}' created{' (multi-tenancy)' if multi_tenancy else ''}.")
+
+    async def _apply_vector_index_config(self, collection, indexing_config: Dict[str, Any]) -> None:
+        """
+        将索引配置应用到已存在的 Collection
+
+        Weaviate 只允许在线修改 ef / dynamic ef / 向量缓存，以及为未压缩的索引开启压缩；
+        索引类型、ef_construction、max_connections、距离度量和已启用的压缩方式
+        不能修改，这些差异只记录警告（需要重建知识库索引才能生效）。
+        """
+        index, compression = _index_options(indexing_config)
+        current = await collection.config.get()
+        current_type = current.vector_index_type.value
+        if current_type != index["type"]:
+            logger.warning(
+                f"Collection '{collection.name}' 的向量索引类型为 {current_type}，"
+                f"无法在线修改为 {index['type']}，需要重建索引"
+            )
+            return
+
+        index_config = current.vector_index_config
+        if current_type == "dynamic":
+            # dynamic 索引的压缩配置位于 hnsw 子配置中
+            index_config = getattr(index_config, "hnsw", None) or index_config
+        for key in ("ef_construction", "max_connections"):
+            if index.get(key) is not None and getattr(index_config, key, None) not in (None, index[key]):
+                logger.warning(f"Collection '{collection.name}' 的 {key} 不可在线修改，需要重建索引")
+
+        current_compression = _quantizer_type(getattr(index_config, "quantizer", None))
+        quantizer = None
+        if compression["type"] != current_compression:
+            if current_compression == "none":
+                quantizer = _build_quantizer_update(compression)
+            else:
+                logger.warning(
+                    f"Collection '{collection.name}' 已启用 {current_compression} 压缩，"
+                    f"无法在线切换为 {compression['type']}，需要重建索引"
+                )
+
+        if current_type == "hnsw":
+            update = Reconfigure.VectorIndex.hnsw(
+                ef=index.get("ef"),
+                dynamic_ef_min=index.get("dynamic_ef_min"),
+                dynamic_ef_max=index.get("dynamic_ef_max"),
+                dynamic_ef_factor=index.get("dynamic_ef_factor"),
+                vector_cache_max_objects=index.get("vector_cache_max_objects"),
+                quantizer=quantizer,
+            )
+        elif current_type == "flat":
+            update = Reconfigure.VectorIndex.flat(
+                vector_cache_max_objects=index.get("vector_cache_max_objects"),
+                quantizer=quantizer,
+            )
+        else:
+            update = Reconfigure.VectorIndex.dynamic(
+                threshold=index.get("threshold"),
+                hnsw=Reconfigure.VectorIndex.hnsw(
+                    ef=index.get("ef"),
+                    vector_cache_max_objects=index.get("vector_cache_max_objects"),
+                ),
+                quantizer=quantizer,
+            )
+        await collection.config.update(vector_index_config=update)
+        logger.info(f"Collection '{collection.name}' 向量索引配置已更新")
+
+    def _forget_collection(self, name: str) -> None:
+        self._known_collections = {key for key in self._known_collections if key[0] != name}
+
     async def delete_collection(self, name: str) -> bool:
-        """删除 Collection"""
-        if self.client.collections.exists(name):
-            self.client.collections.delete(name)
-            logger.info(f"Collection '{name}' deleted.")
+        """删除 Collection（多租户名称只删除对应租户）"""
+        collection_name, tenant = await self._resolve(name)
+        self._forget_collection(name)
+        self._resolved.pop(name, None)
+        self._active_tenants.delete(name)
+        client = await self._get_client()
+
+        if tenant is not None:
+            if await client.collections.exists(collection_name):
+                collection = client.collections.get(collection_name)
+                if await collection.tenants.exists(tenant):
+                    await collection.tenants.remove([tenant])
+                    logger.info(f"Tenant '{tenant}' deleted from collection '{collection_name}'.")
+            redis = get_redis()
+            if redis is not None:
+                try:
+                    await redis.zrem(_TENANT_ACTIVITY_KEY, name)
+                except Exception as e:
+                    logger.warning(f"清理租户访问记录失败: {e}")
+            return True
+
+        if await client.collections.exists(collection_name):
+            await client.collections.delete(collection_name)
+            logger.info(f"Collection '{collection_name}' deleted.")
         return True
 
     async def list_collections(self) -> List[str]:
-        """列出所有 Collections"""
-        collections = self.client.collections.list_all()
-        return list(collections.keys())
+        """列出所有 Collections（多租户 Collection 展开为 "Collection::tenant"）"""
+        client = await self._get_client()
+        names = []
+        for name, config in (await client.collections.list_all()).items():
+            if config.multi_tenancy_config and config.multi_tenancy_config.enabled:
+                tenants = await client.collections.get(name).tenants.get()
+                names.extend(f"{name}{TENANT_SEPARATOR}{tenant}" for tenant in tenants)
+            else:
+                names.append(name)
+        return names
+
+    async def offload_idle_tenants(
+        self,
+        idle_seconds: float,
+        status: TenantActivityStatus = TenantActivityStatus.OFFLOADED
+    ) -> int:
+        """
+        将闲置租户转为 INACTIVE（本地磁盘）或 OFFLOADED（对象存储，需要 offload-s3 模块）
+
+        访问时间来自 Redis（_ensure_tenant_active 记录）；没有访问记录的租户
+        从本次检查开始计时。未开启 Redis 时不做任何操作。
+
+        Returns:
+            状态被修改的租户数量
+        """
+        redis = get_redis()
+        if redis is None:
+            logger.warning("未开启 Redis（CACHE_REDIS_ENABLED），无法统计租户访问时间，跳过卸载")
+            return 0
+
+        client = await self._get_client()
+        now = time.time()
+        changed = 0
+        for name, config in (await client.collections.list_all()).items():
+            if not (config.multi_tenancy_config and config.multi_tenancy_config.enabled):
+                continue
+            collection = client.collections.get(name)
+            active = [
+                tenant for tenant in (await collection.tenants.get()).values()
+                if tenant.activity_status == TenantActivityStatus.ACTIVE
+            ]
+            if not active:
+                continue
+
+            members = [f"{name}{TENANT_SEPARATOR}{tenant.name}" for tenant in active]
+            last_seen = await redis.zmscore(_TENANT_ACTIVITY_KEY, members)
+            idle = []
+            unseen = {}
+            for tenant, member, seen in zip(active, members, last_seen):
+                if seen is None:
+                    unseen[member] = now
+                elif now - float(seen) >= idle_seconds:
+                    idle.append(tenant.name)
+            if unseen:
+                await redis.zadd(_TENANT_ACTIVITY_KEY, unseen, nx=True)
+
+            for i in range(0, len(idle), 100):
+                batch = idle[i:i + 100]
+                await collection.tenants.update([Tenant(name=t, activity_status=status) for t in batch])
+                for t in batch:
+                    self._active_tenants.delete(f"{name}{TENANT_SEPARATOR}{t}")
+                changed += len(batch)
+            if idle:
+                logger.info(f"Collection '{name}': {len(idle)} idle tenants -> {status.value}")
+        return changed
 
     # ============================
     # 文档写入（外部 embedding）
@@ -186,52 +669,38 @@ class WeaviateClient:
         if len(documents) != len(vectors):
             raise ValueError("Documents and vectors must have the same length.")
 
-        collection = self.client.collections.get(collection_name)
-        ids = []
+        collection = await self._collection(collection_name)
 
-        # 使用 dynamic batch，自动处理并发和重试
-        with collection.batch.dynamic() as batch:
-            for doc, vector in zip(documents, vectors):
+        # UUID 在客户端生成，保证返回顺序与输入一致
+        objects = [
+            DataObject(
+                uuid=uuid_lib.uuid4(),
+                properties=to_properties(doc),
                 # 确保 vector 是列表格式
-                vec = vector if isinstance(vector, list) else list(vector)
-
-                uuid = batch.add_object(
-                    properties={
-                        "content": doc.get("content", ""),
-                        "doc_id": doc.get("doc_id", ""),
-                        "doc_name": doc.get("doc_name", ""),
-                        "chunk_index": doc.get("chunk_index", 0),
-                        "knowledge_base_id": doc.get("knowledge_base_id", ""),
-                        "source": doc.get("source", ""),
-                        "segment_id": doc.get("segment_id", 0),
-                        "enabled": doc.get("enabled", True),
-                        "archived": doc.get("archived", False),
-                    },
-                    vector=vec
-                )
-                ids.append(str(uuid))
+                vector=vector if isinstance(vector, list) else list(vector)
+            )
+            for doc, vector in zip(documents, vectors)
+        ]
 
-        # 检查是否有失败的对象
-        if collection.batch.failed_objects:
-            logger.error(f"Failed to import {len(collection.batch.failed_objects)} objects.")
-            for failed in collection.batch.failed_objects:
+        # 分批 insert_many（gRPC），批次有限并发
+        semaphore = asyncio.Semaphore(_INSERT_CONCURRENCY)
+
+        async def _insert(batch: List[DataObject]) -> int:
+            async with semaphore:
+                result = await collection.data.insert_many(batch)
+            for failed in result.errors.values():
                 logger.error(f"Error: {failed.message}")
+            return len(result.errors)
 
-        return ids
+        batches = [objects[i:i + _INSERT_BATCH_SIZE] for i in range(0, len(objects), _INSERT_BATCH_SIZE)]
+        failed_count = sum(await asyncio.gather(*[_insert(batch) for batch in batches]))
 
-    # ============================
-    # LangChain VectorStore 封装
-    # ============================
+        # 检查是否有失败的对象
+        if failed_count:
+            logger.error(f"Failed to import {failed_count} objects.")
+            self._forget_collection(collection_name)
 
-    def _get_vectorstore(self, collection_name: str, embedding) -> Weaviate:
-        """获取 LangChain VectorStore 实例"""
-        return Weaviate(
-            client=self.client,
-            index_name=collection_name,
-            text_key="content",
-            embedding=embedding,
-            by_text=False,  # 使用外部 embedding
-        )
+        return [str(obj.uuid) for obj in objects]
 
     def _build_filter(self, filters: Optional[Dict[str, Any]]) -> Optional[Filter]:
         """
@@ -282,22 +751,7 @@ class WeaviateClient:
                 if score is None:
                     score = 1.0 / (1.0 + distance)
 
-        return SearchResult(
-            id=str(obj.uuid),
-            content=props.get("content", ""),
-            score=score,
-            metadata={
-                "doc_id": props.get("doc_id", ""),
-                "doc_name": props.get("doc_name", ""),
-                "chunk_index": props.get("chunk_index", 0),
-                "knowledge_base_id": props.get("knowledge_base_id", ""),
-                "source": props.get("source", ""),
-                "segment_id": props.get("segment_id", 0),
-                "enabled": props.get("enabled", True),
-                "archived": props.get("archived", False),
-                "distance": distance,
-            }
-        )
+        return to_search_result(str(obj.uuid), props, score, distance)
 
     # ============================
     # 混合检索（Hybrid）
@@ -315,12 +769,12 @@ class WeaviateClient:
         """
         混合检索（向量 + BM25）
         """
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
 
         weaviate_filter = self._build_filter(filters)
 
         try:
-            response = collection.query.hybrid(
+            response = await collection.query.hybrid(
                 query=query,
                 vector=query_vector,
                 alpha=alpha,
@@ -345,12 +799,12 @@ class WeaviateClient:
         filters: Optional[Dict[str, Any]] = None
     ) -> List[SearchResult]:
         """纯向量检索"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
 
         weaviate_filter = self._build_filter(filters)
 
         try:
-            response = collection.query.near_vector(
+            response = await collection.query.near_vector(
                 near_vector=query_vector,
                 limit=limit,
                 filters=weaviate_filter,
@@ -375,11 +829,11 @@ class WeaviateClient:
         filters: Optional[Dict[str, Any]] = None
     ) -> List[SearchResult]:
         """BM25 关键词检索"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
         weaviate_filter = self._build_filter(filters)
 
         try:
-            response = collection.query.bm25(
+            response = await collection.query.bm25(
                 query=query,
                 limit=limit,
                 filters=weaviate_filter,
@@ -402,12 +856,12 @@ class WeaviateClient:
         filters: Dict[str, Any]
     ) -> Optional[str]:
         """查找单个对象的 UUID"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
         weaviate_filter = self._build_filter(filters)
         
         try:
             # 只获取 UUID，不获取属性和向量
-            response = collection.query.fetch_objects(
+            response = await collection.query.fetch_objects(
                 filters=weaviate_filter,
                 limit=1,
                 include_vector=False
@@ -427,9 +881,9 @@ class WeaviateClient:
         vector: Optional[List[float]] = None
     ) -> bool:
         """更新对象的属性和向量"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
         try:
-            collection.data.update(
+            await collection.data.update(
                 uuid=uuid,
                 properties=properties,
                 vector=vector
@@ -439,25 +893,90 @@ class WeaviateClient:
             logger.error(f"Update object failed: {e}")
             return False
 
+    async def update_by_filter(
+        self,
+        collection_name: str,
+        filters: Dict[str, Any],
+        properties: Dict[str, Any]
+    ) -> int:
+        """
+        更新所有匹配对象的属性
+
+        Weaviate 不支持按条件批量更新：逐页读取匹配且属性尚未是目标值的对象，有限并发逐个更新
+        （不修改向量）。已更新的对象不再匹配，因此每页都从头读取，不受 offset 上限
+        （QUERY_MAXIMUM_RESULTS）限制，已是目标值的对象也不会重复更新。
+        """
+        collection = await self._collection(collection_name)
+        weaviate_filter = self._build_filter(filters)
+
+        if weaviate_filter is None:
+            logger.warning("Update operation aborted: No filters provided (would update all).")
+            return 0
+
+        differs = [Filter.by_property(key).not_equal(value) for key, value in properties.items()]
+        if not differs:
+            return 0
+        pending_filter = weaviate_filter & (differs[0] if len(differs) == 1 else Filter.any_of(differs))
+
+        semaphore = asyncio.Semaphore(_UPDATE_CONCURRENCY)
+
+        async def _update(object_uuid) -> None:
+            async with semaphore:
+                await collection.data.update(uuid=object_uuid, properties=properties)
+
+        updated = 0
+        try:
+            while True:
+                response = await collection.query.fetch_objects(
+                    filters=pending_filter,
+                    limit=_UPDATE_PAGE_SIZE,
+                    return_properties=["doc_id"],
+                    include_vector=False
+                )
+                if not response.objects:
+                    break
+                outcomes = await asyncio.gather(
+                    *[_update(obj.uuid) for obj in response.objects],
+                    return_exceptions=True
+                )
+                failed = [o for o in outcomes if isinstance(o, BaseException)]
+                updated += len(outcomes) - len(failed)
+                if failed:
+                    # 失败的对象仍会匹配，继续读取会反复命中，直接结束
+                    logger.error(f"Update by filter: {len(failed)}/{len(outcomes)} objects failed: {failed[0]}")
+                    break
+        except Exception as e:
+            logger.error(f"Update by filter failed: {e}")
+        return updated
+
     async def delete_documents(
         self,
         collection_name: str,
         filters: Dict[str, Any]
     ) -> int:
-        """根据过滤条件批量删除文档"""
-        collection = self.client.collections.get(collection_name)
+        """
+        根据过滤条件批量删除文档
+
+        单次 delete_many 最多删除 QUERY_MAXIMUM_RESULTS 个对象（默认 10000），循环直到没有匹配对象。
+        """
+        collection = await self._collection(collection_name)
         weaviate_filter = self._build_filter(filters)
 
         if weaviate_filter is None:
             logger.warning("Delete operation aborted: No filters provided (would delete all).")
             return 0
 
+        deleted = 0
         try:
-            result = collection.data.delete_many(where=weaviate_filter)
-            return result.successful
+            while True:
+                result = await collection.data.delete_many(where=weaviate_filter)
+                deleted += result.successful
+                if not result.matches or not result.successful:
+                    break
+            return deleted
         except Exception as e:
             logger.error(f"Delete documents failed: {e}")
-            return 0
+            return deleted
 
     async def delete_by_ids(
         self,
@@ -465,11 +984,11 @@ class WeaviateClient:
         ids: List[str]
     ) -> int:
         """根据 ID 列表删除文档"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
         try:
             # V4 同样支持 delete_many 传入 uuid 列表的过滤器，这比循环删除效率高
             # 但这里使用循环确保兼容性，或者使用 batch delete logic
-            result = collection.data.delete_many(
+            result = await collection.data.delete_many(
                 where=Filter.by_id().contains_any(ids)
             )
             return result.successful
@@ -483,9 +1002,9 @@ class WeaviateClient:
         doc_id: str
     ) -> Optional[SearchResult]:
         """根据 ID 获取文档"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
         try:
-            obj = collection.query.fetch_object_by_id(doc_id)
+            obj = await collection.query.fetch_object_by_id(doc_id)
             if obj:
                 return self._parse_result(obj)
         except Exception:
@@ -498,11 +1017,11 @@ class WeaviateClient:
         filters: Optional[Dict[str, Any]] = None
     ) -> int:
         """统计文档数量"""
-        collection = self.client.collections.get(collection_name)
+        collection = await self._collection(collection_name)
         weaviate_filter = self._build_filter(filters)
 
         try:
-            response = collection.aggregate.over_all(
+            response = await collection.aggregate.over_all(
                 filters=weaviate_filter,
                 total_count=True,
             )
@@ -8,6 +8,7 @@ Author: chunlin
 
 from .registry import TOOL_REGISTRY, get_all_tool_names, resolve_tools
 from .builtin import calc, echo, get_current_datetime, web_page_reader
+from .cache import TOOL_CACHE_TTLS, ToolResultCache, get_tool_cache
 
 __all__ = [
     "TOOL_REGISTRY",
@@ -17,4 +18,7 @@ __all__ = [
     "echo",
     "get_current_datetime",
     "web_page_reader",
+    "TOOL_CACHE_TTLS",
+    "ToolResultCache",
+    "get_tool_cache",
 ]
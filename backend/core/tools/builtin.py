@@ -13,7 +13,7 @@ from typing import Any
 
 import httpx
 from bs4 import BeautifulSoup
-from langchain_core.tools import tool
+from langchain_core.tools import ToolException, tool
 
 
 # Safe expression evaluation helpers
@@ -82,4 +82,5 @@ async def web_page_reader(url: str) -> str:
             lines = [line.strip() for line in text.splitlines() if line.strip()]
             return "\n".join(lines)[:4000]
         except Exception as e:
-            return f"读取网页失败: {e}"
+            # 抛出而不是返回错误文本：失败结果不会被工具结果缓存
+            raise ToolException(f"读取网页失败: {e}") from e
@@ -0,0 +1,137 @@
+"""
+工具结果缓存模块
+
+对幂等工具（搜索、百科、网页读取、计算等）的调用结果按参数缓存，
+避免 Agent 在同一会话或不同用户之间重复发起相同的外部请求。
+
+- 按工具开启缓存并单独设置 TTL（TOOL_CACHE_TTLS 或工具上的 cache_ttl 属性）
+- 参数归一化后作为缓存键
+- 进程内 LRU 为一级缓存，Redis 为可选二级缓存
+- 记录命中/未命中次数（GET /health/cache 查看）
+
+Author: chunlin
+"""
+
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import xxhash
+
+from core.cache import CacheStats, LRUCache, get_redis
+
+logger = logging.getLogger(__name__)
+
+# 默认开启缓存的工具及其 TTL（秒），其余工具默认不缓存
+TOOL_CACHE_TTLS: Dict[str, int] = {
+    "wikipedia": 3600,
+    "duckduckgo_search": 600,
+    "web_page_reader": 300,
+    "calc": 86400,
+}
+
+_MISSING = object()
+
+
+def _normalize(value: Any) -> Any:
+    """参数归一化：去除字符串首尾空白、合并空白、丢弃 None、统一数字类型"""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class ToolResultCache:
+    """工具结果缓存"""
+
+    def __init__(self, max_entries: int = 2048, key_prefix: str = "tool_cache:"):
+        self.key_prefix = key_prefix
+        self.local = LRUCache(max_entries=max_entries)
+        self.stats = CacheStats()
+
+    @staticmethod
+    def ttl_for(tool: Any) -> int:
+        """获取工具的缓存 TTL，0 表示不缓存"""
+        ttl = getattr(tool, "cache_ttl", None)
+        if ttl is not None:
+            return int(ttl)
+        if getattr(tool, "mcp_server_url", None):
+            # MCP 工具需在服务器配置中显式开启
+            return 0
+        return TOOL_CACHE_TTLS.get(getattr(tool, "name", ""), 0)
+
+    def make_key(self, tool: Any, args: Any) -> str:
+        # MCP 工具按服务器地址区分（显示名称可能重复），内置工具共用命名空间
+        namespace = getattr(tool, "mcp_server_url", None) or "builtin"
+        payload = json.dumps(
+            [namespace, getattr(tool, "name", ""), _normalize(args)],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return self.key_prefix + xxhash.xxh3_128_hexdigest(payload.encode("utf-8"))
+
+    async def invoke(
+        self,
+        tool: Any,
+        args: Any,
+        call: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        带缓存的工具调用
+
+        Args:
+            tool: 工具对象
+            args: 调用参数
+            call: 实际执行调用的协程工厂，异常会原样抛出且不写入缓存
+        """
+        ttl = self.ttl_for(tool)
+        if ttl <= 0:
+            return await call()
+
+        key = self.make_key(tool, args)
+
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats.hits += 1
+            return value
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(key)
+                if raw is not None:
+                    value = json.loads(raw)
+                    self.local.set(key, value, ttl)
+                    self.stats.redis_hits += 1
+                    return value
+            except Exception as e:
+                logger.warning(f"读取工具缓存失败: {e}")
+
+        self.stats.misses += 1
+        value = await call()
+
+        self.local.set(key, value, ttl)
+        if redis is not None:
+            try:
+                await redis.set(key, json.dumps(value, ensure_ascii=False, default=str), ex=ttl)
+            except Exception as e:
+                logger.warning(f"写入工具缓存失败: {e}")
+
+        return value
+
+
+_tool_cache: Optional[ToolResultCache] = None
+
+
+def get_tool_cache() -> ToolResultCache:
+    """获取全局工具结果缓存（懒加载单例）"""
+    global _tool_cache
+    if _tool_cache is None:
+        _tool_cache = ToolResultCache()
+    return _tool_cache
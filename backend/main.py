@@ -12,6 +12,11 @@ from api.routers.knowledge import router as knowledge_router
 from api.routers.settings import router as settings_router
 from api.routers.mcp import router as mcp_router
 from api.routers.conversations import router as conversations_router
+from core.cache import close_redis
+from core.mcp import close_mcp_pool
+from core.rag.db_conn import close_vector_store_connections
+from core.rag.chunker import shutdown_chunk_executor
+from core.rag.local_inference import shutdown_inference_executor
 from database.connection import close_db, init_db, generate_schema
 
 
@@ -23,6 +28,11 @@ async def lifespan(app: FastAPI):
     app.state.db_ready = True
     yield
     # Shutdown
+    await close_mcp_pool()
+    await close_redis()
+    await close_vector_store_connections()
+    shutdown_inference_executor()
+    shutdown_chunk_executor()
     await close_db()
 
 
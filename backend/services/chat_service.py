@@ -6,15 +6,96 @@
 Author: chunlin
 """
 
+import asyncio
+import logging
+import time
 from typing import AsyncGenerator, Dict, Any, List, Optional
 from uuid import UUID, uuid4
 
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from tortoise.expressions import F
 from tortoise.transactions import in_transaction
 
+from configs import get_settings
 from core.agent import agent_stream
 from database.models import App, Conversation, Message
 
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """
+    Per-turn write-behind buffer for chat messages.
+
+    Messages are collected in memory and written with a single ``bulk_create``
+    plus one ``message_count`` update. A flush is triggered in the background
+    once ``flush_interval`` seconds have passed since the last one, so the
+    streaming loop never waits on the database; ``close`` writes whatever is
+    left at the end of the turn (including error / disconnect paths).
+    """
+
+    def __init__(self, conversation_id: str, flush_interval: Optional[float] = None):
+        self.conversation_id = conversation_id
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else get_settings().chat_message_flush_interval
+        )
+        self._messages: List[Message] = []
+        self._lock = asyncio.Lock()
+        self._last_flush = time.monotonic()
+        self._pending: Optional[asyncio.Task] = None
+
+    def add(
+        self,
+        role: str,
+        content: str,
+        name: str = None,
+        tool_call_id: str = None,
+        tool_calls: List[Dict[str, Any]] = None,
+        metadata: Dict[str, Any] = None,
+        workflow_run_id: int = None
+    ) -> None:
+        """Queue a message; may schedule a background flush."""
+        self._messages.append(Message(
+            conversation_id=self.conversation_id,
+            role=role,
+            content=content,
+            name=name,
+            tool_call_id=tool_call_id,
+            tool_calls=tool_calls,
+            metadata=metadata or {},
+            workflow_run_id=workflow_run_id
+        ))
+
+        due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due and (self._pending is None or self._pending.done()):
+            self._pending = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Write all queued messages in one transaction."""
+        async with self._lock:
+            batch, self._messages = self._messages, []
+            self._last_flush = time.monotonic()
+            if not batch:
+                return
+            try:
+                async with in_transaction():
+                    await Message.bulk_create(batch)
+                    await Conversation.filter(id=self.conversation_id).update(
+                        message_count=F("message_count") + len(batch)
+                    )
+            except Exception as e:
+                # Keep the batch (in order) for the next flush attempt
+                logger.error(f"Failed to persist {len(batch)} messages for conversation {self.conversation_id}: {e}")
+                self._messages = batch + self._messages
+
+    async def close(self) -> None:
+        """Wait for any background flush and write the remaining messages."""
+        if self._pending is not None:
+            await asyncio.shield(self._pending)
+            self._pending = None
+        await self.flush()
+
 
 class ChatService:
     """Service class for chat functionality."""
@@ -184,7 +265,10 @@ class ChatService:
         mcp_servers: List[Dict[str, Any]] = None,
         model_config: Dict[str, Any] = None,
         knowledge_base_ids: List[int] = None,
-        knowledge_settings: Dict[str, Any] = None
+        knowledge_settings: Dict[str, Any] = None,
+        tool_result_max_chars: Optional[int] = None,
+        tool_context_budget: Optional[int] = None,
+        stable_prompt_prefix: Optional[bool] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Process agent chat with streaming response.
@@ -194,6 +278,10 @@ class ChatService:
         2. Saves user message
         3. Streams agent response
         4. Persists intermediate messages (AI/tool)
+
+        All messages of the turn go through a MessageBuffer and are written
+        in bulk at the end of the turn (or periodically / on error), so
+        persistence never blocks token delivery.
         
         Args:
             conversation_id: Conversation ID
@@ -206,6 +294,10 @@ class ChatService:
             model_config: Optional LLM configuration
             knowledge_base_ids: Optional list of knowledge base IDs for RAG
             knowledge_settings: Optional knowledge retrieval settings
+            tool_result_max_chars: Optional per-result limit for tool output in the prompt
+            tool_context_budget: Optional total budget for tool output in the prompt
+            stable_prompt_prefix: Optional flag to keep the system prompt byte-stable
+                for provider prompt caching
             
         Yields:
             Event dictionaries for streaming response
@@ -215,32 +307,41 @@ class ChatService:
             for key, value in inputs.items():
                 instructions = instructions.replace(f"{{{{{key}}}}}", str(value))
         
+        buffer = MessageBuffer(conversation_id)
+
         # 1. Save user message
-        await ChatService.save_message(conversation_id, "user", user_input)
+        buffer.add("user", user_input)
         
         # 2. Create user message for agent
         user_msg = HumanMessage(content=user_input)
         
         # 3. Stream agent response
-        async for item in agent_stream(
-            system_prompt=instructions,
-            messages=history + [user_msg],
-            enabled_tools=enabled_tools,
-            mcp_servers=mcp_servers,
-            llm_config=model_config,
-            knowledge_base_ids=knowledge_base_ids,
-            knowledge_settings=knowledge_settings
-        ):
-            if item["type"] == "message":
-                # Persist intermediate messages (AI thinking or tool execution)
-                await ChatService.save_message(
-                    conversation_id=conversation_id,
-                    role=item["role"],
-                    content=item["content"],
-                    name=item.get("name"),
-                    tool_call_id=item.get("tool_call_id"),
-                    tool_calls=item.get("tool_calls")
-                )
-                continue  # Persistence-only packet, don't send to frontend
-
-            yield item
+        try:
+            async for item in agent_stream(
+                system_prompt=instructions,
+                messages=history + [user_msg],
+                enabled_tools=enabled_tools,
+                mcp_servers=mcp_servers,
+                llm_config=model_config,
+                knowledge_base_ids=knowledge_base_ids,
+                knowledge_settings=knowledge_settings,
+                tool_result_max_chars=tool_result_max_chars,
+                tool_context_budget=tool_context_budget,
+                stable_prompt_prefix=stable_prompt_prefix
+            ):
+                if item["type"] == "message":
+                    # Persist intermediate messages (AI thinking or tool execution)
+                    buffer.add(
+                        role=item["role"],
+                        content=item["content"],
+                        name=item.get("name"),
+                        tool_call_id=item.get("tool_call_id"),
+                        tool_calls=item.get("tool_calls"),
+                        metadata=item.get("metadata")
+                    )
+                    continue  # Persistence-only packet, don't send to frontend
+
+                yield item
+        finally:
+            # 4. Flush buffered messages (end of turn, error or client disconnect)
+            await buffer.close()
@@ -10,7 +10,7 @@ from celery import Celery
 from celery.signals import worker_process_init, worker_process_shutdown
 import asyncio
 from configs import get_settings
-from core.rag.db_conn import get_weaviate_client, close_weaviate_client
+from core.rag.db_conn import get_vector_store, close_weaviate_client
 
 # 获取配置
 settings = get_settings()
@@ -20,7 +20,7 @@ celery_app = Celery(
     "llmops",
     broker=settings.redis_url,
     backend=settings.redis_url,
-    include=["tasks.indexing"]
+    include=["tasks.indexing", "tasks.tenants"]
 )
 
 # 配置
@@ -34,6 +34,15 @@ celery_app.conf.update(
     result_expires=3600,  # 结果过期时间 1 小时
 )
 
+# 定时任务（需要运行 celery beat）
+if settings.weaviate_multi_tenancy:
+    celery_app.conf.beat_schedule = {
+        "offload-idle-tenants": {
+            "task": "offload_idle_tenants",
+            "schedule": settings.weaviate_tenant_offload_interval,
+        },
+    }
+
 # ============================================================
 # 全局资源管理 (Database + Weaviate)
 # ============================================================
@@ -45,12 +54,12 @@ def init_worker_resources(**kwargs):
     """
     print(f"[Celery Worker] Initializing resources for PID: {kwargs.get('pid')}")
 
-    # Weaviate 是单例且跨 Loop 安全（通常），可以全局初始化
+    # 向量存储（Weaviate 或本地存储）是单例且跨 Loop 安全（通常），可以全局初始化
     try:
-        get_weaviate_client()
-        print("[Celery Worker] Weaviate connection initialized.")
+        get_vector_store()
+        print("[Celery Worker] Vector store initialized.")
     except Exception as e:
-        print(f"[Celery Worker] Weaviate init failed: {e}")
+        print(f"[Celery Worker] Vector store init failed: {e}")
 
 
 @worker_process_shutdown.connect
@@ -3,16 +3,71 @@
 
 将文档分块、向量化、存储到向量数据库。
 
+向量按批写入，直接带上文档当前的 enabled / archived 状态；
+任一批失败则删除该文档已写入的分段与向量，不会留下只索引了一部分的文档。
+
 Author: chunlin
 """
+import logging
+import os
+
 from .celery_app import celery_app
 from celery import states
 from configs import get_settings
-from core.rag.db_conn import get_weaviate_client
+from core.rag.db_conn import get_vector_store, close_vector_store_connections, kb_collection_name
+from core.rag.retrieval_cache import bump_index_version
+from core.cache import close_redis
 from core.utils import run_async
 
+logger = logging.getLogger(__name__)
+
+
+def _batched(iterable, size: int):
+    """将迭代器按 size 分批"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _SourceReader:
+    """按窗口读取文档来源（上传文件或内容字符串），统计已读取量用于进度和字数"""
+
+    def __init__(self, file_path: str = None, content: str = None, block_size: int = 1_000_000):
+        self.file_path = file_path
+        self.content = content or ""
+        self.block_size = block_size
+        self.total_bytes = os.path.getsize(file_path) if file_path else len(self.content.encode("utf-8"))
+        self.read_bytes = 0
+        self.chars = 0
+
+    def __iter__(self):
+        if not self.file_path:
+            self.chars = len(self.content)
+            self.read_bytes = self.total_bytes
+            yield self.content
+            return
+        with open(self.file_path, encoding="utf-8") as f:
+            while True:
+                block = f.read(self.block_size)
+                if not block:
+                    break
+                self.chars += len(block)
+                self.read_bytes += len(block.encode("utf-8"))
+                yield block
 
-async def update_document_status(document_id: int, status: str, segment_count: int = 0, error_message: str = None):
+
+async def update_document_status(
+    document_id: int,
+    status: str,
+    segment_count: int = 0,
+    error_message: str = None,
+    word_count: int = 0
+):
     """更新文档状态"""
     from database.models import Document
     doc = await Document.get_or_none(id=document_id)
@@ -20,11 +75,25 @@ async def update_document_status(document_id: int, status: str, segment_count: i
         doc.status = status
         if segment_count > 0:
             doc.segment_count = segment_count
+        if word_count > 0:
+            doc.word_count = word_count
         if error_message:
             doc.error_message = error_message
         await doc.save()
 
 
+async def _discard_partial_index(document_id: int, knowledge_base_id: int):
+    """删除索引失败的文档已写入的分段和向量（失败只记录日志）"""
+    from database.models import KnowledgeBase, DocumentSegment
+    try:
+        kb = await KnowledgeBase.get_or_none(id=knowledge_base_id)
+        collection_name = kb_collection_name(kb) if kb else f"kb_{knowledge_base_id}"
+        await get_vector_store().delete_documents(collection_name, {"doc_id": str(document_id)})
+        await DocumentSegment.filter(document_id=document_id).delete()
+    except Exception as e:
+        logger.warning(f"清理文档 {document_id} 的部分索引失败: {e}")
+
+
 @celery_app.task(bind=True, name="index_document")
 def index_document_task(
     self,
@@ -35,7 +104,8 @@ def index_document_task(
     chunk_size: int = 500,
     chunk_overlap: int = 50,
     embedding_provider: str = "openai",
-    embedding_model: str = None
+    embedding_model: str = None,
+    file_path: str = None
 ):
     """
     文档索引任务
@@ -43,19 +113,22 @@ def index_document_task(
     Args:
         document_id: 文档 ID
         knowledge_base_id: 知识库 ID
-        content: 文档内容
+        content: 文档内容（未提供 file_path 时使用）
         filename: 文件名
         chunk_size: 分块大小
         chunk_overlap: 分块重叠
         embedding_provider: 向量化提供商
         embedding_model: 向量化模型
+        file_path: 上传文件路径，按窗口流式读取分块
     """
+    settings = get_settings()
     # 更新任务状态
     self.update_state(state="CHUNKING", meta={"progress": 10, "stage": "分块中..."})
 
     # 导入模块（在任务中导入，避免循环依赖）
     from core.rag.chunker import DocumentChunker
     from core.rag.embedding import EmbeddingService
+    from core.rag.tokenizer import get_token_counter
     from core.rag.weaviate_client import WeaviateClient
 
     # ... imports
@@ -68,23 +141,12 @@ def index_document_task(
         await init_db()
         
         try:
-            # 1. 分块
-            chunker = DocumentChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            segments = chunker.chunk_document(
-                content=content,
-                metadata={"doc_id": str(document_id), "doc_name": filename}
-            )
+            # 1. 获取 Provider 凭证，准备向量化服务与 Collection
+            from database.models import ModelProvider, KnowledgeBase, Document, DocumentSegment
 
-            self.update_state(state="EMBEDDING", meta={
-                "progress": 30,
-                "stage": "向量化中...",
-                "total_chunks": len(segments)
-            })
+            kb = await KnowledgeBase.get_or_none(id=knowledge_base_id)
+            indexing_config = (kb.indexing_config if kb else None) or {}
 
-            # 2. 向量化
-            # 获取 Provider 凭证
-            from database.models import ModelProvider
-            
             api_key = None
             api_base = None
             
@@ -98,57 +160,77 @@ def index_document_task(
                 provider=embedding_provider,
                 model=embedding_model,
                 api_key=api_key,
-                api_base=api_base
+                api_base=api_base,
+                dimensions=indexing_config.get("dimensions")
             )
 
-            texts = [seg.content for seg in segments]
-            vectors = await embedding.embed_documents(texts)
-
-            self.update_state(state="INDEXING", meta={
-                "progress": 70,
-                "stage": "存储到数据库...",
-                "total_chunks": len(segments)
-            })
-
-            # 3. 保存片段到数据库 (先保存以获取 ID)
-            from database.models import DocumentSegment
-            
-            db_segments = []
-            for seg in segments:
-                db_seg = await DocumentSegment.create(
-                    document_id=document_id,
-                    content=seg.content,
-                    position=seg.position,
-                    tokens=seg.tokens,
-                    hit_count=0,
-                    enabled=True
-                )
-                db_segments.append(db_seg)
-
-            # 4. 存储到 Weaviate
-            weaviate = get_weaviate_client()
-            collection_name = f"kb_{knowledge_base_id}"
+            weaviate = get_vector_store()
+            collection_name = kb_collection_name(kb) if kb else f"kb_{knowledge_base_id}"
             
             # 确保 collection 存在并更新 Schema
-            await weaviate.create_collection(collection_name)
-
-            documents_to_add = []
-            # 使用 db_segments 匹配真实 ID
-            for i, seg in enumerate(segments):
-                documents_to_add.append({
-                    "content": seg.content,
-                    "doc_id": str(document_id),
-                    "doc_name": filename,
-                    "chunk_index": seg.position,
-                    "segment_id": db_segments[i].id, # Use REAL DB ID
-                    "knowledge_base_id": str(knowledge_base_id),
-                    "source": filename,
-                    "enabled": True,
-                    "archived": False,
-                })
+            await weaviate.create_collection(collection_name, indexing_config)
+
+            # 2. 流式分块，按批向量化、保存片段（获取 ID）、写入向量存储
+            # 分块惰性产出，内存中只保留一批分块及其向量
+            chunker = DocumentChunker(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                token_counter=get_token_counter(embedding_provider, embedding_model)
+            )
+            reader = _SourceReader(file_path, content, settings.chunker_section_size)
+            segments = chunker.iter_chunks(
+                reader,
+                metadata={"doc_id": str(document_id), "doc_name": filename}
+            )
+
+            segment_count = 0
+            token_count = 0
+            for batch in _batched(segments, settings.indexing_batch_size):
+                vectors = await embedding.embed_documents([seg.content for seg in batch])
+
+                # 每批读取文档当前状态（索引期间可能被禁用或归档，已写入的批次由状态同步接口更新）
+                doc = await Document.get_or_none(id=document_id)
+                archived = bool(doc and doc.archived)
+                enabled = bool(doc is None or doc.enabled) and not archived
 
-            # Do NOT close weaviate here, it is a global singleton!
-            await weaviate.add_documents(collection_name, documents_to_add, vectors)
+                db_segments = []
+                for seg in batch:
+                    db_seg = await DocumentSegment.create(
+                        document_id=document_id,
+                        content=seg.content,
+                        position=seg.position,
+                        tokens=seg.tokens,
+                        hit_count=0,
+                        enabled=True
+                    )
+                    db_segments.append(db_seg)
+
+                documents_to_add = []
+                # 使用 db_segments 匹配真实 ID
+                for seg, db_seg in zip(batch, db_segments):
+                    documents_to_add.append({
+                        "content": seg.content,
+                        "doc_id": str(document_id),
+                        "doc_name": filename,
+                        "chunk_index": seg.position,
+                        "segment_id": db_seg.id, # Use REAL DB ID
+                        "knowledge_base_id": str(knowledge_base_id),
+                        "source": filename,
+                        "enabled": enabled,
+                        "archived": archived,
+                    })
+
+                # Do NOT close weaviate here, it is a global singleton!
+                await weaviate.add_documents(collection_name, documents_to_add, vectors)
+
+                segment_count += len(batch)
+                token_count += sum(seg.tokens for seg in batch)
+                # 总分块数事先未知，按已读取的字节数估算进度
+                self.update_state(state="INDEXING", meta={
+                    "progress": 10 + int(80 * min(1.0, reader.read_bytes / max(reader.total_bytes, 1))),
+                    "stage": "向量化并存储中...",
+                    "total_chunks": segment_count
+                })
 
             self.update_state(state="SAVING", meta={
                 "progress": 90,
@@ -159,17 +241,20 @@ def index_document_task(
             await update_document_status(
                 document_id=document_id,
                 status="completed",
-                segment_count=len(segments)
+                segment_count=segment_count,
+                word_count=reader.chars
             )
 
             return {
                 "status": "success",
                 "document_id": document_id,
-                "segments": len(segments),
-                "tokens": sum(seg.tokens for seg in segments)
+                "segments": segment_count,
+                "tokens": token_count
             }
 
         except Exception as e:
+            # 清理已写入的部分分段与向量
+            await _discard_partial_index(document_id, knowledge_base_id)
             # 更新文档状态为失败
             await update_document_status(
                 document_id=document_id,
@@ -181,8 +266,13 @@ def index_document_task(
             })
             raise e
         finally:
+            # 无论成功与否都可能已写入部分向量，使该知识库的检索缓存失效
+            await bump_index_version(knowledge_base_id)
             # 必须关闭数据库连接，释放资源
             await close_db()
+            # 向量存储与 Redis 连接绑定本任务的事件循环，随任务关闭
+            await close_vector_store_connections()
+            await close_redis()
 
     # Run the entire async logic in one loop
     return run_async(index_document_async())
@@ -0,0 +1,45 @@
+"""
+Weaviate 租户维护任务
+
+WEAVIATE_MULTI_TENANCY 开启时由 Celery Beat 定期执行：将超过
+WEAVIATE_TENANT_IDLE_HOURS 未被访问的知识库租户转为 OFFLOADED（对象存储）
+或 INACTIVE（本地磁盘），释放内存。再次访问时由 WeaviateClient 自动激活。
+
+Author: chunlin
+"""
+from .celery_app import celery_app
+from configs import get_settings
+from core.rag.db_conn import get_vector_store, close_vector_store_connections
+from core.cache import close_redis
+from core.utils import run_async
+
+
+@celery_app.task(name="offload_idle_tenants")
+def offload_idle_tenants_task():
+    """卸载闲置租户，返回状态被修改的租户数量"""
+    from weaviate.classes.tenants import TenantActivityStatus
+    from core.rag.weaviate_client import WeaviateClient
+
+    settings = get_settings()
+    store = get_vector_store()
+    if not settings.weaviate_multi_tenancy or not isinstance(store, WeaviateClient):
+        return 0
+
+    status = (
+        TenantActivityStatus.INACTIVE
+        if settings.weaviate_tenant_idle_status == "inactive"
+        else TenantActivityStatus.OFFLOADED
+    )
+
+    async def offload_async():
+        try:
+            return await store.offload_idle_tenants(
+                idle_seconds=settings.weaviate_tenant_idle_hours * 3600,
+                status=status
+            )
+        finally:
+            # 连接绑定本任务的事件循环，随任务关闭
+            await close_vector_store_connections()
+            await close_redis()
+
+    return run_async(offload_async())